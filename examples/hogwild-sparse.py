@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compare hogwild training with serial SGD for a model with sparse inputs.
+
+This example creates a regression problem with sparse, high-dimensional inputs
+(like bag-of-words features), where each example only touches a few rows of
+the first weight matrix. It first measures training throughput using the
+hogwild trainer with an increasing number of worker processes, up to the
+number of CPUs, and then compares the validation loss after a fixed number of
+training passes with the loss reached by the serial SGD trainer.
+'''
+
+import climate
+import logging
+import multiprocessing
+import numpy as np
+import scipy.sparse
+import theanets
+import time
+
+climate.enable_default_logging()
+
+NUM_FEATURES = 2000
+NUM_EXAMPLES = 20000
+DENSITY = 0.005
+ITERATIONS = 10
+
+rng = np.random.RandomState(13)
+
+
+def dataset(n):
+    # theano's sparse matrices hold float64 values.
+    x = scipy.sparse.random(n, NUM_FEATURES, DENSITY, 'csr', random_state=rng)
+    y = np.tanh(x.dot(weights)).astype('f')
+    return [x, y]
+
+weights = rng.randn(NUM_FEATURES, 10) / np.sqrt(NUM_FEATURES * DENSITY)
+train = dataset(NUM_EXAMPLES)
+valid = dataset(NUM_EXAMPLES // 10)
+
+
+def run(workers=None):
+    net = theanets.Regressor([
+        dict(size=NUM_FEATURES, sparse='csr'), (100, 'tanh'), 10], rng=3)
+    if workers is None:
+        kwargs = dict(algo='sgd')
+    else:
+        kwargs = dict(algo='hogwild', workers=workers)
+    start = time.time()
+    for i, (tm, vm) in enumerate(net.itertrain(
+            train, valid, batch_size=16, learning_rate=0.2,
+            validate_every=ITERATIONS, **kwargs)):
+        if i + 1 == ITERATIONS:
+            break
+    elapsed = time.time() - start
+    return NUM_EXAMPLES * ITERATIONS / elapsed, net.score(*valid)
+
+
+workers = 1
+while workers <= multiprocessing.cpu_count():
+    rate, r2 = run(workers)
+    logging.info('hogwild, %d workers: %.0f examples/s, validation R^2 %.4f',
+                 workers, rate, r2)
+    workers *= 2
+
+rate, r2 = run()
+logging.info('serial sgd: %.0f examples/s, validation R^2 %.4f', rate, r2)
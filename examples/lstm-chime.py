@@ -42,51 +42,20 @@ if not os.path.isfile(TRAIN_NC) or not os.path.isfile(VALID_NC):
     z.close()
 
 
-def batch_at(features, labels, seq_begins, seq_lengths):
-    '''Extract a single batch of data to pass to the model being trained.
-
-    Parameters
-    ----------
-    features, labels : ndarray
-        Arrays of the input features and target labels.
-    seq_begins : ndarray
-        Array of the start offsets of the speech segments to include.
-    seq_lengths : ndarray
-        Array of the lengths of the speech segments to include in the batch.
-
-    Returns
-    -------
-    features, labels, mask : ndarrays
-        A triple of arrays for training a network. The first element contains
-        input features, the second contains target labels, and the third
-        contains a "mask" consisting of ones where there is valid data and zeros
-        everywhere else.
-    '''
-    length = seq_lengths.max()
-    feat = np.zeros((BATCH_SIZE, length, features.shape[-1]), 'f')
-    labl = np.zeros((BATCH_SIZE, length), 'i')
-    mask = np.zeros((BATCH_SIZE, length), 'f')
-    for b, (begin, length) in enumerate(zip(seq_begins, seq_lengths)):
-        feat[b, :length] = features[begin:begin+length]
-        labl[b, :length] = labels[begin:begin+length]
-        mask[b, :length] = 1
-    return [feat, labl, mask]
-
-
 def batches(dataset):
-    '''Returns a callable that chooses sequences from netcdf data.'''
-    seq_lengths = dataset.variables['seqLengths'].data
-    seq_begins = np.concatenate(([0], np.cumsum(seq_lengths)[:-1]))
+    '''Returns a callable that chooses sequences from netcdf data.
 
-    def sample():
-        chosen = np.random.choice(
-            list(range(len(seq_lengths))), BATCH_SIZE, replace=False)
-        return batch_at(dataset.variables['inputs'].data,
-                        dataset.variables['targetClasses'].data,
-                        seq_begins[chosen],
-                        seq_lengths[chosen])
-
-    return sample
+    Sequences are grouped into buckets of similar length, and each batch is
+    drawn from one bucket, so that little of each batch is spent on padding.
+    Each batch contains input features, target labels, and a "mask" consisting
+    of ones where there is valid data and zeros everywhere else.
+    '''
+    seq_lengths = dataset.variables['seqLengths'].data
+    splits = np.cumsum(seq_lengths)[:-1]
+    return theanets.recurrent.bucketed_batches(
+        [np.split(dataset.variables['inputs'].data.astype('f'), splits),
+         np.split(dataset.variables['targetClasses'].data.astype('i'), splits)],
+        batch_size=BATCH_SIZE)
 
 
 # Now that we can load data, we construct a recurrent classifier model and then
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compare the latency of Theano and NumPy inference for small batches.
+
+This example builds a small feedforward regressor and a small recurrent
+regressor, exports each one to a NumPy :class:`theanets.inference.Executor`,
+and then times predictions from both engines at several (small) batch sizes.
+For small models and batches, the fixed per-call overhead of a compiled Theano
+function tends to dominate the cost of a prediction.
+'''
+
+import climate
+import logging
+import numpy as np
+import theanets
+import timeit
+
+climate.enable_default_logging()
+
+REPEATS = 200
+
+
+def benchmark(name, net, shape):
+    exe = theanets.inference.export(net)
+    for batch_size in (1, 8, 64):
+        x = np.random.randn(batch_size, *shape).astype('f')
+        assert np.allclose(net.predict(x), exe.predict(x), atol=1e-4)
+        theano = min(timeit.repeat(
+            lambda: net.predict(x), number=REPEATS, repeat=3)) / REPEATS
+        numpy = min(timeit.repeat(
+            lambda: exe.predict(x), number=REPEATS, repeat=3)) / REPEATS
+        logging.info('%s batch %d: theano %.1fus, numpy %.1fus (%.1fx)',
+                     name, batch_size, 1e6 * theano, 1e6 * numpy,
+                     theano / numpy)
+
+
+benchmark('feedforward',
+          theanets.Regressor([64, 128, 128, 10]),
+          (64, ))
+
+benchmark('recurrent',
+          theanets.recurrent.Regressor([16, (32, 'lstm'), (32, 'gru'), 4]),
+          (20, 16))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compare the speed of recurrent batch sampling implementations.
+
+This example times :func:`theanets.recurrent.batches`, which gathers each
+batch from a strided view of all windows in the data, against the previous
+implementation, which copied each window into the batch using a Python loop.
+'''
+
+import climate
+import logging
+import numpy as np
+import theanets
+import timeit
+
+climate.enable_default_logging()
+
+BATCH_SIZE = 256
+STEPS = 500
+REPEATS = 20
+
+inputs = np.random.randn(100000, 32).astype('f')
+outputs = np.random.randn(100000, 8).astype('f')
+
+
+def loop_batches(arrays, steps=100, batch_size=64, rng=None):
+    rng = np.random.RandomState(rng)
+
+    def sample():
+        xs = [np.zeros((batch_size, steps, a.shape[1]), a.dtype) for a in arrays]
+        for i in range(batch_size):
+            j = rng.randint(len(arrays[0]) - steps)
+            for x, a in zip(xs, arrays):
+                x[i] = a[j:j+steps]
+        return xs
+
+    return sample
+
+
+for name, sample in (
+        ('loop', loop_batches([inputs, outputs], STEPS, BATCH_SIZE)),
+        ('strided', theanets.recurrent.batches([inputs, outputs], STEPS, BATCH_SIZE)),
+):
+    elapsed = min(timeit.repeat(sample, number=REPEATS, repeat=3)) / REPEATS
+    logging.info('%s: %.2fms per batch', name, 1000 * elapsed)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Compare the speed of unrolled and plain recurrent loops.
+
+This example builds small recurrent regressors with a fixed number of time
+steps and times the forward pass and the gradient computation of each one
+with a plain scan loop, with a loop that computes four time steps per
+iteration, and with the loop fully unrolled. For short sequences and small
+layers, the per-iteration overhead of the loop tends to dominate.
+'''
+
+import climate
+import logging
+import numpy as np
+import theano
+import theanets
+import timeit
+
+climate.enable_default_logging()
+
+BATCH_SIZE = 16
+NUM_INPUTS = 16
+NUM_HIDDEN = 32
+REPEATS = 20
+
+
+def timer(net, x, y):
+    grad = theano.function(
+        net.variables, theano.grad(net.loss(), net.params),
+        updates=net.updates(), on_unused_input='ignore')
+    net.predict(x)
+    grad(x, y)
+
+    def run(f, *args):
+        return min(timeit.repeat(lambda: f(*args), number=REPEATS, repeat=3)) / REPEATS
+
+    return run(net.predict, x), run(grad, x, y)
+
+
+for steps in (8, 32):
+    x = np.random.randn(BATCH_SIZE, steps, NUM_INPUTS).astype('f')
+    y = np.random.randn(BATCH_SIZE, steps, 1).astype('f')
+    for form in ('rnn', 'gru', 'lstm', 'mut1', 'scrn'):
+        results = []
+        for unroll in (None, 4, True):
+            net = theanets.recurrent.Regressor([
+                (steps, NUM_INPUTS),
+                dict(size=NUM_HIDDEN, form=form, unroll=unroll),
+                1])
+            results.append(timer(net, x, y))
+        (fw, bw), (fw4, bw4), (fwu, bwu) = results
+        logging.info('%s T=%d forward: scan %.0fus, unroll=4 %.0fus (%.1fx), '
+                     'unroll=True %.0fus (%.1fx)', form, steps, 1e6 * fw,
+                     1e6 * fw4, fw / fw4, 1e6 * fwu, fw / fwu)
+        logging.info('%s T=%d gradient: scan %.0fus, unroll=4 %.0fus (%.1fx), '
+                     'unroll=True %.0fus (%.1fx)', form, steps, 1e6 * bw,
+                     1e6 * bw4, bw / bw4, 1e6 * bwu, bw / bwu)
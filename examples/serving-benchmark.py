@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''Measure latency and throughput of batched inference with many clients.
+
+This example starts a :class:`theanets.serving.Server` for a small regression
+model, then runs a local load generator: a number of client threads that each
+submit single examples as fast as they can. For each level of concurrency we
+report the throughput and the median (p50) and tail (p99) request latency, and
+compare against clients that call ``predict`` directly for every request.
+'''
+
+import climate
+import logging
+import numpy as np
+import theanets
+import threading
+import time
+
+climate.enable_default_logging()
+
+REQUESTS = 200  # Number of requests submitted by each client.
+
+net = theanets.Regressor([64, 256, 256, 10])
+data = np.random.randn(REQUESTS, 64).astype('f')
+
+
+def load(name, predict, clients):
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        times = []
+        for x in data:
+            start = time.time()
+            predict(x)
+            times.append(time.time() - start)
+        with lock:
+            latencies.extend(times)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.time()
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    elapsed = time.time() - start
+    p50, p99 = 1000 * np.percentile(latencies, [50, 99])
+    logging.info('%s, %d clients: %.0f requests/s, p50 %.2fms, p99 %.2fms',
+                 name, clients, len(latencies) / elapsed, p50, p99)
+
+
+lock = threading.Lock()
+
+
+def direct(x):
+    with lock:  # compiled theano functions are not safe to call concurrently.
+        return net.predict(x[None])[0]
+
+
+with theanets.serving.Server(net, max_batch_size=64, max_latency=0.002) as server:
+    for clients in (1, 4, 16, 64):
+        load('direct', direct, clients)
+        load('server', server.predict, clients)
+    logging.info('server computed %d requests in %d batches',
+                 server.num_requests, server.num_batches)
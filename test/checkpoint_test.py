@@ -0,0 +1,76 @@
+import numpy as np
+import os
+import pytest
+import theanets
+
+import util as u
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_deltas(tmpdir, background):
+    net = theanets.Regressor(u.REG_LAYERS)
+    pattern = os.path.join(str(tmpdir), 'model-{}.pkl')
+    save = theanets.checkpoint.Checkpointer(
+        net, pattern, background=background, deltas=2)
+    expected = {}
+    for t in range(4):
+        w = net.find('hid1', 'w')
+        w.set_value(w.get_value() + 0.01)
+        save(now=t)
+        save.close()
+        expected[t] = [p.get_value() for p in net.params]
+    assert not theanets.checkpoint.is_delta_file(pattern.format(0))
+    assert theanets.checkpoint.is_delta_file(pattern.format(1))
+    assert theanets.checkpoint.is_delta_file(pattern.format(2))
+    assert not theanets.checkpoint.is_delta_file(pattern.format(3))
+    for t, values in expected.items():
+        loaded = theanets.Network.load(pattern.format(t))
+        for p, v in zip(loaded.params, values):
+            assert np.array_equal(p.get_value(), v)
+
+
+def test_lossy_deltas(tmpdir):
+    net = theanets.Regressor(u.REG_LAYERS)
+    pattern = os.path.join(str(tmpdir), 'model-{}.pkl')
+    save = theanets.checkpoint.Checkpointer(
+        net, pattern, deltas=1, tolerance=1e-3)
+    save(now=0)
+    w = net.find('hid1', 'w')
+    value = w.get_value()
+    change = np.zeros_like(value)
+    change[0] = np.linspace(-0.1, 0.1, len(change[0]))
+    w.set_value(value + change)
+    save(now=1)
+    assert theanets.checkpoint.is_delta_file(pattern.format(1))
+    loaded = theanets.Network.load(pattern.format(1))
+    for p, q in zip(loaded.params, net.params):
+        assert np.allclose(p.get_value(), q.get_value(), rtol=0, atol=1.001e-3)
+    # values that did not change are replayed exactly.
+    assert np.array_equal(loaded.find('hid1', 'w').get_value()[1:], value[1:])
+    i = [p.name for p in net.params].index(w.name)
+    with np.load(pattern.format(1)) as data:
+        assert 0 < len(data['q{}'.format(i)]) <= len(change[0])
+        assert all(len(data['q{}'.format(j)]) == 0
+                   for j in range(len(net.params)) if j != i)
+
+
+def test_keep(tmpdir):
+    net = theanets.Regressor(u.REG_LAYERS)
+    pattern = os.path.join(str(tmpdir), 'model-{}.pkl')
+    save = theanets.checkpoint.Checkpointer(net, pattern, keep=2, deltas=2)
+    for t in range(5):
+        save(now=t)
+    # 3 is a base, so it is still needed by 4; 0 is a base needed by nothing.
+    assert sorted(os.listdir(str(tmpdir))) == ['model-3.pkl', 'model-4.pkl']
+    save = theanets.checkpoint.Checkpointer(net, pattern, keep=2, deltas=3)
+    for t in range(10, 14):
+        save(now=t)
+    assert 'model-10.pkl' in os.listdir(str(tmpdir))
+    assert 'model-11.pkl' not in os.listdir(str(tmpdir))
+
+
+def test_deltas_need_pattern(tmpdir):
+    net = theanets.Regressor(u.REG_LAYERS)
+    with pytest.raises(theanets.util.ConfigurationError):
+        theanets.checkpoint.Checkpointer(
+            net, str(tmpdir.join('model.pkl')), deltas=2)
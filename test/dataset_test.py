@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+import theanets
+import time
+
+import util as u
+
+
+def sampler(seed=13):
+    rng = np.random.RandomState(seed)
+
+    def batch():
+        return [rng.randn(2, 3).astype('f')]
+
+    batch.rng = rng
+    return batch
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_callable(processes):
+    data = theanets.dataset.PrefetchDataset(
+        sampler(), workers=2, processes=processes, iteration_size=20)
+    try:
+        batches = list(data)
+        assert len(batches) == 20
+        assert all(b[0].shape == (2, 3) for b in batches)
+        batches.extend(data)
+        assert len(batches) == 40
+        # workers must not produce copies of the same batches.
+        assert len(set(b[0].tobytes() for b in batches)) == 40
+        stats = data.stats(reset=True)
+        assert stats['batches'] == 40
+        assert 0 <= stats['starved'] <= 40
+        assert data.stats()['batches'] == 0
+    finally:
+        data.close()
+
+
+def test_recurrent_rng():
+    # samplers expose the random state that prefetch processes reseed.
+    rng = np.random.RandomState(3)
+    arrays = [np.zeros((20, 3), 'f')]
+    assert theanets.recurrent.batches(arrays, steps=5, rng=rng).rng is rng
+    data = theanets.dataset.PrefetchDataset(
+        theanets.recurrent.batches([np.arange(100.)[:, None]], steps=5),
+        workers=2, processes=True, iteration_size=20)
+    try:
+        starts = [b[0][0, 0, 0] for b in data]
+    finally:
+        data.close()
+    # with the same random states, pairs of workers would send equal batches.
+    assert len(set(starts)) > 10
+
+
+def test_starved():
+    def slow():
+        time.sleep(0.02)
+        return [u.INPUTS]
+    data = theanets.dataset.PrefetchDataset(slow, iteration_size=3)
+    try:
+        list(data)
+    finally:
+        data.close()
+    stats = data.stats()
+    assert stats['starved'] >= 1
+    assert stats['wait'] > 0
+
+
+def test_error():
+    def fail():
+        raise ValueError('no batches here')
+    data = theanets.dataset.PrefetchDataset(fail)
+    with pytest.raises(ValueError):
+        list(data)
+    data.close()
+
+
+def test_invalid():
+    with pytest.raises(theanets.util.ConfigurationError):
+        theanets.dataset.PrefetchDataset([u.INPUTS])
+    with pytest.raises(theanets.util.ConfigurationError):
+        theanets.dataset.PrefetchDataset(sampler(), workers=0)
+
+
+def test_itertrain():
+    net = theanets.Regressor(u.REG_LAYERS)
+    train = net.itertrain([u.INPUTS, u.OUTPUTS], algo='sgd', batch_size=3,
+                          momentum=0.5, max_gradient_norm=1, prefetch=2)
+    train0, valid0 = next(train)
+    train1, valid1 = next(train)
+    assert train1['loss'] < valid0['loss']
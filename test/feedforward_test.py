@@ -35,6 +35,13 @@ def test_score(Model, layers, target, score):
     assert Model(layers).score(u.INPUTS, target) == score
 
 
+def test_score_chunked():
+    net = theanets.Regressor(u.REG_LAYERS)
+    for w in (None, u.OUTPUT_WEIGHTS):
+        assert np.allclose(net.score(u.INPUTS, u.OUTPUTS, w, max_memory=1000),
+                           net.score(u.INPUTS, u.OUTPUTS, w))
+
+
 @pytest.mark.parametrize('Model, layers, target', [
     (theanets.Regressor, u.REG_LAYERS, u.NUM_OUTPUTS),
     (theanets.Classifier, u.CLF_LAYERS, u.NUM_CLASSES),
@@ -49,6 +56,50 @@ def test_feed_forward(Model, layers, target):
     u.assert_shape(outs['out:out'].shape, target)
 
 
+def test_feed_forward_outputs():
+    net = theanets.Regressor(u.REG_LAYERS)
+    full = net.feed_forward(u.INPUTS)
+    outs = net.feed_forward(u.INPUTS, outputs='hid*:out')
+    assert sorted(outs) == ['hid1:out', 'hid2:out']
+    assert np.allclose(outs['hid2:out'], full['hid2:out'])
+    assert np.allclose(net.predict(u.INPUTS), full['out:out'])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(batch_size=10),
+    dict(max_memory=1000),
+    dict(batch_size=100),
+])
+def test_predict_chunked(kwargs):
+    net = theanets.Regressor(u.REG_LAYERS)
+    full = net.predict(u.INPUTS)
+    assert np.allclose(net.predict(u.INPUTS, **kwargs), full)
+    out = np.zeros_like(full)
+    assert net.predict(u.INPUTS, out=out, **kwargs) is out
+    assert np.allclose(out, full)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(batch_size=10),
+    dict(max_memory=1000),
+])
+def test_predict_empty(kwargs):
+    net = theanets.Regressor(u.REG_LAYERS)
+    empty = u.INPUTS[:0]
+    assert net.predict(empty, **kwargs).shape == (0, u.NUM_OUTPUTS)
+    out = np.zeros((0, u.NUM_OUTPUTS), 'f')
+    assert net.predict(empty, out=out, **kwargs) is out
+
+
+def test_predict_iter():
+    net = theanets.Regressor(u.REG_LAYERS)
+    batches = (u.INPUTS[i:i+10] for i in range(0, u.NUM_EXAMPLES, 10))
+    ys = list(net.predict_iter(batches))
+    assert len(ys) == 7
+    assert np.allclose(np.concatenate(ys), net.predict(u.INPUTS))
+
+
 def test_decode_from_multiple_layers():
     net = theanets.Regressor([u.NUM_INPUTS, u.NUM_HID1, u.NUM_HID2, dict(
         size=u.NUM_OUTPUTS, inputs=('hid2:out', 'hid1:out'))])
@@ -71,10 +122,37 @@ class TestClassifier:
     def test_predict_logit(self, net):
         u.assert_shape(net.predict_logit(u.INPUTS).shape, u.NUM_CLASSES)
 
+    def test_predict_proba_iter(self, net):
+        ps = list(net.predict_proba_iter([u.INPUTS[:10], u.INPUTS[10:]]))
+        assert np.allclose(np.concatenate(ps), net.predict_proba(u.INPUTS))
+
     def test_score(self, net):
         w = 0.5 * np.ones(u.CLASSES.shape, 'f')
         assert 0 <= net.score(u.INPUTS, u.CLASSES, w) <= 1
 
+    @pytest.mark.parametrize('kwargs', [
+        dict(batch_size=10),
+        dict(max_memory=1000),
+    ])
+    def test_predict_chunked(self, net, kwargs):
+        full = net.predict(u.INPUTS)
+        assert np.array_equal(net.predict(u.INPUTS, **kwargs), full)
+        out = np.zeros_like(full)
+        assert net.predict(u.INPUTS, out=out, **kwargs) is out
+        assert np.array_equal(out, full)
+        assert net.predict(u.INPUTS[:0], **kwargs).shape == (0, )
+
+    def test_score_chunked(self, net):
+        w = np.random.rand(*u.CLASSES.shape).astype('f')
+        for v in (None, w):
+            assert np.allclose(net.score(u.INPUTS, u.CLASSES, v, batch_size=10),
+                               net.score(u.INPUTS, u.CLASSES, v))
+
+    def test_score_empty(self, net):
+        assert net.score(u.INPUTS[:0], u.CLASSES[:0]) == 0
+        w = np.zeros(u.CLASSES.shape, 'f')
+        assert net.score(u.INPUTS, u.CLASSES, w) == 0
+
 
 class TestAutoencoder:
     @pytest.fixture
@@ -89,6 +167,10 @@ class TestAutoencoder:
         z = net.encode(u.INPUTS, 'hid2')
         u.assert_shape(z.shape, u.NUM_HID2)
 
+    def test_encode_iter(self, net):
+        zs = list(net.encode_iter([u.INPUTS[:10], u.INPUTS[10:]], layer='hid1'))
+        assert np.allclose(np.concatenate(zs), net.encode(u.INPUTS, 'hid1'))
+
     def test_decode_hid1(self, net):
         x = net.decode(net.encode(u.INPUTS))
         u.assert_shape(x.shape, u.NUM_INPUTS)
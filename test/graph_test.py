@@ -1,7 +1,11 @@
+import io
+import itertools
 import numpy as np
 import os
+import pickle
 import pytest
 import theanets
+import threading
 
 try:
     from itertools import izip as zip
@@ -190,3 +194,143 @@ def test_save_every(tmpdir):
             assert not p.check()
         if p.check():
             p.remove()
+
+
+class Clock(object):
+    def __init__(self, ticks):
+        self.ticks = ticks
+
+    def time(self):
+        return float(next(self.ticks))
+
+
+def test_save_async(tmpdir, monkeypatch):
+    # a fake clock that advances by two seconds whenever it is read, so that
+    # each checkpoint gets a different timestamp without waiting.
+    clock = itertools.count(1000, 2)
+    monkeypatch.setattr(theanets.graph, 'time', Clock(clock))
+    net = theanets.Autoencoder((u.NUM_INPUTS, (3, 'prelu'), u.NUM_INPUTS))
+    d = tmpdir.mkdir('graph-test')
+    fn = os.path.join(str(d), 'model-{}.pkl')
+    train = net.itertrain([u.INPUTS], save_every=1, save_progress=fn,
+                          save_async=True, save_keep=1)
+    for _ in zip(train, range(4)):
+        pass
+    train.close()
+    assert len(d.listdir()) == 1
+    saved = theanets.Network.load(str(d.listdir()[0]))
+    assert [p.name for p in saved.params] == [p.name for p in net.params]
+
+
+def test_load_stream():
+    net = theanets.Regressor(u.REG_LAYERS)
+    data = pickle.dumps(net, -1)
+    r, w = os.pipe()
+
+    def write():
+        with os.fdopen(w, 'wb') as handle:
+            handle.write(data)
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    with os.fdopen(r, 'rb') as handle:
+        assert not handle.seekable()
+        loaded = theanets.Network.load(handle)
+    writer.join()
+    for a, b in zip(loaded.params, net.params):
+        assert np.allclose(a.get_value(), b.get_value())
+
+
+def test_function_cache(tmpdir):
+    cache = str(tmpdir.mkdir('graph-cache'))
+    net = theanets.Regressor(u.REG_LAYERS)
+    net.predict(u.INPUTS, cache_dir=cache)
+    assert len(os.listdir(cache)) == 1
+    # a network with the same topology, but different parameter values, should
+    # reuse the cached function while computing with its own parameters.
+    other = theanets.Regressor(u.REG_LAYERS, rng=21)
+    expected = theanets.Regressor(u.REG_LAYERS, rng=21).predict(u.INPUTS)
+    assert np.allclose(other.predict(u.INPUTS, cache_dir=cache), expected)
+    assert len(os.listdir(cache)) == 1
+
+
+def test_function_cache_activation(tmpdir):
+    cache = str(tmpdir.mkdir('graph-cache'))
+    layers = [u.NUM_INPUTS, (u.NUM_HID1, 'relu'), u.NUM_OUTPUTS]
+    theanets.Regressor(layers, rng=21).predict(u.INPUTS, cache_dir=cache)
+    # networks that differ only in an activation must not share a function.
+    layers = [u.NUM_INPUTS, (u.NUM_HID1, 'tanh'), u.NUM_OUTPUTS]
+    net = theanets.Regressor(layers, rng=21)
+    expected = theanets.Regressor(layers, rng=21).predict(u.INPUTS)
+    assert np.allclose(net.predict(u.INPUTS, cache_dir=cache), expected)
+    assert len(os.listdir(cache)) == 2
+
+
+def test_function_cache_no_weights(tmpdir):
+    cache = str(tmpdir.mkdir('graph-cache'))
+    net = theanets.Regressor(u.REG_LAYERS)
+    net.predict(u.INPUTS, cache_dir=cache)
+    fn, = os.listdir(cache)
+    with open(os.path.join(cache, fn), 'rb') as handle:
+        _, f = pickle.load(handle)
+    # cached functions hold empty placeholders instead of model parameters.
+    assert f.get_shared()
+    for v in f.get_shared():
+        assert v.get_value().size == 0
+
+
+def test_hash_changes():
+    net = theanets.Regressor(u.REG_LAYERS)
+    key = net._hash()
+    assert net._hash() == key
+    net.set_loss('mae')
+    assert net._hash() != key
+    key = net._hash()
+    net.add_loss('mse', weight=0.5)
+    assert net._hash() != key
+    assert net._hash(regularizers=[]) == net._hash()
+    # losses changed in place also change the key.
+    key = net._hash()
+    net.losses[0].output_name = 'hid1:out'
+    assert net._hash() != key
+
+
+@pytest.mark.parametrize('Model, layers', [
+    (theanets.Regressor, u.REG_LAYERS),
+    (theanets.Classifier, u.CLF_LAYERS),
+    (theanets.Autoencoder, (u.NUM_INPUTS, (3, 'prelu'), (u.NUM_INPUTS, 'tied'))),
+])
+@pytest.mark.parametrize('mmap', [False, True])
+def test_save_load_arrays(tmpdir, Model, layers, mmap):
+    net = Model(layers)
+    fn = str(tmpdir.join('model.tnet'))
+    net.save(fn, format='arrays')
+    loaded = theanets.Network.load(fn, mmap=mmap)
+    assert type(loaded) is Model
+    assert [p.name for p in loaded.params] == [p.name for p in net.params]
+    for a, b in zip(loaded.params, net.params):
+        assert np.allclose(a.get_value(), b.get_value())
+    assert [l.to_spec() for l in loaded.losses] == \
+        [l.to_spec() for l in net.losses]
+    assert np.allclose(loaded.predict(u.INPUTS), net.predict(u.INPUTS))
+
+
+def test_load_arrays_handle(monkeypatch):
+    net = theanets.recurrent.Regressor([
+        u.NUM_INPUTS, dict(size=u.NUM_HID1, form='rnn', radius=1.1),
+        u.NUM_OUTPUTS])
+    handle = io.BytesIO()
+    net.save(handle, format='arrays')
+    handle.seek(0)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('parameters were randomly initialized')
+
+    # parameters must be created from the file, not initialized and replaced.
+    monkeypatch.setattr(theanets.util, 'random_matrix', fail)
+    monkeypatch.setattr(theanets.util, 'random_vector', fail)
+    loaded = theanets.Network.load(handle)
+    for a, b in zip(loaded.params, net.params):
+        value = a.get_value(borrow=True)
+        assert value.flags.writeable
+        assert np.allclose(value, b.get_value())
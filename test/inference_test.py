@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import theanets
+
+import util as u
+
+
+def assert_same(net, x):
+    exe = theanets.inference.export(net)
+    expected = net.feed_forward(x)
+    actual = exe.feed_forward(x)
+    assert sorted(expected) == sorted(actual)
+    for name in expected:
+        assert np.allclose(expected[name], actual[name], rtol=1e-4, atol=1e-5), name
+
+
+@pytest.mark.parametrize('Model, layers', [
+    (theanets.Regressor, u.REG_LAYERS),
+    (theanets.Classifier, u.CLF_LAYERS),
+    (theanets.Autoencoder, u.AE_LAYERS),
+    (theanets.Autoencoder, [u.NUM_INPUTS, (u.NUM_HID1, 'prelu'),
+                            (u.NUM_INPUTS, 'tied', 'elu')]),
+    (theanets.Regressor, [u.NUM_INPUTS, (u.NUM_HID1, 'maxout:3'),
+                          (u.NUM_HID2, 'tanh+norm:z'), u.NUM_OUTPUTS]),
+])
+def test_feedforward(Model, layers):
+    assert_same(Model(layers), u.INPUTS)
+
+
+@pytest.mark.parametrize('form', ['rnn', 'gru', 'lstm'])
+@pytest.mark.parametrize('direction', ['', 'back'])
+def test_recurrent(form, direction):
+    net = theanets.recurrent.Regressor([
+        u.NUM_INPUTS,
+        dict(size=u.NUM_HID1, form=form, direction=direction),
+        dict(size=u.NUM_HID2, form='conv1', filter_size=3),
+        u.NUM_OUTPUTS])
+    assert_same(net, u.RNN.INPUTS)
+
+
+def test_convolution():
+    net = theanets.convolution.Classifier([
+        (u.CNN.NUM_WIDTH, u.CNN.NUM_HEIGHT, u.NUM_INPUTS),
+        dict(size=u.NUM_HID1, form='conv2', filter_size=u.CNN.FILTER_SIZE),
+        dict(size=u.NUM_HID2, form='conv2', filter_size=(2, 2),
+             border_mode='full'),
+        'flat',
+        u.NUM_CLASSES])
+    assert_same(net, u.CNN.INPUTS)
+
+
+def test_save_load(tmpdir):
+    net = theanets.Regressor(u.REG_LAYERS)
+    path = str(tmpdir.join('model.npz'))
+    theanets.inference.export(net).save(path)
+    exe = theanets.inference.Executor.load(path)
+    assert np.allclose(exe.predict(u.INPUTS), net.predict(u.INPUTS), atol=1e-5)
+
+
+def test_unsupported():
+    net = theanets.recurrent.Regressor(
+        [u.NUM_INPUTS, (u.NUM_HID1, 'mrnn'), u.NUM_OUTPUTS])
+    with pytest.raises(ValueError):
+        theanets.inference.export(net)
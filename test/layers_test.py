@@ -132,6 +132,7 @@ class TestRecurrent:
             spec['c_0'] = None
         if form not in ('bidirectional', 'conv1'):
             spec['h_0'] = None
+            spec['mask'] = None
         assert layer.to_spec() == dict(
             form=form, name='l', size=NH, inputs='in',
             activation=layer.kwargs.get('activation', 'relu'), **spec)
@@ -15,6 +15,12 @@ class TestBuild:
         assert callable(l)
         assert len(l.variables) == 2
 
+    def test_mse_masked(self):
+        l = theanets.Loss.build('mse', target=3, mask_name='mask')
+        assert callable(l)
+        assert len(l.variables) == 1
+        assert l.mask_name == 'mask:out'
+
 
 @pytest.mark.parametrize('loss', ['xe', 'hinge'])
 def test_classification(loss):
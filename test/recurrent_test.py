@@ -1,3 +1,4 @@
+import itertools
 import numpy as np
 import pytest
 import theanets
@@ -70,6 +71,87 @@ def test_symbolic_initial_state():
     u.assert_progress(net, [H0, u.RNN.INPUTS, u.RNN.OUTPUTS])
 
 
+def masked_regressor(form, direction=''):
+    net = theanets.recurrent.Regressor([
+        dict(size=u.NUM_INPUTS, form='input', name='in'),
+        dict(form='input', name='mask', shape=(None, )),
+        dict(size=u.NUM_HID1, form=form, direction=direction,
+             inputs='in:out', mask='mask'),
+        u.NUM_OUTPUTS])
+    net.set_loss('mse', mask_name='mask')
+    return net
+
+
+def test_mask_progress():
+    net = masked_regressor('lstm')
+    mask = (np.arange(u.RNN.NUM_TIMES) < 20).astype('f')
+    mask = np.tile(mask, (u.NUM_EXAMPLES, 1))
+    u.assert_progress(net, [u.RNN.INPUTS, mask, u.RNN.OUTPUTS])
+
+
+@pytest.mark.parametrize('form', ['rnn', 'gru', 'lstm'])
+@pytest.mark.parametrize('direction', ['', 'back'])
+def test_mask(form, direction):
+    net = masked_regressor(form, direction)
+    lengths = [31, 20, 9, 1]
+    x = u.RNN.INPUTS[:len(lengths)]
+    mask = np.zeros(x.shape[:2], 'f')
+    for i, n in enumerate(lengths):
+        mask[i, :n] = 1
+    y = net.predict([x, mask])
+    for i, n in enumerate(lengths):
+        expected = net.predict([x[i:i+1, :n], mask[i:i+1, :n]])[0]
+        # backwards layers skip the padding first, and produce outputs in the
+        # order they process the time steps.
+        actual = y[i, -n:] if direction else y[i, :n]
+        assert np.allclose(actual, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('form', ['rnn', 'gru', 'lstm', 'scrn'])
+@pytest.mark.parametrize('direction', ['', 'back'])
+@pytest.mark.parametrize('unroll', [True, 4])
+def test_unroll(form, direction, unroll):
+    def build(**kwargs):
+        return theanets.recurrent.Regressor([
+            (u.RNN.NUM_TIMES, u.NUM_INPUTS),
+            dict(size=u.NUM_HID1, form=form, direction=direction, rng=13,
+                 **kwargs),
+            u.NUM_OUTPUTS], rng=13)
+    expected = build().predict(u.RNN.INPUTS)
+    actual = build(unroll=unroll).predict(u.RNN.INPUTS)
+    assert np.allclose(actual, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize('periods', [(1, 2, 4), (2, 3, 5)])
+def test_clockwork(periods):
+    net = theanets.recurrent.Regressor([
+        u.NUM_INPUTS,
+        dict(size=6, form='clockwork', periods=periods, activation='tanh'),
+        u.NUM_OUTPUTS])
+    xh, hh, b = (net.find('hid1', k).get_value() for k in ('xh', 'hh', 'b'))
+    x = u.RNN.INPUTS[:3]
+    pre = np.zeros((len(x), 6))
+    expected = []
+    for t in range(x.shape[1]):
+        h = np.tanh(pre)
+        for i, T in enumerate(periods):
+            if t % T == 0:
+                cols = slice(2 * i, 2 * i + 2)
+                pre[:, cols] = (np.dot(x[:, t], xh[:, cols]) + b[cols] +
+                                np.dot(h[:, 2 * i:], hh[2 * i:, cols]))
+        expected.append(np.tanh(pre))
+    actual = net.feed_forward(x)['hid1:out']
+    assert np.allclose(actual, np.stack(expected, axis=1), atol=1e-5)
+
+
+def test_unroll_unknown_length():
+    net = theanets.recurrent.Regressor(
+        [u.NUM_INPUTS, dict(size=u.NUM_HID1, form='rnn', unroll=True),
+         u.NUM_OUTPUTS])
+    with pytest.raises(theanets.util.ConfigurationError):
+        net.predict(u.RNN.INPUTS)
+
+
 class TestClassifier:
     @pytest.fixture
     def net(self):
@@ -86,7 +168,53 @@ class TestClassifier:
         assert 0 <= net.score(u.RNN.INPUTS, u.CLASSES, w) <= 1
 
     def test_predict_sequence(self, net):
-        assert list(net.predict_sequence([0, 1, 2], 5, rng=13)) == [4, 5, 1, 3, 1]
+        assert list(net.predict_sequence([0, 1, 2], 5, rng=13)) == [3, 5, 3, 3, 5]
+
+    @pytest.mark.parametrize('form', [
+        'rnn', 'gru', 'lstm', 'mut1', 'scrn',
+        dict(form='clockwork', periods=(1, 2)),
+    ])
+    def test_predict_sequence_steps(self, form):
+        if not isinstance(form, dict):
+            form = dict(form=form)
+        net = theanets.recurrent.Classifier([
+            u.NUM_INPUTS, dict(size=u.NUM_HID1, **form), u.NUM_INPUTS])
+        labels = [0, 1, 2]
+        streams = list(net.predict_sequence(labels, 4, streams=3, rng=13))
+        # recompute the whole prefix at each step, with the same samples.
+        rng = np.random.RandomState(13)
+        prefix = [[c] * 3 for c in labels]
+        for chars in streams:
+            x = np.zeros((3, len(prefix), u.NUM_INPUTS), 'f')
+            for t, cs in enumerate(prefix):
+                x[np.arange(3), t, cs] = 1
+            pdfs = net.predict_proba(x)[:, -1]
+            assert chars == [rng.multinomial(1, p).argmax() for p in pdfs]
+            prefix.append(chars)
+
+    def test_beam_search(self):
+        net = theanets.recurrent.Classifier([3, (u.NUM_HID1, 'lstm'), 3])
+
+        def logp(seq):
+            x = np.zeros((1, 2 + len(seq), 3), 'f')
+            x[0, np.arange(2 + len(seq)), [0, 1] + list(seq)] = 1
+            p = net.predict_proba(x)[0, 1:]
+            return sum(np.log(p[i, c]) for i, c in enumerate(seq))
+
+        # with a beam as large as the search space, the search is exact.
+        expected = sorted(itertools.product(range(3), repeat=3), key=logp)[::-1]
+        seqs, scores = net.beam_search([0, 1], 3, beam_size=27)
+        assert seqs.shape == (27, 3)
+        assert [tuple(s) for s in seqs[:5]] == expected[:5]
+        assert np.allclose(scores[:5], [logp(s) for s in expected[:5]], atol=1e-4)
+
+    def test_beam_search_streams(self, net):
+        seqs, scores = net.beam_search([[0, 1], [2, 3]], 4, beam_size=3)
+        assert seqs.shape == (2, 3, 4)
+        assert scores.shape == (2, 3)
+        assert (np.diff(scores, axis=1) <= 0).all()
+        one, _ = net.beam_search([2, 3], 4, beam_size=3)
+        assert np.array_equal(seqs[1], one)
 
 
 class TestAutoencoder:
@@ -137,6 +265,39 @@ class TestFunctions:
         assert len(f()) == 1
         assert_shape(f()[0].shape, u.NUM_INPUTS)
 
+    def test_batches_windows(self, samples, labels):
+        f = theanets.recurrent.batches(
+            [samples, labels], steps=5, batch_size=4, rng=3)
+        starts = np.random.RandomState(3).randint(len(samples) - 5, size=4)
+        x, y = f()
+        for i, j in enumerate(starts):
+            assert np.array_equal(x[i], samples[j:j+5])
+            assert np.array_equal(y[i], labels[j:j+5])
+
+    def test_bucketed_batches(self):
+        rng = np.random.RandomState(3)
+        lengths = rng.randint(1, 40, size=50)
+        xs = [rng.randn(n, 3).astype('f') for n in lengths]
+        ys = [rng.randint(5, size=n).astype('i') for n in lengths]
+        buckets = np.array_split(np.argsort(lengths, kind='mergesort'), 5)
+        f = theanets.recurrent.bucketed_batches(
+            [xs, ys], batch_size=8, buckets=5, mask=1, rng=3)
+        for _ in range(10):
+            x, m, y = f()
+            assert x.shape[:2] == m.shape == y.shape
+            assert x.dtype == np.float32 and y.dtype == np.int32
+            n = m.sum(axis=1).astype(int)
+            assert n.max() == m.shape[1]
+            chosen = set()
+            for i in range(8):
+                j, = [k for k, v in enumerate(xs)
+                      if len(v) == n[i] and np.array_equal(v, x[i, :n[i]])]
+                assert np.array_equal(y[i, :n[i]], ys[j])
+                assert not x[i, n[i]:].any() and not y[i, n[i]:].any()
+                chosen.add(j)
+            # all sequences in a batch come from the same bucket.
+            assert any(chosen <= set(b) for b in buckets)
+
 
 class TestText:
     TXT = 'hello world, how are you!'
@@ -158,6 +319,11 @@ class TestText:
         assert txt.text == 'hello world, how _re _o_!'
         assert txt.alpha == 'helo wrd,!'
 
+    def test_text_cached(self, txt):
+        assert txt.text is txt.text
+        txt.codes = txt.encode('hello')
+        assert txt.text == 'hello'
+
     def test_encode(self, txt):
         assert txt.encode('hello!') == [1, 2, 3, 3, 4, 10]
         assert txt.encode('you!') == [0, 4, 0, 10]
@@ -172,3 +338,35 @@ class TestText:
         assert b()[0].shape == (5, 8, 1 + len(txt.alpha))
         assert b()[1].shape == (5, 8)
         assert not np.allclose(b()[0], b()[0])
+
+    def test_classifier_batches_content(self, txt):
+        inputs, outputs = txt.classifier_batches(steps=8, batch_size=5, rng=3)()
+        assert (inputs.sum(axis=-1) == 1).all()
+        enc = inputs.argmax(axis=-1)
+        assert (enc[:, 1:] == outputs[:, :-1]).all()
+        for row in enc:
+            assert txt.decode(row) in txt.text
+
+    def test_codes(self, txt):
+        assert txt.codes.dtype == np.uint8
+        assert txt.decode(txt.codes) == txt.text
+
+    def test_save_load(self, txt, tmpdir):
+        path = str(tmpdir.join('text.enc'))
+        txt.save(path)
+        loaded = theanets.recurrent.Text.load(path)
+        assert isinstance(loaded.codes, np.memmap)
+        assert loaded.alpha == txt.alpha
+        assert loaded.text == txt.text
+        assert loaded.encode('hello!') == txt.encode('hello!')
+
+    def test_encode_files(self, tmpdir):
+        paths = [str(tmpdir.join('a.txt')), str(tmpdir.join('b.txt'))]
+        for path, doc in zip(paths, (self.TXT, self.TXT[::-1])):
+            with open(path, 'w') as handle:
+                handle.write(doc)
+        txt = theanets.recurrent.Text.encode_files(
+            paths, str(tmpdir.join('text.enc')), unknown='_', chunk_size=4)
+        expected = theanets.recurrent.Text(self.TXT + self.TXT[::-1], unknown='_')
+        assert txt.alpha == expected.alpha
+        assert np.array_equal(txt.codes, expected.codes)
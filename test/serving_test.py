@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import theanets
+import threading
+
+import util as u
+
+
+@pytest.fixture
+def net():
+    return theanets.Regressor(u.REG_LAYERS)
+
+
+def test_predict(net):
+    results = {}
+    with theanets.serving.Server(net, max_batch_size=8, max_latency=0.01) as server:
+        def client(i):
+            results[i] = server.predict(u.INPUTS[i])
+        threads = [threading.Thread(target=client, args=(i, ))
+                   for i in range(u.NUM_EXAMPLES)]
+        [t.start() for t in threads]
+        [t.join() for t in threads]
+    expected = net.predict(u.INPUTS)
+    for i in range(u.NUM_EXAMPLES):
+        assert np.allclose(results[i], expected[i], atol=1e-5)
+    assert server.num_requests == u.NUM_EXAMPLES
+    assert u.NUM_EXAMPLES // 8 <= server.num_batches < u.NUM_EXAMPLES
+
+
+def test_method():
+    net = theanets.Classifier(u.CLF_LAYERS)
+    with theanets.serving.Server(net, method='predict_proba') as server:
+        y = server.predict(u.INPUTS[0])
+    assert y.shape == (u.NUM_CLASSES, )
+    assert np.allclose(y, net.predict_proba(u.INPUTS[:1])[0], atol=1e-5)
+
+
+def test_error(net):
+    with theanets.serving.Server(net) as server:
+        with pytest.raises(ValueError):
+            server.submit(np.zeros(u.NUM_INPUTS + 1, 'f'))
+        with pytest.raises(ValueError):
+            server.submit(np.zeros(u.NUM_INPUTS, complex))
+        y = server.predict(u.INPUTS[0])
+    assert np.allclose(y, net.predict(u.INPUTS[:1])[0], atol=1e-5)
+
+
+class Picky(object):
+    layers = []
+
+    def predict(self, x):
+        if (x < 0).any():
+            raise ArithmeticError('negative input')
+        return 2 * x
+
+
+def test_batch_error():
+    xs = [np.ones(3, 'f'), -np.ones(3, 'f'), np.zeros(3, 'f')]
+    with theanets.serving.Server(Picky(), max_latency=1) as server:
+        futures = [server.submit(x) for x in xs]
+        with pytest.raises(ValueError):
+            server.submit(np.ones(4, 'f'))
+        with pytest.raises(ArithmeticError):
+            futures[1].result()
+        assert np.allclose(futures[0].result(), 2)
+        assert np.allclose(futures[2].result(), 0)
+    assert server.num_requests == 2
+    assert server.num_batches == 1
+    assert server.num_retries == 3
+
+
+def test_recurrent_lengths():
+    net = theanets.recurrent.Regressor([
+        u.NUM_INPUTS, (u.NUM_HID1, 'rnn'), u.NUM_OUTPUTS])
+    xs = [u.RNN.INPUTS[0], u.RNN.INPUTS[1, :-1]]
+    with theanets.serving.Server(net, max_latency=1) as server:
+        futures = [server.submit(x) for x in xs]
+        ys = [f.result() for f in futures]
+    for x, y in zip(xs, ys):
+        assert np.allclose(y, net.predict(x[None])[0], atol=1e-5)
+
+
+def test_not_running(net):
+    server = theanets.serving.Server(net)
+    with pytest.raises(RuntimeError):
+        server.submit(u.INPUTS[0])
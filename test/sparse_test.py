@@ -34,6 +34,32 @@ def test_sgd(Model, layers, sparse, weighted, data):
     u.assert_progress(Model(layers[sparse], weighted=weighted), data[sparse])
 
 
+def test_hogwild():
+    net = theanets.Regressor(REG_LAYERS['csr'])
+    u.assert_progress(net, REG_DATA['csr'], algo='hogwild', workers=2)
+    # parameters get private copies of their values after training.
+    for param in net.params:
+        assert param.get_value(borrow=True).base is None
+
+
+def test_hogwild_sparse_rows():
+    # inputs 0-2 never occur, so their weight rows get no gradient.
+    x = u.INPUTS.copy()
+    x[:, :3] = 0
+    net = theanets.Regressor(REG_LAYERS['csr'])
+    w = net.find('hid1', 'w').get_value()
+    train = net.itertrain([scipy.sparse.csr_matrix(x), u.OUTPUTS],
+                          algo='hogwild', workers=2, momentum=0, batch_size=3,
+                          learning_rate=0.1)
+    next(train)
+    next(train)
+    train.close()
+    # without momentum, untouched rows are never written.
+    trained = net.find('hid1', 'w').get_value()
+    assert np.array_equal(trained[:3], w[:3])
+    assert not np.allclose(trained[3:], w[3:])
+
+
 @pytest.mark.parametrize('Model, layers, output', [
     (theanets.Regressor, u.REG_LAYERS, u.NUM_OUTPUTS),
     (theanets.Classifier, u.CLF_LAYERS, (u.NUM_EXAMPLES, )),
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 import theanets
 
@@ -31,9 +32,73 @@ def test_sample(ae):
     train0, valid0 = next(trainer)
     # for this trainer, we don't measure the loss.
     assert train0['loss'] == 0 == valid0['loss']
+    # every weight matrix is set to unit-norm samples.
+    w1, w2, w3 = (ae.find(l, 'w').get_value() for l in ('hid1', 'hid2', 'out'))
+    assert np.allclose((w1 * w1).sum(axis=0), 1)
+    assert np.allclose((w2 * w2).sum(axis=0), 1)
+    assert np.allclose((w3 * w3).sum(axis=1), 1)
+    # first-layer weights are normalized input rows.
+    x = u.INPUTS / np.sqrt((u.INPUTS * u.INPUTS).sum(axis=1))[:, None]
+    assert all(np.isclose(x, w).all(axis=1).any() for w in w1.T)
+
+
+def test_sample_recurrent():
+    net = theanets.recurrent.Autoencoder([
+        u.NUM_INPUTS, (u.NUM_HID1, 'rnn'), (u.NUM_HID2, 'rnn'), u.NUM_INPUTS])
+    train0, valid0 = next(net.itertrain([u.RNN.INPUTS], algo='sample'))
+    assert train0['loss'] == 0 == valid0['loss']
+    # deeper recurrent layers are set from samples of their inputs.
+    w = net.find('hid2', 'xh').get_value()
+    assert np.allclose((w * w).sum(axis=0), 1)
+
+
+def test_reservoir():
+    rng = np.random.RandomState(13)
+    xs = np.arange(40, dtype='f').reshape((20, 2)) + 1
+    pool = theanets.trainer.SampleTrainer.reservoir(xs, 5, rng)
+    assert pool.shape == (5, 2)
+    assert np.allclose((pool * pool).sum(axis=1), 1)
+    # samples are padded when there are not enough items.
+    pool = theanets.trainer.SampleTrainer.reservoir(xs[:3], 5, rng)
+    assert pool.shape == (5, 2)
+
+
+def test_reservoir_batches():
+    # offering a batch at once samples just like offering items one by one.
+    xs = np.random.randn(100, 3)
+    one = theanets.trainer._Reservoir(10, np.random.RandomState(3))
+    for x in xs:
+        one.add(x[None])
+    many = theanets.trainer._Reservoir(10, np.random.RandomState(3))
+    for i in range(0, 100, 7):
+        many.add(xs[i:i+7])
+    assert np.allclose(one.values, many.values)
 
 
 def test_unsupervised_pretrainer():
     u.assert_progress(
         theanets.Experiment(theanets.Classifier, u.CLF_LAYERS),
         u.AE_DATA, algo='pretrain')
+
+
+def test_parallel(ae):
+    u.assert_progress(ae, u.AE_DATA, algo='parallel', workers=2)
+
+
+def test_parallel_matches_downhill():
+    nets = []
+    for kwargs in (dict(algo='sgd'),
+                   dict(algo='parallel', subalgo='sgd', workers=3)):
+        net = theanets.Regressor(u.REG_LAYERS, rng=13)
+        train = net.itertrain([u.INPUTS, u.OUTPUTS], batch_size=8, rng=3,
+                              learning_rate=0.1, max_gradient_norm=1, **kwargs)
+        for _ in range(3):
+            next(train)
+        train.close()
+        nets.append(net)
+    for a, b in zip(nets[0].params, nets[1].params):
+        assert np.allclose(a.get_value(), b.get_value())
+
+
+def test_hogwild(ae):
+    u.assert_progress(ae, u.AE_DATA, algo='hogwild', workers=2)
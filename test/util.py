@@ -74,9 +74,10 @@ class CNN:
     WREG_DATA = [INPUTS, OUTPUTS, OUTPUT_WEIGHTS]
 
 
-def assert_progress(model, data, algo='sgd'):
+def assert_progress(model, data, algo='sgd', **kwargs):
     trainer = model.itertrain(
-        data, algo=algo, momentum=0.5, batch_size=3, max_gradient_norm=1)
+        data, algo=algo, momentum=0.5, batch_size=3, max_gradient_norm=1,
+        **kwargs)
     train0, valid0 = next(trainer)
     train1, valid1 = next(trainer)
     assert train1['loss'] < valid0['loss']   # should have made progress!
@@ -67,3 +67,20 @@ class TestMatching:
         match = sorted(theanets.util.outputs_matching(outputs, '*:pre'))
         assert len(match) == 3
         assert [n for n, _ in match] == ['hid1:pre', 'hid2:pre', 'out:pre']
+
+
+class TestPrefetch:
+    def test_order(self):
+        assert list(theanets.util.prefetch(iter(range(10)), 3)) == list(range(10))
+
+    def test_raises(self):
+        def items():
+            yield 1
+            raise ValueError
+        it = theanets.util.prefetch(items())
+        assert next(it) == 1
+        try:
+            next(it)
+            assert False
+        except ValueError:
+            pass
@@ -8,8 +8,12 @@ from .losses import Loss
 from .regularizers import Regularizer
 from .main import Experiment
 
+from . import checkpoint
 from . import convolution
+from . import dataset
+from . import inference
 from . import recurrent
 from . import regularizers
+from . import serving
 
 __version__ = '0.8.0pre'
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+
+r'''This module contains tools for saving checkpoints during training.
+
+A :class:`Checkpointer` saves a network to disk each time it is called. Files
+are written to a temporary name in the destination directory and then renamed
+into place, so a checkpoint file is never observed half-written, and only the
+most recent few checkpoints can optionally be retained.
+
+When run in the background, a checkpointer snapshots the parameter values of
+the network (using ``get_value()``) in the calling thread, which is fast, and
+then serializes and compresses the snapshot on a background thread, so that
+training does not stall while a large model is written to a slow disk. If a
+new checkpoint is requested while the previous one is still being written,
+the pending snapshot is replaced by the newer one.
+
+For long training runs, a checkpointer can also save "delta" checkpoints: every
+so often it writes a full "base" model, and the checkpoints in between store
+only the difference between the current parameter values and the base values.
+Differences are computed as the bitwise XOR of the raw parameter values, so
+unchanged values are zero and values that have changed by a small amount
+share their sign, exponent, and leading mantissa bits with the base; the
+result compresses well, and replaying a delta reproduces parameter values
+exactly.
+
+Lossless deltas are only about half the size of a full checkpoint, though,
+because training changes nearly every parameter by a little. If a small error
+in the saved values is acceptable, a positive ``tolerance`` stores lossy deltas
+instead: changes no larger than the tolerance are dropped, and the remaining
+changes are stored sparsely, as gaps between their (flat) indices and as small
+integer multiples of twice the tolerance. Every value replayed from a lossy
+delta is within ``tolerance`` of the value that was saved (up to rounding to
+the dtype of the parameter), and because each
+delta is computed against the base, errors do not accumulate from one delta to
+the next.
+
+A delta checkpoint can be loaded with :func:`Network.load()
+<theanets.graph.Network.load>` as long as its base file is still present in
+the same directory.
+
+Checkpointers are normally created by :func:`Network.itertrain()
+<theanets.graph.Network.itertrain>` using the ``save_every``,
+``save_progress``, ``save_async``, ``save_keep``, ``save_deltas``, and
+``save_tolerance`` arguments.
+'''
+
+import climate
+import gzip
+import numpy as np
+import os
+import pickle
+import tempfile
+import threading
+import time
+import zipfile
+
+from . import util
+
+logging = climate.get_logger(__name__)
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+class Checkpointer(object):
+    '''Save checkpoints of a network during training.
+
+    Parameters
+    ----------
+    network : :class:`theanets.graph.Network`
+        The network to save.
+    save_progress : str or file handle
+        Either (a) the full path of a file where checkpoints are saved, or (b)
+        a file-like object where checkpoints should be written. If this is a
+        string containing a "{}" format specifier, it will be filled with the
+        integer Unix timestamp at the time each checkpoint is saved.
+    keep : int, optional
+        If this is positive and ``save_progress`` is a filename with a "{}"
+        format specifier, only the most recent ``keep`` checkpoint files
+        written by this checkpointer are kept; older ones are removed. Defaults
+        to 0, which keeps all checkpoints.
+    background : bool, optional
+        If True, serialize and write checkpoints on a background thread.
+        Defaults to False.
+    format : str, optional
+        Format for saved models; see :func:`Network.save()
+        <theanets.graph.Network.save>`. Defaults to ``'pickle'``.
+    deltas : int, optional
+        If this is positive, write this many delta checkpoints after each full
+        checkpoint. This requires ``save_progress`` to be a filename with a
+        "{}" format specifier. Defaults to 0, which writes only full
+        checkpoints.
+    tolerance : float, optional
+        If this is positive, delta checkpoints are lossy: each parameter value
+        is stored with an absolute error of at most this much. Defaults to 0,
+        which stores deltas exactly.
+
+    Raises
+    ------
+    ConfigurationError :
+        If ``deltas`` is positive but ``save_progress`` is not a filename
+        pattern.
+    '''
+
+    def __init__(self, network, save_progress, keep=0, background=False,
+                 format='pickle', deltas=0, tolerance=0):
+        if deltas > 0 and not (isinstance(save_progress, util.basestring) and
+                               '{}' in save_progress):
+            raise util.ConfigurationError(
+                'delta checkpoints need a filename pattern containing "{}"')
+        self.network = network
+        self.save_progress = save_progress
+        self.keep = keep
+        self.background = background
+        self.format = format
+        self.deltas = deltas
+        self.tolerance = tolerance
+        self._base = None
+        self._since_base = 0
+        self._written = []
+        self._retired = []
+        self._shadow = None
+        self._pending = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+        self._error = None
+
+    def __call__(self, now=None):
+        '''Save a checkpoint of the network.
+
+        Parameters
+        ----------
+        now : float, optional
+            Unix timestamp for the checkpoint. Defaults to the current time.
+        '''
+        if now is None:
+            now = time.time()
+        target = self.save_progress
+        if isinstance(target, util.basestring):
+            target = target.format(int(now))
+        if not self.background:
+            values = None
+            if self.deltas > 0:
+                values = [p.get_value() for p in self.network.params]
+            self._save(target, values)
+            return
+        self._raise()
+        values = [p.get_value() for p in self.network.params]
+        with self._cond:
+            if self._pending is not None:
+                logging.info('%s: replacing pending checkpoint', self._pending[0])
+            self._pending = (target, values)
+            self._cond.notify()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def close(self):
+        '''Wait for any checkpoint being written in the background to finish.
+
+        Raises
+        ------
+        Exception :
+            Any error raised while writing a checkpoint in the background is
+            re-raised here.
+        '''
+        if self._thread is not None:
+            with self._cond:
+                self._closing = True
+                self._cond.notify()
+            self._thread.join()
+            self._thread = None
+            self._closing = False
+        self._raise()
+
+    def _raise(self):
+        err, self._error = self._error, None
+        if err is not None:
+            raise err
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closing:
+                    self._cond.wait()
+                if self._pending is None:
+                    return
+                (target, values), self._pending = self._pending, None
+            try:
+                self._save(target, values)
+            except Exception as err:
+                logging.exception('%s: error saving checkpoint', target)
+                self._error = err
+
+    def _save(self, target, values):
+        '''Save a full or delta checkpoint with the given parameter values.'''
+        if self._base is not None and self._since_base < self.deltas:
+            base, base_values = self._base
+            self._write(target, lambda h: _save_delta(
+                h, base, base_values, values, self.tolerance))
+            self._since_base += 1
+            self._retain(target, base)
+            return
+        network = self.network
+        if self.background:
+            # write a private copy of the network, so that training can keep
+            # updating the values of the original in the meantime.
+            if self._shadow is None:
+                self._shadow = pickle.loads(pickle.dumps(self.network, -1))
+            for param, value in zip(self._shadow.params, values):
+                param.set_value(value, borrow=True)
+            network = self._shadow
+        zipped = self.format == 'pickle' and \
+            isinstance(target, util.basestring) and target.lower().endswith('.gz')
+        self._write(target, lambda h: _save_full(h, network, self.format, zipped))
+        if self.deltas > 0:
+            self._base = (target, values)
+            self._since_base = 0
+        self._retain(target, None)
+
+    def _write(self, target, write):
+        '''Write to a file handle, or atomically to a filename.'''
+        if not isinstance(target, util.basestring):
+            write(target)
+            return
+        dirname = os.path.dirname(os.path.abspath(target))
+        fd, tmp = tempfile.mkstemp(
+            dir=dirname, prefix='.' + os.path.basename(target), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as handle:
+                write(handle)
+            _replace(tmp, target)
+        except Exception:
+            os.remove(tmp)
+            raise
+        logging.info('%s: saved checkpoint', target)
+
+    def _retain(self, target, base):
+        '''Remove old checkpoint files that are no longer needed.'''
+        if not isinstance(target, util.basestring):
+            return
+        self._written = [w for w in self._written if w[0] != target]
+        self._written.append((target, base))
+        while self.keep > 0 and len(self._written) > self.keep:
+            self._retired.append(self._written.pop(0)[0])
+        # base files are kept until no remaining delta depends on them.
+        needed = set(b for _, b in self._written)
+        if self._base is not None:
+            needed.add(self._base[0])
+        for old in [r for r in self._retired if r not in needed]:
+            self._retired.remove(old)
+            try:
+                os.remove(old)
+                logging.info('%s: removed old checkpoint', old)
+            except OSError as err:
+                logging.warning('%s: error removing checkpoint: %s', old, err)
+
+
+def _save_full(handle, network, format, zipped):
+    if zipped:
+        with gzip.GzipFile(fileobj=handle, mode='wb') as z:
+            network.save(z, format=format)
+    else:
+        network.save(handle, format=format)
+
+
+def _bits(value):
+    '''View an array as unsigned integers of the same size.'''
+    value = np.ascontiguousarray(value)
+    return value.view(np.dtype('u{}'.format(value.dtype.itemsize)))
+
+
+def _narrow(values, kinds):
+    '''Cast integers to the smallest dtype of the given kinds that holds them.'''
+    for kind in kinds:
+        info = np.iinfo(kind)
+        if not len(values) or (info.min <= values.min() and values.max() <= info.max):
+            return values.astype(kind)
+    return values
+
+
+def _save_delta(handle, base, base_values, values, tolerance=0):
+    '''Write the difference between two sets of parameter values.
+
+    If ``tolerance`` is positive, differences are quantized to multiples of
+    twice the tolerance and stored sparsely; otherwise they are stored exactly
+    as the bitwise XOR of the values.
+    '''
+    deltas = {}
+    for i, (b, v) in enumerate(zip(base_values, values)):
+        if tolerance <= 0:
+            deltas['p{}'.format(i)] = _bits(v) ^ _bits(b)
+            continue
+        diff = np.asarray(v, 'd').ravel() - np.asarray(b, 'd').ravel()
+        index = np.flatnonzero(abs(diff) > tolerance)
+        codes = np.round(diff[index] / (2 * tolerance)).astype(np.int64)
+        gaps = np.diff(np.concatenate([[-1], index]))
+        deltas['g{}'.format(i)] = _narrow(gaps, ('u1', 'u2', 'u4', 'u8'))
+        deltas['q{}'.format(i)] = _narrow(codes, ('i1', 'i2', 'i4', 'i8'))
+    np.savez_compressed(handle, __base__=np.array(os.path.basename(base)),
+                        __tolerance__=np.array(float(tolerance)), **deltas)
+
+
+def is_delta_file(filename):
+    '''Check whether a file contains a delta checkpoint.
+
+    Parameters
+    ----------
+    filename : str
+        Name of a file on disk.
+
+    Returns
+    -------
+    matches : bool
+        True if the file appears to contain a delta checkpoint.
+    '''
+    if not zipfile.is_zipfile(filename):
+        return False
+    with zipfile.ZipFile(filename) as z:
+        return '__base__.npy' in z.namelist()
+
+
+def load_delta(filename, mmap=False):
+    '''Load a network from a delta checkpoint.
+
+    The base checkpoint for the delta is loaded from the same directory as the
+    delta file, and then the delta is applied to its parameter values.
+
+    Parameters
+    ----------
+    filename : str
+        Name of a delta checkpoint file on disk.
+    mmap : bool, optional
+        If True, memory-map the parameters of the base checkpoint, if it
+        supports this. Defaults to False.
+
+    Returns
+    -------
+    network : :class:`theanets.graph.Network`
+        The network saved in the checkpoint.
+    '''
+    from . import graph
+
+    with np.load(filename) as data:
+        base = os.path.join(os.path.dirname(filename), str(data['__base__']))
+        network = graph.Network.load(base, mmap=mmap)
+        for i, param in enumerate(network.params):
+            value = param.get_value()
+            if 'p{}'.format(i) in data.files:
+                bits = _bits(value) ^ data['p{}'.format(i)]
+                param.set_value(bits.view(value.dtype).reshape(value.shape))
+                continue
+            step = 2 * float(data['__tolerance__'])
+            index = np.cumsum(data['g{}'.format(i)].astype(np.int64)) - 1
+            flat = np.array(value, 'd').ravel()
+            flat[index] += step * data['q{}'.format(i)]
+            param.set_value(flat.astype(value.dtype).reshape(value.shape))
+    return network
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+r'''This module contains a dataset that prepares batches in the background.
+
+During training, each batch of data is normally produced just before it is
+needed, so the time spent assembling a batch (e.g., slicing, padding, or
+sampling sequences) is added to the time spent computing each gradient step. A
+:class:`PrefetchDataset` instead runs one or more background workers that
+produce batches ahead of time into a bounded queue, so that batch generation
+overlaps with the computation of the training updates.
+
+The dataset keeps count of the batches that were not ready when they were
+requested. If training often waits for batches, more workers might help; if
+it never waits, fewer workers might do.
+
+Prefetching datasets are normally created by :func:`Network.itertrain()
+<theanets.graph.Network.itertrain>` using the ``prefetch`` and
+``prefetch_processes`` arguments.
+'''
+
+import climate
+import downhill
+import multiprocessing
+import numpy as np
+import threading
+import time
+
+from . import util
+
+logging = climate.get_logger(__name__)
+
+
+class PrefetchDataset(object):
+    '''A dataset whose batches are produced by background workers.
+
+    Parameters
+    ----------
+    data : :class:`downhill.Dataset <downhill.dataset.Dataset>` or callable
+        Source of batches. If this is a callable, each worker calls it
+        repeatedly to produce batches. If this is a ``downhill.Dataset``, a
+        single worker iterates over it, so batches are produced in the same
+        order as the wrapped dataset would produce them.
+    workers : int, optional
+        Number of background workers calling a callable source. Defaults to 1.
+    size : int, optional
+        Maximum number of batches waiting to be consumed. Defaults to twice
+        the number of workers.
+    processes : bool, optional
+        If True, workers are (forked) processes instead of threads. This
+        avoids contention for the Python interpreter lock when producing
+        batches is CPU-intensive, but batches must then be copied between
+        processes. Each worker process starts with a copy of the random state
+        of the calling process, so to make workers produce different batches,
+        each one reseeds the global NumPy random state and, if a callable has
+        an ``rng`` attribute, the ``numpy.random.RandomState`` it holds. A
+        callable that draws random numbers must draw them from one of these;
+        the callables created by :func:`theanets.recurrent.batches` and the
+        like expose their random state this way. Defaults to False.
+    name : str, optional
+        Name of this dataset. Defaults to the name of a wrapped
+        ``downhill.Dataset``, or ``'dataset'``.
+    iteration_size : int, optional
+        Number of batches in one iteration over this dataset. Defaults to the
+        iteration size of a wrapped ``downhill.Dataset``, or 100.
+
+    Attributes
+    ----------
+    num_batches : int
+        Number of batches consumed from this dataset.
+    num_starved : int
+        Number of batches that were not ready when they were requested.
+    wait_time : float
+        Total number of seconds spent waiting for batches.
+    '''
+
+    def __init__(self, data, workers=1, size=None, processes=False, name=None,
+                 iteration_size=None):
+        if isinstance(data, downhill.Dataset):
+            self._dataset, self._callable = data, None
+            workers = 1
+        elif callable(data):
+            self._dataset, self._callable = None, data
+        else:
+            raise util.ConfigurationError(
+                'cannot prefetch batches from {!r}'.format(data))
+        if workers < 1:
+            raise util.ConfigurationError(
+                'prefetching needs at least one worker, got {}'.format(workers))
+        self.name = name or getattr(self._dataset, 'name', 'dataset')
+        self.batch_size = getattr(self._dataset, 'batch_size', None)
+        self.iteration_size = (iteration_size or
+                               getattr(self._dataset, 'iteration_size', None) or
+                               100)
+        self.workers = workers
+        self.size = size or 2 * workers
+        self.processes = processes
+        self.num_batches = 0
+        self.num_starved = 0
+        self.wait_time = 0.
+        self._queue = None
+        self._stop = None
+        self._workers = []
+
+    def __iter__(self):
+        return self.iterate()
+
+    def iterate(self):
+        '''Iterate over batches in the dataset.
+
+        This method yields ``iteration_size`` batches from the dataset and
+        then returns. Background workers are started when needed, and keep
+        producing batches for the next iteration until :func:`close` is
+        called. A wrapped dataset shuffles its batches as usual.
+
+        Raises
+        ------
+        Exception :
+            Any error raised while producing a batch is re-raised here.
+
+        Yields
+        ------
+        batches : data batches
+            A sequence of batches from the dataset.
+        '''
+        if not self._workers:
+            self._start()
+        for _ in range(self.iteration_size):
+            yield self._next()
+
+    def stats(self, reset=False):
+        '''Get statistics about waiting for batches.
+
+        Parameters
+        ----------
+        reset : bool, optional
+            If True, reset the statistics after returning them. Defaults to
+            False.
+
+        Returns
+        -------
+        stats : dict
+            A dictionary containing the number of batches consumed
+            (``'batches'``), the number of those that were not ready when
+            requested (``'starved'``), and the total seconds spent waiting for
+            them (``'wait'``).
+        '''
+        stats = dict(batches=self.num_batches,
+                     starved=self.num_starved,
+                     wait=self.wait_time)
+        if reset:
+            self.num_batches = self.num_starved = 0
+            self.wait_time = 0.
+        return stats
+
+    def close(self):
+        '''Stop the background workers.'''
+        if not self._workers:
+            return
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(1)
+            if self.processes and worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def _start(self):
+        if self.processes:
+            ctx = multiprocessing
+            if hasattr(multiprocessing, 'get_context'):
+                ctx = multiprocessing.get_context('fork')
+            self._queue = ctx.Queue(self.size)
+            self._stop = ctx.Event()
+            create = ctx.Process
+        else:
+            self._queue = util.queue.Queue(self.size)
+            self._stop = threading.Event()
+            create = threading.Thread
+        for _ in range(self.workers):
+            worker = create(target=self._run)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except util.queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        if self.processes:
+            # forked workers start with copies of the same random states, so
+            # give each one its own seeds to produce different batches.
+            np.random.seed()
+            rng = getattr(self._callable, 'rng', None)
+            if isinstance(rng, np.random.RandomState):
+                rng.seed(np.random.randint(2 ** 31))
+        try:
+            if self._callable is not None:
+                while self._put((self._callable(), None)):
+                    pass
+                return
+            while True:
+                for batch in self._dataset.iterate():
+                    if not self._put((batch, None)):
+                        return
+        except Exception as err:
+            self._put((None, err))
+
+    def _next(self):
+        start = time.time()
+        try:
+            batch, err = self._queue.get_nowait()
+        except util.queue.Empty:
+            self.num_starved += 1
+            while True:
+                try:
+                    batch, err = self._queue.get(timeout=1)
+                    break
+                except util.queue.Empty:
+                    if not any(w.is_alive() for w in self._workers):
+                        raise RuntimeError(
+                            '{}: all prefetch workers have exited'
+                            .format(self.name))
+        self.wait_time += time.time() - start
+        if err is not None:
+            raise err
+        self.num_batches += 1
+        return batch
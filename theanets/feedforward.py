@@ -2,6 +2,8 @@
 
 '''This module contains common feedforward network models.'''
 
+from __future__ import division
+
 import numpy as np
 import theano
 import warnings
@@ -140,6 +142,15 @@ class Autoencoder(graph.Network):
             If True, then draw a sample using the hidden activations as
             independent Bernoulli probabilities for the encoded data. This
             assumes the hidden layer has a logistic sigmoid activation function.
+        batch_size : int, optional
+            Process the input in chunks of this many examples. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        max_memory : int, optional
+            Choose a chunk size to bound memory use to this many bytes. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        out : ndarray, optional
+            If given, write the encoded data into this preallocated array (e.g.,
+            a ``numpy.memmap``).
 
         Returns
         -------
@@ -147,11 +158,33 @@ class Autoencoder(graph.Network):
             The given dataset, encoded by the appropriate hidden layer
             activation.
         '''
-        enc = self.feed_forward(x, **kwargs)[self._find_output(layer)]
+        enc = self._compute(x, self._find_output(layer), **kwargs)
         if sample:
             return np.random.binomial(n=1, p=enc).astype(np.uint8)
         return enc
 
+    def encode_iter(self, batches, prefetch=1, **kwargs):
+        '''Encode a sequence of data batches lazily.
+
+        While one batch is being encoded, the next batch(es) are fetched from
+        the input sequence on a background thread.
+
+        Parameters
+        ----------
+        batches : iterable of ndarray
+            A sequence (e.g., a generator) of datasets to encode.
+        prefetch : int, optional
+            Number of input batches to fetch ahead. Defaults to 1.
+
+        Yields
+        ------
+        ndarray :
+            The result of :func:`encode` for each input batch. Additional
+            keyword arguments are passed to :func:`encode`.
+        '''
+        for x in util.prefetch(batches, prefetch):
+            yield self.encode(x, **kwargs)
+
     def decode(self, z, layer=None, **kwargs):
         '''Decode an encoded dataset by computing the output layer activation.
 
@@ -373,7 +406,7 @@ class Classifier(graph.Network):
         outputs, _ = self.build_graph(regs)
         return monitors + [('acc', self.losses[0].accuracy(outputs))]
 
-    def predict(self, x, **kwargs):
+    def predict(self, x, out=None, **kwargs):
         '''Compute a greedy classification for the given set of data.
 
         Parameters
@@ -381,14 +414,37 @@ class Classifier(graph.Network):
         x : ndarray (num-examples, num-variables)
             An array containing examples to classify. Examples are given as the
             rows in this array.
+        batch_size : int, optional
+            Process the input in chunks of this many examples. Class labels
+            are computed for one chunk at a time, so class probabilities are
+            never held for all examples at once. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        max_memory : int, optional
+            Choose a chunk size to bound memory use to this many bytes. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        out : ndarray, optional
+            If given, write the class labels into this preallocated array.
 
         Returns
         -------
         k : ndarray (num-examples, )
             A vector of class index values, one per row of input data.
         '''
-        outputs = self.feed_forward(x, **kwargs)
-        return outputs[self.layers[-1].output_name].argmax(axis=-1)
+        batch_size = kwargs.pop('batch_size', None)
+        max_memory = kwargs.pop('max_memory', None)
+        if batch_size is None and not max_memory:
+            k = self.predict_proba(x, **kwargs).argmax(axis=-1)
+            if out is not None:
+                out[...] = k
+                return out
+            return k
+        n = (x[0] if isinstance(x, (tuple, list)) else x).shape[0]
+        for rows, chunk in self._chunks(x, batch_size, max_memory):
+            k = self.predict_proba(chunk, **kwargs).argmax(axis=-1)
+            if out is None:
+                out = np.empty((n, ) + k.shape[1:], k.dtype)
+            out[rows] = k
+        return out
 
     def classify(self, x, **kwargs):
         warnings.warn('please use predict() instead of classify()',
@@ -403,6 +459,14 @@ class Classifier(graph.Network):
         x : ndarray (num-examples, num-variables)
             An array containing examples to predict. Examples are given as the
             rows in this array.
+        batch_size : int, optional
+            Process the input in chunks of this many examples. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        max_memory : int, optional
+            Choose a chunk size to bound memory use to this many bytes. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        out : ndarray, optional
+            If given, write the probabilities into this preallocated array.
 
         Returns
         -------
@@ -410,7 +474,29 @@ class Classifier(graph.Network):
             An array of class posterior probability values, one per row of input
             data.
         '''
-        return self.feed_forward(x, **kwargs)[self.layers[-1].output_name]
+        return self._compute(x, self.layers[-1].output_name, **kwargs)
+
+    def predict_proba_iter(self, batches, prefetch=1, **kwargs):
+        '''Compute class probabilities lazily for a sequence of input batches.
+
+        While one batch is being processed, the next batch(es) are fetched from
+        the input sequence on a background thread.
+
+        Parameters
+        ----------
+        batches : iterable of ndarray
+            A sequence (e.g., a generator) of input arrays.
+        prefetch : int, optional
+            Number of input batches to fetch ahead. Defaults to 1.
+
+        Yields
+        ------
+        p : ndarray
+            The result of :func:`predict_proba` for each input batch.
+            Additional keyword arguments are passed to :func:`predict_proba`.
+        '''
+        for x in util.prefetch(batches, prefetch):
+            yield self.predict_proba(x, **kwargs)
 
     def predict_logit(self, x, **kwargs):
         '''Compute the logit values that underlie the softmax output.
@@ -427,7 +513,7 @@ class Classifier(graph.Network):
             An array of posterior class logit values, one row of logit values
             per row of input data.
         '''
-        return self.feed_forward(x, **kwargs)[self.layers[-1].full_name('pre')]
+        return self._compute(x, self.layers[-1].full_name('pre'), **kwargs)
 
     def score(self, x, y, w=None, **kwargs):
         '''Compute the mean accuracy on a set of labeled data.
@@ -441,13 +527,30 @@ class Classifier(graph.Network):
             A vector of integer class labels, one for each row of input data.
         w : ndarray (num-examples, )
             A vector of weights, one for each row of input data.
+        batch_size : int, optional
+            Classify the input in chunks of this many examples. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
+        max_memory : int, optional
+            Choose a chunk size to bound memory use to this many bytes. See
+            :func:`feed_forward <theanets.graph.Network.feed_forward>`.
 
         Returns
         -------
         score : float
-            The (possibly weighted) mean accuracy of the model on the data.
+            The (possibly weighted) mean accuracy of the model on the data, or
+            0 if there are no examples (or their weights add up to 0).
         '''
-        eq = y == self.predict(x, **kwargs)
-        if w is not None:
-            return (w * eq).sum() / w.sum()
-        return eq.mean()
+        batch_size = kwargs.pop('batch_size', None)
+        max_memory = kwargs.pop('max_memory', None)
+        correct = total = 0
+        for rows, chunk in self._chunks(x, batch_size, max_memory):
+            eq = y[rows] == self.predict(chunk, **kwargs)
+            if w is None:
+                correct += eq.sum()
+                total += eq.size
+            else:
+                correct += (w[rows] * eq).sum()
+                total += w[rows].sum()
+        if not total:
+            return 0.
+        return float(correct / total)
@@ -7,20 +7,63 @@ import downhill
 import gzip
 import hashlib
 import numpy as np
+import os
 import pickle
+import sys
+import tempfile
 import theano
 import time
 import warnings
 
+from . import checkpoint
+from . import dataset
 from . import layers
 from . import losses
 from . import regularizers
+from . import storage
 from . import trainer
 from . import util
 
 logging = climate.get_logger(__name__)
 
 
+def _canonical(value):
+    '''Convert a configuration value to a string that does not vary by process.
+
+    Layers are represented by the name of their output, and other objects
+    (e.g., activations or random number generators) by their name or class.
+    '''
+    if isinstance(value, dict):
+        return '{' + ','.join('{}:{}'.format(k, _canonical(value[k]))
+                              for k in sorted(value)) + '}'
+    if isinstance(value, (tuple, list)):
+        return '[' + ','.join(_canonical(v) for v in value) + ']'
+    if isinstance(value, np.generic):
+        return repr(value.item())
+    if value is None or isinstance(value, (bool, int, float, util.basestring)):
+        return repr(value)
+    if hasattr(value, 'output_name'):
+        return repr(value.output_name)
+    if isinstance(value, np.ndarray):
+        data = np.ascontiguousarray(value).tobytes()
+        return '<array {}>'.format(hashlib.md5(data).hexdigest())
+    if isinstance(getattr(value, 'name', None), util.basestring):
+        return '<{}>'.format(value.name)
+    if hasattr(value, '__name__'):
+        return '<{}.{}>'.format(getattr(value, '__module__', ''), value.__name__)
+    return '<{}>'.format(value.__class__.__name__)
+
+
+def _seekable(handle):
+    '''Check whether a file handle supports seeking.'''
+    try:
+        return handle.seekable()
+    except AttributeError:
+        return hasattr(handle, 'seek') and hasattr(handle, 'tell')
+    except (IOError, OSError, ValueError):
+        return False
+
+
 class Network(object):
     '''The network class encapsulates a network computation graph.
 
@@ -241,7 +284,9 @@ class Network(object):
         self.add_loss(*args, **kwargs)
 
     def itertrain(self, train, valid=None, algo='rmsprop', subalgo='rmsprop',
-                  save_every=0, save_progress=None, **kwargs):
+                  save_every=0, save_progress=None, save_async=False,
+                  save_keep=0, save_deltas=0, save_tolerance=0, prefetch=0,
+                  prefetch_processes=False, **kwargs):
         '''Train our network, one batch at a time.
 
         This method yields a series of ``(train, valid)`` monitor pairs. The
@@ -275,8 +320,13 @@ class Network(object):
             provided, :class:`RMSProp <downhill.adaptive.RMSProp>` will be used.
         subalgo : str, optional
             An optimization algorithm to use for a trainer that requires a
-            "sub-algorithm," sugh as an unsupervised pretrainer. Defaults to
+            "sub-algorithm," sugh as an unsupervised pretrainer or the
+            data-parallel trainer (``algo='parallel'``). Defaults to
             :class:`RMSProp <downhill.adaptive.RMSProp>`.
+        workers : int, optional
+            Number of processes that compute gradients when training with the
+            data-parallel or the hogwild trainer. Defaults to the number of
+            CPUs.
         save_every : int or float, optional
             If this is nonzero and ``save_progress`` is not None, then the model
             being trained will be saved periodically. If this is a float, it is
@@ -291,6 +341,33 @@ class Network(object):
             name contains a "{}" format specifier, it will be filled with the
             integer Unix timestamp at the time the model is saved. Defaults to
             None, which does not save models.
+        save_async : bool, optional
+            If True, snapshot the model parameters when a save is due, and
+            write the model to disk on a background thread, so that training
+            does not wait for the disk. Defaults to False.
+        save_keep : int, optional
+            If this is positive and ``save_progress`` contains a "{}" format
+            specifier, keep only this many of the most recently saved models
+            on disk. Defaults to 0, which keeps all saved models.
+        save_deltas : int, optional
+            If this is positive, save only the (compressed) changes in parameter
+            values since the last full save, for this many saves between full
+            saves. Requires ``save_progress`` to contain a "{}" format
+            specifier. Defaults to 0, which saves the full model every time.
+        save_tolerance : float, optional
+            If this is positive, changes saved with ``save_deltas`` are lossy,
+            storing each parameter value to within this absolute error, which
+            makes them much smaller. Defaults to 0, which saves changes
+            exactly.
+        prefetch : int, optional
+            If this is positive, produce training and validation batches ahead
+            of time using this many background workers; see
+            :class:`theanets.dataset.PrefetchDataset`. The number of batches
+            that training had to wait for is logged after each iteration.
+            Defaults to 0, which produces each batch when it is needed.
+        prefetch_processes : bool, optional
+            If True, prefetching workers are processes instead of threads.
+            Defaults to False.
 
         Yields
         ------
@@ -309,21 +386,38 @@ class Network(object):
         def create_dataset(data, **kwargs):
             name = kwargs.get('name', 'dataset')
             s = '{}_batches'.format(name)
-            return downhill.Dataset(
-                data,
-                name=name,
-                batch_size=kwargs.get('batch_size', 32),
-                iteration_size=kwargs.get('iteration_size', kwargs.get(s)),
-                axis=kwargs.get('axis', 0),
-                rng=kwargs['rng'])
+            iteration_size = kwargs.get('iteration_size', kwargs.get(s))
+            if prefetch > 0 and callable(data):
+                # callables are called directly by each prefetching worker.
+                return dataset.PrefetchDataset(
+                    data, workers=prefetch, processes=prefetch_processes,
+                    name=name, iteration_size=iteration_size)
+            if not isinstance(data, downhill.Dataset):
+                data = downhill.Dataset(
+                    data,
+                    name=name,
+                    batch_size=kwargs.get('batch_size', 32),
+                    iteration_size=iteration_size,
+                    axis=kwargs.get('axis', 0),
+                    rng=kwargs['rng'])
+            if prefetch > 0:
+                data = dataset.PrefetchDataset(
+                    data, processes=prefetch_processes)
+            return data
 
         # set up datasets ...
         if valid is None:
             valid = train
-        if not isinstance(valid, downhill.Dataset):
-            valid = create_dataset(valid, name='valid', **kwargs)
-        if not isinstance(train, downhill.Dataset):
+        shared = valid is train and isinstance(train, downhill.Dataset)
+        valid = create_dataset(valid, name='valid', **kwargs)
+        if shared:
+            # a dataset object must not be iterated by two prefetchers.
+            train = valid
+        else:
             train = create_dataset(train, name='train', **kwargs)
+        prefetched = [d for i, d in enumerate((train, valid))
+                      if isinstance(d, dataset.PrefetchDataset) and
+                      not (i and d is train)]
 
         if 'algorithm' in kwargs:
             warnings.warn(
@@ -338,10 +432,14 @@ class Network(object):
             algo = algo.lower()
             if algo == 'sample':
                 algo = trainer.SampleTrainer(self)
+            elif algo == 'hogwild':
+                algo = trainer.HogwildTrainer(self)
             elif algo.startswith('layer') or algo.startswith('sup'):
                 algo = trainer.SupervisedPretrainer(subalgo, self)
             elif algo.startswith('pre') or algo.startswith('unsup'):
                 algo = trainer.UnsupervisedPretrainer(subalgo, self)
+            elif algo.startswith('parallel') or algo.startswith('data'):
+                algo = trainer.DataParallelTrainer(subalgo, self)
             else:
                 algo = trainer.DownhillTrainer(algo, self)
 
@@ -355,17 +453,32 @@ class Network(object):
                 return iteration % save_every == 0
             return False
 
+        save = None
+        if save_progress is not None:
+            save = checkpoint.Checkpointer(
+                self, save_progress, keep=save_keep, background=save_async,
+                deltas=save_deltas, tolerance=save_tolerance)
+
         # train it!
         start = time.time()
-        for i, monitors in enumerate(algo.itertrain(train, valid, **kwargs)):
-            yield monitors
-            now = time.time()
-            if i and needs_saving(now - start, i):
-                filename_or_handle = save_progress
-                if isinstance(filename_or_handle, util.basestring):
-                    filename_or_handle = save_progress.format(int(now))
-                self.save(filename_or_handle)
-                start = now
+        try:
+            for i, monitors in enumerate(algo.itertrain(train, valid, **kwargs)):
+                for data in prefetched:
+                    stats = data.stats(reset=True)
+                    if stats['batches']:
+                        logging.info('%s: waited %.2fs for %d of %d batches',
+                                     data.name, stats['wait'],
+                                     stats['starved'], stats['batches'])
+                yield monitors
+                now = time.time()
+                if i and needs_saving(now - start, i):
+                    save(now)
+                    start = now
+        finally:
+            for data in prefetched:
+                data.close()
+            if save is not None:
+                save.close()
 
     def train(self, *args, **kwargs):
         '''Train the network until the trainer converges.
@@ -391,8 +504,9 @@ class Network(object):
     def _hash(self, regularizers=()):
         '''Construct a string key for representing a computation graph.
 
-        This key will be unique for a given (a) network topology, (b) set of
-        losses, and (c) set of regularizers.
+        This key will be unique for a given (a) network topology, including
+        the full configuration of every layer (e.g., activations and inputs),
+        (b) set of losses, and (c) set of regularizers.
 
         Returns
         -------
@@ -403,11 +517,19 @@ class Network(object):
             h.update(str(s).encode('utf-8'))
         h = hashlib.md5()
         for l in self.layers:
-            add('{}{}{}'.format(l.__class__.__name__, l.name, l.output_shape))
+            spec = l.to_spec()
+            # random number generators only affect parameter initialization.
+            spec.pop('rng', None)
+            add(_canonical(dict(spec, output_shape=l.output_shape)))
         for l in self.losses:
-            add('{}{}'.format(l.__class__.__name__, l.weight))
+            try:
+                spec = l.to_spec()
+            except util.ConfigurationError:
+                spec = dict(form=l.__class__.__name__, weight=l.weight,
+                            output_name=l.output_name)
+            add(_canonical(spec))
         for r in regularizers:
-            add('{}{}{}'.format(r.__class__.__name__, r.weight, r.pattern))
+            add(_canonical(dict(vars(r), form=r.__class__.__name__)))
         return h.hexdigest()
 
     def build_graph(self, regularizers=()):
@@ -501,7 +623,8 @@ class Network(object):
                 return layer.find(param)
         raise KeyError(which)
 
-    def feed_forward(self, x, **kwargs):
+    def feed_forward(self, x, outputs=None, batch_size=None, max_memory=None,
+                     out=None, **kwargs):
         '''Compute a forward pass of all layers from the given input.
 
         All keyword arguments are passed directly to :func:`build_graph`.
@@ -511,7 +634,35 @@ class Network(object):
         x : ndarray (num-examples, num-variables)
             An array containing data to be fed into the network. Multiple
             examples are arranged as rows in this array, with columns containing
-            the variables for each example.
+            the variables for each example. For a network with more than one
+            input layer (e.g., a recurrent network with a mask input), this is
+            a list containing one array for each input, in the order of the
+            input layers.
+        outputs : str or sequence of str, optional
+            If given, compute only the graph outputs whose names match these
+            glob-style patterns, e.g., ``'out:out'`` or ``'hid*:out'``. A
+            separate function is compiled (and cached) for each selection, and
+            only the part of the graph needed for the selected outputs is
+            computed. By default all outputs in the graph are computed.
+        batch_size : int, optional
+            If given, push the input through the network in chunks of at most
+            this many examples, writing results into preallocated output
+            arrays. This bounds the memory needed for intermediate values in
+            the graph. By default, all examples are processed at once.
+        max_memory : int, optional
+            If given (and ``batch_size`` is not), choose a chunk size so that
+            the (approximate) memory needed for the activations of all layers
+            in the graph stays below this many bytes.
+        out : dict of ndarray, optional
+            If given, a dictionary mapping output names to preallocated arrays
+            (e.g., a ``numpy.memmap``) where computed values will be written.
+            Arrays for outputs not in this dictionary will be allocated.
+        cache_dir : str, optional
+            If given, compiled feedforward functions are pickled to (and reused
+            from) this directory on disk, so that other processes loading the
+            same network topology can skip compilation. Defaults to the value
+            of the ``THEANETS_CACHE_DIR`` environment variable, if set;
+            otherwise, compiled functions are only cached in memory.
 
         Returns
         -------
@@ -522,16 +673,250 @@ class Network(object):
             correspond to units in the respective layer. The "output" of the
             network is the last element of this list.
         '''
+        if isinstance(outputs, util.basestring):
+            outputs = (outputs, )
         regs = regularizers.from_kwargs(self, **kwargs)
         key = self._hash(regs)
+        if outputs is not None:
+            key = '{}:{}'.format(key, ','.join(outputs))
         if key not in self._functions:
-            outputs, updates = self.build_graph(regs)
-            labels, exprs = list(outputs.keys()), list(outputs.values())
-            logging.info('compiling feed_forward function')
-            self._functions[key] = (labels, theano.function(
-                self.inputs, exprs, updates=updates))
+            graph, updates = self.build_graph(regs)
+            if outputs is not None:
+                graph = dict(util.outputs_matching(graph, outputs))
+                if not graph:
+                    raise KeyError('no graph outputs match {}'.format(outputs))
+            labels, exprs = list(graph.keys()), list(graph.values())
+            self._functions[key] = self._compile(
+                key, labels, exprs, updates, kwargs.get('cache_dir'))
         labels, f = self._functions[key]
-        return dict(zip(labels, f(x)))
+        xs = list(x) if isinstance(x, (tuple, list)) else [x]
+        if batch_size is None and not max_memory and out is None:
+            return dict(zip(labels, f(*xs)))
+        n = xs[0].shape[0]
+        results = dict(out or {})
+        for rows, chunk in self._chunks(xs, batch_size, max_memory):
+            m = chunk[0].shape[0]
+            for label, value in zip(labels, f(*chunk)):
+                if value.ndim == 0 or value.shape[0] != m:
+                    # this output is not computed per example (e.g., a rate
+                    # parameter), so it does not need to be chunked.
+                    results[label] = value
+                    continue
+                if label not in results:
+                    results[label] = np.empty((n, ) + value.shape[1:], value.dtype)
+                results[label][rows] = value
+        return results
+
+    def _chunks(self, x, batch_size=None, max_memory=None):
+        '''Split input data into consecutive chunks of examples.
+
+        Parameters
+        ----------
+        x : ndarray or list of ndarray
+            Input data for the network; a list holds one array per input.
+        batch_size : int, optional
+            Number of examples in each chunk. By default, this is computed from
+            ``max_memory``; if neither is given, all examples form one chunk.
+        max_memory : int, optional
+            Maximum number of bytes to use for network activations; see
+            :func:`_chunk_size`.
+
+        Yields
+        ------
+        rows : slice
+            The rows of the input covered by the chunk.
+        chunk : ndarray or list of ndarray
+            The input data for the chunk, in the same form as ``x``.
+        '''
+        xs = list(x) if isinstance(x, (tuple, list)) else [x]
+        n = xs[0].shape[0]
+        if batch_size is None and max_memory:
+            batch_size = self._chunk_size(xs[0], max_memory)
+        batch_size = batch_size or max(1, n)
+        # an empty input still yields one (empty) chunk, so that callers get
+        # outputs with the correct trailing shape and dtype.
+        for i in range(0, max(1, n), batch_size):
+            rows = slice(i, i + batch_size)
+            chunk = [a[rows] for a in xs]
+            yield rows, chunk if isinstance(x, (tuple, list)) else chunk[0]
+
+    def _chunk_size(self, x, max_memory):
+        '''Compute a number of examples to process within a memory budget.
+
+        The estimate assumes that every layer holds two arrays (e.g., "pre" and
+        "out") of its output shape for each example in a chunk. Dimensions not
+        specified in a layer's shape (e.g., time steps in a recurrent model)
+        are taken from the shape of the input.
+
+        Parameters
+        ----------
+        x : ndarray
+            An array of input data.
+        max_memory : int
+            Maximum number of bytes to use for network activations.
+
+        Returns
+        -------
+        batch_size : int
+            The number of examples to process at once.
+        '''
+        extra = int(np.prod(x.shape[1:-1]))
+        itemsize = np.dtype(util.FLOAT).itemsize
+        per_example = getattr(x, 'nbytes', 0) // max(1, x.shape[0])
+        for layer in self.layers:
+            shape = layer.output_shape
+            size = int(np.prod([d for d in shape if d is not None]))
+            if any(d is None for d in shape):
+                size *= extra
+            per_example += 2 * size * itemsize
+        return max(1, int(max_memory // per_example))
+
+    def _compile(self, key, labels, exprs, updates, cache_dir=None):
+        '''Compile a feedforward function, possibly using an on-disk cache.
+
+        Compiled functions are stored in the cache directory under a filename
+        derived from the graph key, the Theano version, and the relevant Theano
+        configuration values. Loading a cached function skips graph
+        optimization and compilation; the shared variables in the loaded
+        function are swapped for the ones in this network, so the function
+        always computes values using the current network parameters.
+
+        Parameters
+        ----------
+        key : str
+            A string key identifying the computation graph; see :func:`_hash`.
+        labels : list of str
+            Names of the outputs computed by the function.
+        exprs : list of Theano expressions
+            Expressions for the outputs computed by the function.
+        updates : list of update pairs
+            Updates to perform when the function is called.
+        cache_dir : str, optional
+            Directory for storing compiled functions. Defaults to the value of
+            the ``THEANETS_CACHE_DIR`` environment variable. If neither is set,
+            functions are compiled without using a disk cache.
+
+        Returns
+        -------
+        labels : list of str
+            Names of the outputs computed by the function.
+        function : callable
+            A compiled Theano function.
+        '''
+        cache_dir = cache_dir or os.environ.get('THEANETS_CACHE_DIR')
+        path = None
+        if cache_dir:
+            h = hashlib.md5()
+            for s in (key, labels, theano.__version__, sys.version_info[:2],
+                      theano.config.floatX, theano.config.device,
+                      theano.config.mode, theano.config.optimizer):
+                h.update(str(s).encode('utf-8'))
+            path = os.path.join(cache_dir, 'ff-{}.pkl'.format(h.hexdigest()))
+            f = self._load_function(path, labels, exprs)
+            if f is not None:
+                return labels, f
+        logging.info('compiling feed_forward function')
+        f = theano.function(self.inputs, exprs, updates=updates)
+        if path:
+            self._save_function(path, labels, f)
+        return labels, f
+
+    @staticmethod
+    def _save_function(path, labels, f):
+        '''Atomically save a compiled function to a pickle file on disk.
+
+        Pickling a compiled function also pickles the values of its shared
+        variables. The parameters of the network are swapped for empty
+        placeholders of the same type before saving, so cache files do not hold
+        a copy of the model weights.
+        '''
+        dirname = os.path.dirname(path)
+        try:
+            swap = {}
+            for v in f.get_shared():
+                if not isinstance(v.type, theano.tensor.TensorType):
+                    continue
+                empty = np.zeros((0, ) * v.ndim, v.dtype)
+                p = theano.shared(empty, name=v.name, broadcastable=v.broadcastable)
+                if p.type == v.type:
+                    swap[v] = p
+            if swap:
+                f = f.copy(swap=swap)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as handle:
+                pickle.dump((labels, f), handle, -1)
+            os.rename(tmp, path)
+            logging.info('%s: cached compiled function', path)
+        except Exception as err:
+            logging.warning('%s: cannot cache compiled function: %s', path, err)
+
+    def _load_function(self, path, labels, exprs):
+        '''Load a compiled function from disk and bind it to our parameters.
+
+        Returns
+        -------
+        function : callable or None
+            A compiled Theano function, or None if no usable function could be
+            loaded from the given path.
+        '''
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path, 'rb') as handle:
+                cached_labels, f = pickle.load(handle)
+            if list(cached_labels) != list(labels):
+                raise ValueError('cached outputs do not match graph')
+            # the unpickled function holds its own shared variables. swap them
+            # for the shared variables in this network, matching by name (and
+            # then by order, for duplicate names).
+            ours = {}
+            for v in theano.gof.graph.inputs(exprs):
+                if isinstance(v, theano.compile.SharedVariable):
+                    ours.setdefault(v.name, [])
+                    if not any(v is o for o in ours[v.name]):
+                        ours[v.name].append(v)
+            swap = {}
+            for old in f.get_shared():
+                new = ours.get(old.name, [])
+                if not new:
+                    raise ValueError('no shared variable "{}"'.format(old.name))
+                new = new.pop(0)
+                # cached functions hold empty placeholders for parameters, so
+                # only the types (not the shapes) of the variables can match.
+                if old.type != new.type or old.ndim != new.ndim:
+                    raise ValueError('shared variable "{}" mismatch'.format(old.name))
+                swap[old] = new
+            if any(ours.values()):
+                raise ValueError('graph has unbound shared variables')
+            f = f.copy(swap=swap)
+        except Exception as err:
+            logging.warning('%s: cannot use cached function: %s', path, err)
+            return None
+        logging.info('%s: loaded compiled function', path)
+        return f
+
+    def _compute(self, x, name, out=None, **kwargs):
+        '''Compute just one named output of the graph for the given input.
+
+        Parameters
+        ----------
+        x : ndarray
+            An array containing data to be fed into the network.
+        name : str
+            The fully-scoped name of the graph output to compute.
+        out : ndarray, optional
+            If given, write the computed values into this preallocated array.
+
+        Returns
+        -------
+        y : ndarray
+            The values of the named graph output.
+        '''
+        if out is not None:
+            out = {name: out}
+        return self.feed_forward(x, outputs=name, out=out, **kwargs)[name]
 
     def predict(self, x, **kwargs):
         '''Compute a forward pass of the inputs, returning the network output.
@@ -544,6 +929,15 @@ class Network(object):
             An array containing data to be fed into the network. Multiple
             examples are arranged as rows in this array, with columns containing
             the variables for each example.
+        batch_size : int, optional
+            Process the input in chunks of this many examples. See
+            :func:`feed_forward`.
+        max_memory : int, optional
+            Choose a chunk size to bound memory use to this many bytes. See
+            :func:`feed_forward`.
+        out : ndarray, optional
+            If given, write the output into this preallocated array (e.g., a
+            ``numpy.memmap``).
 
         Returns
         -------
@@ -552,11 +946,37 @@ class Network(object):
             Rows in this array correspond to examples, and columns to output
             variables.
         '''
-        return self.feed_forward(x, **kwargs)[self.layers[-1].output_name]
+        return self._compute(x, self.layers[-1].output_name, **kwargs)
+
+    def predict_iter(self, batches, prefetch=1, **kwargs):
+        '''Compute network outputs lazily for a sequence of input batches.
+
+        While the output for one batch is being computed, the next batch(es)
+        are fetched from the input sequence on a background thread.
+
+        Parameters
+        ----------
+        batches : iterable of ndarray
+            A sequence (e.g., a generator) of input arrays.
+        prefetch : int, optional
+            Number of input batches to fetch ahead. Defaults to 1.
+
+        Yields
+        ------
+        y : ndarray
+            The result of :func:`predict` for each input batch. Additional
+            keyword arguments are passed to :func:`predict`.
+        '''
+        for x in util.prefetch(batches, prefetch):
+            yield self.predict(x, **kwargs)
 
     def score(self, x, y, w=None, **kwargs):
         '''Compute R^2 coefficient of determination for a given labeled input.
 
+        If ``batch_size`` or ``max_memory`` is given, the prediction and the sums
+        in the score are computed one chunk of examples at a time. Other keyword
+        arguments are passed to :func:`predict`.
+
         Parameters
         ----------
         x : ndarray (num-examples, num-inputs)
@@ -574,11 +994,20 @@ class Network(object):
             The R^2 correlation between the prediction of this netork and its
             target output.
         '''
-        u = y - self.predict(x, **kwargs)
-        v = y - y.mean()
-        if w is None:
-            w = np.ones_like(u)
-        return 1 - (w * u * u).sum() / (w * v * v).sum()
+        batch_size = kwargs.pop('batch_size', None)
+        max_memory = kwargs.pop('max_memory', None)
+        mean = y.mean()
+        uu, vv = [], []
+        for rows, chunk in self._chunks(x, batch_size, max_memory):
+            u = y[rows] - self.predict(chunk, **kwargs)
+            v = y[rows] - mean
+            if w is None:
+                uu.append((u * u).sum())
+                vv.append((v * v).sum())
+            else:
+                uu.append((w[rows] * u * u).sum())
+                vv.append((w[rows] * v * v).sum())
+        return 1 - np.sum(uu) / np.sum(vv)
 
     def __getstate__(self):
         return (self.layers, self.losses)
@@ -587,52 +1016,86 @@ class Network(object):
         self.layers, self.losses = state
         self._graphs = {}
         self._functions = {}
+        # the random seed is not saved, so use the constructor's default.
+        self._rng = 13
 
-    def save(self, filename_or_handle):
-        '''Save the state of this network to a pickle file on disk.
+    def save(self, filename_or_handle, format='pickle'):
+        '''Save the state of this network to a file on disk.
 
         Parameters
         ----------
         filename_or_handle : str or file handle
-            Save the state of this network to a pickle file. If this parameter
-            is a string, it names the file where the pickle will be saved. If it
-            is a file-like object, this object will be used for writing the
-            pickle. If the filename ends in ".gz" then the output will
+            Save the state of this network to a file. If this parameter is a
+            string, it names the file where the model will be saved. If it is a
+            file-like object, this object will be used for writing the model.
+            If the filename ends in ".gz" then a pickled model will
             automatically be gzipped.
+        format : {'pickle', 'arrays'}, optional
+            Format of the saved model. The default, ``'pickle'``, pickles the
+            entire network. ``'arrays'`` stores layer specifications as JSON,
+            followed by the raw bytes of each parameter array; parameters in
+            such a file can be memory-mapped when loading (see
+            :mod:`theanets.storage`).
         '''
+        if format not in ('pickle', 'arrays'):
+            raise util.ConfigurationError(
+                'unknown model format "{}"'.format(format))
         if isinstance(filename_or_handle, util.basestring):
-            opener = gzip.open if filename_or_handle.lower().endswith('.gz') else open
+            opener = open
+            if format == 'pickle' and filename_or_handle.lower().endswith('.gz'):
+                opener = gzip.open
             handle = opener(filename_or_handle, 'wb')
         else:
             handle = filename_or_handle
-        pickle.dump(self, handle, -1)
+        if format == 'arrays':
+            storage.save(self, handle)
+        else:
+            pickle.dump(self, handle, -1)
         if isinstance(filename_or_handle, util.basestring):
             handle.close()
         logging.info('%s: saved model', filename_or_handle)
 
     @classmethod
-    def load(cls, filename_or_handle):
+    def load(cls, filename_or_handle, mmap=False):
         '''Load a saved network from disk.
 
         Parameters
         ----------
         filename_or_handle : str or file handle
-            Load the state of this network from a pickle file. If this parameter
-            is a string, it names the file where the pickle will be saved. If it
-            is a file-like object, this object will be used for reading the
-            pickle. If the filename ends in ".gz" then the output will
-            automatically be gunzipped.
+            Load the state of this network from a file. If this parameter is a
+            string, it names the file where the model was saved. If it is a
+            file-like object, this object will be used for reading the model.
+            If the filename ends in ".gz" then the file will automatically be
+            gunzipped. Models saved in either the pickle or the arrays format
+            are detected automatically, as are delta checkpoints saved during
+            training (see :mod:`theanets.checkpoint`), which are applied to
+            their base model. The format can only be detected for handles that
+            support seeking; models are unpickled from other handles (e.g.,
+            pipes or sockets).
+        mmap : bool, optional
+            If True, memory-map the parameter arrays of a model saved using
+            ``format='arrays'`` instead of reading them into memory. Processes
+            that map the same file share one copy of the parameter values.
+            Requires a filename. Defaults to False.
         '''
         assert not isinstance(cls, Network), \
             'cannot load an instance! say instead: net = Network.load(source)'
-        if isinstance(filename_or_handle, util.basestring):
+        if isinstance(filename_or_handle, util.basestring) and \
+           checkpoint.is_delta_file(filename_or_handle):
+            model = checkpoint.load_delta(filename_or_handle, mmap=mmap)
+        elif isinstance(filename_or_handle, util.basestring):
             opener = gzip.open if filename_or_handle.lower().endswith('.gz') else open
-            handle = opener(filename_or_handle, 'rb')
+            with opener(filename_or_handle, 'rb') as handle:
+                arrays = storage.is_array_file(handle)
+                if not arrays:
+                    model = pickle.load(handle)
+            if arrays:
+                model = storage.load(filename_or_handle, mmap=mmap)
+        elif _seekable(filename_or_handle) and \
+                storage.is_array_file(filename_or_handle):
+            model = storage.load(filename_or_handle, mmap=mmap)
         else:
-            handle = filename_or_handle
-        model = pickle.load(handle)
-        if isinstance(filename_or_handle, util.basestring):
-            handle.close()
+            model = pickle.load(filename_or_handle)
         logging.info('%s: loaded model', filename_or_handle)
         return model
 
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+
+r'''This module contains a NumPy-only engine for running trained networks.
+
+Running a :class:`Network <theanets.graph.Network>` requires Theano, which
+must be imported and must compile a function before computing anything. For
+serving small models, this overhead can dominate the cost of computing a
+prediction. The code here walks the layers of a trained network and builds an
+:class:`Executor` that computes the same outputs using only NumPy, reusing
+preallocated buffers across calls.
+
+Examples
+--------
+
+Export a trained network and save the executor to disk:
+
+>>> net = theanets.Regressor([10, 20, 3])
+>>> net.train(...)
+>>> exe = theanets.inference.export(net)
+>>> exe.save('model.npz')
+
+On a serving host, load the executor and compute predictions:
+
+>>> exe = Executor.load('model.npz')
+>>> y = exe.predict(x)
+
+This module depends only on NumPy (it does not import Theano, or any other
+part of ``theanets``), so it can be copied on its own to hosts that do not
+have Theano installed.
+
+Supported layer types are :class:`Input <theanets.layers.base.Input>`,
+:class:`Feedforward <theanets.layers.feedforward.Feedforward>`,
+:class:`Classifier <theanets.layers.feedforward.Classifier>`,
+:class:`Tied <theanets.layers.feedforward.Tied>`,
+:class:`Concatenate <theanets.layers.base.Concatenate>`,
+:class:`Flatten <theanets.layers.base.Flatten>`,
+:class:`Reshape <theanets.layers.base.Reshape>`,
+:class:`Product <theanets.layers.base.Product>`,
+:class:`Conv1 <theanets.layers.convolution.Conv1>`,
+:class:`Conv2 <theanets.layers.convolution.Conv2>`,
+:class:`RNN <theanets.layers.recurrent.RNN>`,
+:class:`GRU <theanets.layers.recurrent.GRU>`, and
+:class:`LSTM <theanets.layers.recurrent.LSTM>`.
+'''
+
+import json
+import numpy as np
+
+
+def _sigmoid(a):
+    with np.errstate(over='ignore'):
+        np.negative(a, out=a)
+        np.exp(a, out=a)
+    a += 1
+    np.reciprocal(a, out=a)
+
+
+def _softmax(a):
+    a -= a.max(axis=-1, keepdims=True)
+    np.exp(a, out=a)
+    a /= a.sum(axis=-1, keepdims=True)
+
+
+def _norm_mean(a):
+    a -= a.mean(axis=-1, keepdims=True)
+
+
+def _norm_max(a):
+    a /= abs(a).max(axis=-1, keepdims=True) + 1e-8
+
+
+def _norm_std(a):
+    a /= a.std(axis=-1, keepdims=True) + 1e-8
+
+
+def _norm_z(a):
+    s = a.std(axis=-1, keepdims=True) + 1e-8
+    a -= a.mean(axis=-1, keepdims=True)
+    a /= s
+
+
+COMMON = {
+    # s-shaped
+    'tanh':        lambda a: np.tanh(a, out=a),
+    'logistic':    _sigmoid,
+    'sigmoid':     _sigmoid,
+
+    # softmax (typically for classification)
+    'softmax':     _softmax,
+
+    # linear variants
+    'linear':      lambda a: None,
+    'softplus':    lambda a: np.logaddexp(0, a, out=a),
+    'relu':        lambda a: np.maximum(a, 0, out=a),
+    'rect:max':    lambda a: np.maximum(a, 0, out=a),
+    'rect:min':    lambda a: np.minimum(a, 1, out=a),
+    'rect:minmax': lambda a: np.clip(a, 0, 1, out=a),
+
+    # batch normalization
+    'norm:mean':   _norm_mean,
+    'norm:max':    _norm_max,
+    'norm:std':    _norm_std,
+    'norm:z':      _norm_z,
+}
+'''In-place NumPy versions of :data:`theanets.activations.COMMON`.'''
+
+
+def _activation(name, find):
+    '''Build an in-place NumPy activation function.
+
+    Parameters
+    ----------
+    name : str
+        Name of the activation function, as given to
+        :func:`theanets.activations.build`.
+    find : callable
+        A callable that returns a parameter array, given its short name.
+
+    Returns
+    -------
+    activate : callable
+        A callable that applies the activation, in place, to an array.
+    '''
+    if '+' in name:
+        fs = [_activation(n, find) for n in name.split('+')]
+
+        def composed(a):
+            for f in fs:
+                f(a)
+        return composed
+
+    if name in COMMON:
+        return COMMON[name]
+
+    key = name.lower()
+    if key in ('prelu', 'leaky-relu'):
+        def prelu(a):
+            a *= np.where(a < 0, np.exp(find('leak')), 1)
+        return prelu
+    if key in ('lgrelu', 'leaky-gain-relu'):
+        def lgrelu(a):
+            a *= np.where(a < 0, np.exp(find('leak')), np.exp(find('gain')))
+        return lgrelu
+    if key == 'elu':
+        def elu(a):
+            neg = np.exp(find('gain')) * (np.exp(np.minimum(a, 0)) - 1)
+            np.copyto(a, neg, where=a < 0)
+        return elu
+    if key.startswith('maxout'):
+        def maxout(a):
+            a[...] = (a[..., None] * find('slope') + find('intercept')).max(axis=-1)
+        return maxout
+
+    raise ValueError('cannot export activation "{}"'.format(name))
+
+
+def _windows(x, size, stride):
+    '''Build a strided view of the sliding windows along axis 1 of x.'''
+    n = x.shape[1] - size + 1
+    shape = (x.shape[0], n, size) + x.shape[2:]
+    strides = (x.strides[0], x.strides[1], x.strides[1]) + x.strides[2:]
+    return np.lib.stride_tricks.as_strided(x, shape, strides)[:, ::stride]
+
+
+def _batch_major(x):
+    '''Convert a (time, batch, ...) array to a (batch, time, ...) view.'''
+    return x.swapaxes(0, 1)
+
+
+def _pad(x, axis, size):
+    '''Zero-pad an array on both sides of the given axis.'''
+    pad = [(0, 0)] * x.ndim
+    pad[axis] = (size, size)
+    return np.pad(x, pad, mode='constant')
+
+
+class Executor(object):
+    '''Compute the outputs of an exported network using only NumPy.
+
+    Parameters
+    ----------
+    layers : list of dict
+        Specifications of the layers in the network, in graph order. These
+        are usually generated by :func:`export`.
+    params : dict
+        A dictionary mapping fully-scoped parameter names (e.g., ``'hid1.w'``)
+        to parameter arrays.
+
+    Attributes
+    ----------
+    layers : list of dict
+        Specifications of the layers in the network.
+    params : dict
+        A dictionary mapping parameter names to arrays.
+    output_name : str
+        The fully-scoped name of the network's default output.
+    '''
+
+    def __init__(self, layers, params):
+        self.layers = layers
+        self.params = params
+        self.output_name = '{}:out'.format(layers[-1]['name'])
+        self.dtype = next(iter(params.values())).dtype if params else np.float32
+        self._buffers = {}
+        self._activations = {}
+        for spec in layers:
+            self._activations[spec['name']] = _activation(
+                spec['activation'],
+                lambda key, name=spec['name']: self.params['{}.{}'.format(name, key)])
+
+    def save(self, filename_or_handle):
+        '''Save this executor to an ``.npz`` file on disk.
+
+        Parameters
+        ----------
+        filename_or_handle : str or file handle
+            Save the layer specifications and parameters to this file.
+        '''
+        names = sorted(self.params)
+        arrays = {'arr_{}'.format(i): self.params[n] for i, n in enumerate(names)}
+        meta = json.dumps(dict(layers=self.layers, params=names))
+        np.savez(filename_or_handle, __meta__=np.array(meta), **arrays)
+
+    @classmethod
+    def load(cls, filename_or_handle):
+        '''Load an executor from an ``.npz`` file on disk.
+
+        Parameters
+        ----------
+        filename_or_handle : str or file handle
+            Load the layer specifications and parameters from this file.
+
+        Returns
+        -------
+        executor : :class:`Executor`
+            An executor for the saved network.
+        '''
+        with np.load(filename_or_handle) as data:
+            meta = json.loads(str(data['__meta__']))
+            params = {n: data['arr_{}'.format(i)]
+                      for i, n in enumerate(meta['params'])}
+        return cls(meta['layers'], params)
+
+    def _buffer(self, name, shape):
+        '''Get a (reused) array of the given shape for holding a value.'''
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.empty(shape, self.dtype)
+        return buf
+
+    def feed_forward(self, x):
+        '''Compute a forward pass of all layers from the given input.
+
+        Parameters
+        ----------
+        x : ndarray
+            An array containing data to be fed into the network.
+
+        Returns
+        -------
+        outputs : dict of ndarray
+            A dictionary mapping fully-scoped output names (e.g.,
+            ``'hid1:out'``) to values. The arrays in this dictionary are
+            buffers that will be overwritten by the next call with the same
+            input shape; copy them if they need to be kept.
+        '''
+        values = {}
+        for spec in self.layers:
+            method = getattr(self, '_' + spec['form'], None)
+            if method is None:
+                raise ValueError('cannot compute layer type "{}"'.format(spec['form']))
+            outputs = method(spec, x, values)
+            for key, value in outputs.items():
+                values['{}:{}'.format(spec['name'], key)] = value
+        return values
+
+    def predict(self, x):
+        '''Compute a forward pass of the inputs, returning the network output.
+
+        Parameters
+        ----------
+        x : ndarray
+            An array containing data to be fed into the network.
+
+        Returns
+        -------
+        y : ndarray
+            The values of the network's default output.
+        '''
+        return self.feed_forward(x)[self.output_name].copy()
+
+    def _find(self, spec, key):
+        return self.params['{}.{}'.format(spec['name'], key)]
+
+    def _activate(self, spec, pre, name='out'):
+        out = self._buffer('{}:{}'.format(spec['name'], name), pre.shape)
+        np.copyto(out, pre)
+        self._activations[spec['name']](out)
+        return out
+
+    def _affine(self, spec, xws, bias):
+        '''Compute a sum of dot products plus a bias, into a buffer.'''
+        xws = list(xws)
+        x, w = xws[0]
+        pre = self._buffer(spec['name'] + ':pre', x.shape[:-1] + w.shape[1:])
+        np.dot(x, w, out=pre)
+        for x, w in xws[1:]:
+            pre += np.dot(x, w)
+        pre += bias
+        return pre
+
+    def _input(self, spec, x, values):
+        return dict(out=np.asarray(x, self.dtype))
+
+    def _feedforward(self, spec, x, values):
+        names = spec['inputs']
+        weight = 'w' if len(names) == 1 else 'w_{}'
+        pre = self._affine(spec, ((values[n], self._find(spec, weight.format(n)))
+                                  for n in names), self._find(spec, 'b'))
+        return dict(pre=pre, out=self._activate(spec, pre))
+
+    _classifier = _feedforward
+
+    def _tied(self, spec, x, values):
+        w = self.params['{}.w'.format(spec['partner'])].T
+        pre = self._affine(spec, [(values[spec['inputs'][0]], w)], self._find(spec, 'b'))
+        return dict(pre=pre, out=self._activate(spec, pre))
+
+    def _concatenate(self, spec, x, values):
+        return dict(out=np.concatenate([values[n] for n in spec['inputs']], axis=-1))
+
+    def _flatten(self, spec, x, values):
+        z = values[spec['inputs'][0]]
+        return dict(out=z.reshape((z.shape[0], -1)))
+
+    def _reshape(self, spec, x, values):
+        z = values[spec['inputs'][0]]
+        return dict(out=z.reshape([z.shape[0]] + list(spec['shape'])))
+
+    def _product(self, spec, x, values):
+        out = values[spec['inputs'][0]].copy()
+        for n in spec['inputs'][1:]:
+            out *= values[n]
+        return dict(out=out)
+
+    def _conv1(self, spec, x, values):
+        # input is (batch, time, input); weights are (output, input, 1, k).
+        z = values[spec['inputs'][0]]
+        w = self._find(spec, 'w')
+        k = w.shape[-1]
+        if spec['border_mode'] == 'full':
+            z = _pad(z, 1, k - 1)
+        # theano convolutions flip the filters, so we do too.
+        windows = _windows(z, k, spec['stride'][1])
+        kernel = w[:, :, 0, ::-1].transpose(2, 1, 0)
+        pre = np.tensordot(windows, kernel, axes=([2, 3], [0, 1]))
+        pre += self._find(spec, 'b')
+        return dict(pre=pre, out=self._activate(spec, pre))
+
+    def _conv2(self, spec, x, values):
+        # input is (batch, width, height, input); weights are (output, input,
+        # kw, kh).
+        z = values[spec['inputs'][0]]
+        w = self._find(spec, 'w')
+        kw, kh = w.shape[-2:]
+        if spec['border_mode'] == 'full':
+            z = _pad(_pad(z, 1, kw - 1), 2, kh - 1)
+        rows = _windows(z, kw, spec['stride'][0])
+        # rows is (batch, width', kw, height, input); window over height too.
+        windows = _windows(rows.transpose(0, 3, 1, 2, 4), kh, spec['stride'][1])
+        # windows is (batch, height', kh, width', kw, input).
+        kernel = w[:, :, ::-1, ::-1].transpose(3, 2, 1, 0)
+        pre = np.tensordot(windows, kernel, axes=([2, 4, 5], [0, 1, 2]))
+        pre = np.ascontiguousarray(pre.transpose(0, 2, 1, 3))
+        pre += self._find(spec, 'b')
+        return dict(pre=pre, out=self._activate(spec, pre))
+
+    def _initial(self, spec, values, key, batch, size):
+        name = spec.get(key)
+        if name:
+            return np.array(values[name], self.dtype)
+        return np.zeros((batch, size), self.dtype)
+
+    def _times(self, spec, steps):
+        '''Get time indices in the order processed by a recurrent layer.'''
+        if 'back' in (spec.get('direction') or '').lower():
+            return range(steps - 1, -1, -1)
+        return range(steps)
+
+    def _rnn(self, spec, x, values):
+        z = values[spec['inputs'][0]]
+        batch, steps = z.shape[:2]
+        n = spec['size']
+        hh = self._find(spec, 'hh')
+        xh = self._affine(spec, [(z, self._find(spec, 'xh'))], self._find(spec, 'b'))
+        pre = self._buffer(spec['name'] + ':scan-pre', (steps, batch, n))
+        out = self._buffer(spec['name'] + ':scan-out', (steps, batch, n))
+        h = self._initial(spec, values, 'h_0', batch, n)
+        activate = self._activations[spec['name']]
+        for i, t in enumerate(self._times(spec, steps)):
+            p = pre[i]
+            np.dot(h, hh, out=p)
+            p += xh[:, t]
+            h = out[i]
+            h[...] = p
+            activate(h)
+        return dict(pre=_batch_major(pre), out=_batch_major(out))
+
+    def _gru(self, spec, x, values):
+        z = values[spec['inputs'][0]]
+        batch, steps = z.shape[:2]
+        n = spec['size']
+        hh = self._find(spec, 'hh')
+        hrz = np.concatenate([self._find(spec, 'hr'), self._find(spec, 'hz')], axis=1)
+        xs = self._affine(spec, [(z, self._find(spec, 'w'))], self._find(spec, 'b'))
+        pre, hid, rate, out = (
+            self._buffer('{}:scan-{}'.format(spec['name'], k), (steps, batch, n))
+            for k in ('pre', 'hid', 'rate', 'out'))
+        h = self._initial(spec, values, 'h_0', batch, n)
+        rz = np.empty((batch, 2 * n), self.dtype)
+        r = rz[:, :n]
+        activate = self._activations[spec['name']]
+        for i, t in enumerate(self._times(spec, steps)):
+            np.dot(h, hrz, out=rz)
+            rz += xs[:, t, n:]
+            _sigmoid(rz)
+            g = rate[i]
+            g[...] = rz[:, n:]
+            p = pre[i]
+            np.dot(r * h, hh, out=p)
+            p += xs[:, t, :n]
+            c = hid[i]
+            c[...] = p
+            activate(c)
+            o = out[i]
+            np.subtract(c, h, out=o)
+            o *= g
+            o += h
+            h = o
+        return dict(pre=_batch_major(pre), hid=_batch_major(hid),
+                    rate=_batch_major(rate), out=_batch_major(out))
+
+    def _lstm(self, spec, x, values):
+        z = values[spec['inputs'][0]]
+        batch, steps = z.shape[:2]
+        n = spec['size']
+        hh, ci, cf, co = (self._find(spec, k) for k in ('hh', 'ci', 'cf', 'co'))
+        xh = self._affine(spec, [(z, self._find(spec, 'xh'))], self._find(spec, 'b'))
+        out, cell = (
+            self._buffer('{}:scan-{}'.format(spec['name'], k), (steps, batch, n))
+            for k in ('out', 'cell'))
+        h = self._initial(spec, values, 'h_0', batch, n)
+        c = self._initial(spec, values, 'c_0', batch, n)
+        gates = np.empty((batch, 4 * n), self.dtype)
+        for i, t in enumerate(self._times(spec, steps)):
+            np.dot(h, hh, out=gates)
+            gates += xh[:, t]
+            xi, xf, xc, xo = (gates[:, j*n:(j+1)*n] for j in range(4))
+            xi += c * ci
+            _sigmoid(xi)
+            xf += c * cf
+            _sigmoid(xf)
+            np.tanh(xc, out=xc)
+            c_t = cell[i]
+            np.multiply(xf, c, out=c_t)
+            c_t += xi * xc
+            xo += c_t * co
+            _sigmoid(xo)
+            h = out[i]
+            np.tanh(c_t, out=h)
+            h *= xo
+            c = c_t
+        return dict(out=_batch_major(out), cell=_batch_major(cell))
+
+
+EXPORTED_ATTRIBUTES = ('partner', 'filter_size', 'stride', 'border_mode',
+                       'direction', 'h_0', 'c_0')
+
+
+def export(network):
+    '''Build a NumPy executor for a network.
+
+    Parameters
+    ----------
+    network : :class:`theanets.graph.Network`
+        A network model to export.
+
+    Raises
+    ------
+    ValueError :
+        If the network contains a layer or activation type that cannot be
+        computed using the NumPy executor.
+
+    Returns
+    -------
+    executor : :class:`Executor`
+        An executor that computes the outputs of the network using NumPy.
+    '''
+    layers = []
+    for layer in network.layers:
+        form = layer.__class__.__name__.lower()
+        if not hasattr(Executor, '_' + form):
+            raise ValueError('cannot export layer type "{}"'.format(form))
+        if getattr(layer, 'mask', None):
+            raise ValueError('cannot export masked layer "{}"'.format(layer.name))
+        activation = layer.kwargs.get('activation', 'relu')
+        spec = dict(
+            form=form,
+            name=layer.name,
+            inputs=list(layer._input_shapes),
+            activation=getattr(activation, 'name', activation),
+            shape=list(layer.output_shape),
+            size=layer.output_shape[-1],
+        )
+        for attr in EXPORTED_ATTRIBUTES:
+            value = getattr(layer, attr, layer.kwargs.get(attr))
+            if hasattr(value, 'name'):
+                value = value.name
+            if isinstance(value, tuple):
+                value = list(value)
+            if value is not None:
+                spec[attr] = value
+        layers.append(spec)
+        _activation(spec['activation'], lambda key: None)
+    params = {p.name: p.get_value() for p in network.params}
+    return Executor(layers, params)
@@ -116,6 +116,7 @@ class Layer(util.Registrar(str('Base'), (), {})):
             self.rng = np.random.RandomState(self.rng)
 
         self._params = []
+        self._presets = {}
         self._input_shapes = {}
         self._output_shapes = {}
 
@@ -249,9 +250,12 @@ class Layer(util.Registrar(str('Base'), (), {})):
             A computation network in which this layer is to be bound.
         reset : bool, optional
             If ``True`` (the default), reset the resolved layers for this layer.
-        initialize : bool, optional
+        initialize : bool or dict, optional
             If ``True`` (the default), initialize the parameters for this layer
-            by calling :func:`setup`.
+            by calling :func:`setup`. If this is a dictionary mapping parameter
+            names to arrays, parameters named in the dictionary are created
+            directly from these arrays (and removed from the dictionary) instead
+            of being randomly initialized.
 
         Raises
         ------
@@ -267,8 +271,10 @@ class Layer(util.Registrar(str('Base'), (), {})):
         self.resolve_outputs()
         self.activate = activations.build(
             self.kwargs.get('activation', 'relu'), self)
-        if initialize:
+        if initialize or isinstance(initialize, dict):
+            self._presets = initialize if isinstance(initialize, dict) else {}
             self.setup()
+            self._presets = {}
         self.log()
 
     def resolve_inputs(self, layers):
@@ -400,6 +406,36 @@ class Layer(util.Registrar(str('Base'), (), {})):
                 return p
         raise KeyError(key)
 
+    def _add_preset(self, name, shape):
+        '''Add a parameter using an array given to :func:`bind`, if any.
+
+        Parameters
+        ----------
+        name : str
+            Name of the parameter to add.
+        shape : tuple of int
+            Expected shape of the parameter.
+
+        Raises
+        ------
+        theanets.util.ConfigurationError :
+            If the given array does not have the expected shape.
+
+        Returns
+        -------
+        added : bool
+            True if the parameter was created from a given array.
+        '''
+        value = self._presets.pop(self._fmt(name), None)
+        if value is None:
+            return False
+        if tuple(value.shape) != tuple(shape):
+            raise util.ConfigurationError(
+                'parameter "{}" has shape {}, expected {}'.format(
+                    self._fmt(name), tuple(value.shape), tuple(shape)))
+        self._params.append(theano.shared(value, name=self._fmt(name), borrow=True))
+        return True
+
     def add_weights(self, name, nin, nout, mean=0, std=0, sparsity=0, diagonal=0):
         '''Helper method to create a new weight matrix.
 
@@ -422,6 +458,8 @@ class Layer(util.Registrar(str('Base'), (), {})):
             Initialize weights to a matrix of zeros with this value along the
             diagonal. Defaults to None, which initializes all weights randomly.
         '''
+        if self._add_preset(name, (nin, nout)):
+            return
         glorot = 1 / np.sqrt(nin + nout)
         m = self.kwargs.get(
             'mean_{}'.format(name), self.kwargs.get('mean', mean))
@@ -450,6 +488,8 @@ class Layer(util.Registrar(str('Base'), (), {})):
         std : float, optional
             Standard deviation for randomly-initialized biases. Defaults to 1.
         '''
+        if self._add_preset(name, (size, )):
+            return
         mean = self.kwargs.get('mean_{}'.format(name), mean)
         std = self.kwargs.get('std_{}'.format(name), std)
         self._params.append(theano.shared(
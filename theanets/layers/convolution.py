@@ -37,8 +37,8 @@ class Convolution(base.Layer):
     '''
 
     def __init__(self, filter_size, stride=(1, 1), border_mode='valid', **kwargs):
-        self.filter_size = filter_size
-        self.stride = stride
+        self.filter_size = tuple(filter_size)
+        self.stride = tuple(stride)
         self.border_mode = border_mode
         super(Convolution, self).__init__(**kwargs)
 
@@ -55,6 +55,13 @@ class Convolution(base.Layer):
                      inputs)
         logging.info('learnable parameters: %d', self.log_params())
 
+    def to_spec(self):
+        spec = super(Convolution, self).to_spec()
+        spec.update(filter_size=self.filter_size,
+                    stride=self.stride,
+                    border_mode=self.border_mode)
+        return spec
+
     def add_conv_weights(self, name, mean=0, std=None, sparsity=0):
         '''Add a convolutional weight array to this layer's parameters.
 
@@ -72,6 +79,8 @@ class Convolution(base.Layer):
         '''
         nin = self.input_size
         nout = self.output_size
+        if self._add_preset(name, (nout, nin) + self.filter_size):
+            return
         mean = self.kwargs.get(
             'mean_{}'.format(name),
             self.kwargs.get('mean', mean))
@@ -157,6 +166,11 @@ class Conv1(Convolution):
 
         return dict(pre=pre, out=self.activate(pre)), []
 
+    def to_spec(self):
+        spec = super(Conv1, self).to_spec()
+        spec.update(filter_size=self.filter_size[1], stride=self.stride[1])
+        return spec
+
 
 class Conv2(Convolution):
     '''2-dimensional convolutions run over two data axes.
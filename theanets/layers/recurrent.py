@@ -63,20 +63,45 @@ class Recurrent(base.Layer):
         to the given number of time steps. Defaults to -1, which imposes no
         limit.
 
+    unroll : bool or int, optional
+        If True, expand the loop over time steps into a static graph with one
+        copy of the step computation per time step. This requires the number
+        of time steps to be known from the shape of the layer input. If an
+        integer greater than 1, compute this many time steps in each iteration
+        of the loop. Unrolling avoids per-iteration loop overhead, which can
+        dominate the cost of short sequences with small layers, at the expense
+        of a larger computation graph. Defaults to None, which computes one
+        time step per loop iteration.
+
     h_0 : str, optional
         If provided, this should name a network output that provides the initial
         state for the network's hidden units. Defaults to ``None``, which uses
         an all-zero initial state.
+
+    mask : str, optional
+        If provided, this should name a network output that provides a mask of
+        shape (num-examples, num-time-steps) for the input. Time steps where
+        the mask is zero (e.g., padding at the end of a short sequence in a
+        batch) do not update the state of the layer. Defaults to ``None``,
+        which updates the state at every time step.
     '''
 
-    def __init__(self, h_0=None, **kwargs):
+    # defaults for layers pickled before these attributes existed.
+    mask = None
+    _step_states = None
+
+    def __init__(self, h_0=None, mask=None, **kwargs):
         super(Recurrent, self).__init__(**kwargs)
         self.h_0 = h_0
+        self.mask = mask
+        self._step_states = None
 
     def resolve_inputs(self, layers):
         super(Recurrent, self).resolve_inputs(layers)
         if self.h_0:
             self.h_0, _ = self._resolve_shape(self.h_0, layers)
+        if self.mask:
+            self.mask, _ = self._resolve_shape(self.mask, layers)
 
     def add_weights(self, name, nin, nout, mean=0, std=0, sparsity=0, radius=0,
                     diagonal=0):
@@ -101,6 +126,8 @@ class Recurrent(base.Layer):
             If nonzero, rescale initial weights to have this spectral radius.
             Defaults to 0.
         '''
+        if self._add_preset(name, (nin, nout)):
+            return
         glorot = 1 / np.sqrt(nin + nout)
         mean = self.kwargs.get(
             'mean_{}'.format(name), self.kwargs.get('mean', mean))
@@ -121,7 +148,8 @@ class Recurrent(base.Layer):
             arr = util.random_matrix(nin, nout, mean, std, sparsity=s, rng=self.rng)
         self._params.append(theano.shared(arr, name=self._fmt(name)))
 
-    def _scan(self, inputs, outputs, name='scan', step=None, constants=None):
+    def _scan(self, inputs, outputs, name='scan', step=None, constants=None,
+              mask=None):
         '''Helper method for defining a basic loop in theano.
 
         Parameters
@@ -145,6 +173,10 @@ class Recurrent(base.Layer):
             The callable to apply in the loop. Defaults to :func:`self._step`.
         constants : sequence of tensor, optional
             A sequence of parameters, if any, needed by the step function.
+        mask : theano expression, optional
+            A (batch, time) mask for the inputs. If given, at time steps where
+            the mask is zero the tapped outputs of the scan keep their values
+            from the previous time step.
 
         Returns
         -------
@@ -153,6 +185,30 @@ class Recurrent(base.Layer):
         updates : sequence of update tuples
             A sequence of updates to apply inside a theano function.
         '''
+        if self._step_states is not None:
+            return self._scan_once(inputs, outputs, step or self._step,
+                                   list(constants or []))
+        unroll = self.kwargs.get('unroll')
+        if unroll is True or (unroll and unroll > 1):
+            return self._scan_unrolled(inputs, outputs, name, step or self._step,
+                                       list(constants or []), mask)
+        init = self._initial_states(outputs)
+        step = step or self._step
+        if mask is not None:
+            step = self._masked(step, len(inputs), outputs)
+            inputs = list(inputs) + [mask.dimshuffle(1, 0)]
+        return theano.scan(
+            step,
+            name=self._fmt(name),
+            sequences=inputs,
+            outputs_info=init,
+            non_sequences=constants,
+            go_backwards='back' in self.kwargs.get('direction', '').lower(),
+            truncate_gradient=self.kwargs.get('bptt_limit', -1),
+        )
+
+    def _initial_states(self, outputs):
+        '''Create initial values for the outputs of a scan.'''
         init = []
         for i, x in enumerate(outputs):
             ndim = getattr(x, 'ndim', -1)
@@ -165,15 +221,236 @@ class Recurrent(base.Layer):
                     name=self._fmt('init{}'.format(i))), x, axis=0))
                 continue
             raise ValueError('cannot handle input {} for scan!'.format(x))
-        return theano.scan(
-            step or self._step,
+        return init
+
+    def _scan_unrolled(self, inputs, outputs, name, step, constants, mask):
+        '''Build the loop of a scan with several time steps per iteration.
+
+        If the ``unroll`` setting for this layer is True, the loop is replaced
+        entirely by a static sequence of steps. Otherwise, each iteration of
+        the loop computes ``unroll`` time steps; inputs are padded with masked
+        time steps to a multiple of this number if needed.
+        '''
+        unroll = self.kwargs['unroll']
+        if self.kwargs.get('bptt_limit', -1) > 0:
+            raise util.ConfigurationError(
+                'layer "{}": cannot unroll with a bptt_limit'.format(self.name))
+        if any(isinstance(x, dict) for x in outputs):
+            raise util.ConfigurationError(
+                'layer "{}": cannot unroll with an output specifier'
+                .format(self.name))
+        init = self._initial_states(outputs)
+        tapped = [x for x in init if x is not None]
+        known = None
+        if self.input_shape is not None and len(self.input_shape) == 2:
+            known = self.input_shape[0]
+        if 'back' in self.kwargs.get('direction', '').lower():
+            # outputs of a backwards scan are in the order they are computed.
+            inputs = [x[::-1] for x in inputs]
+            if mask is not None:
+                mask = mask[:, ::-1]
+        if mask is not None:
+            mask = mask.dimshuffle(1, 0)
+
+        if unroll is True:
+            if known is None:
+                raise util.ConfigurationError(
+                    'layer "{}": cannot unroll without a known number of '
+                    'time steps in input shape {}'
+                    .format(self.name, self.input_shape))
+            if mask is not None:
+                step = self._masked(step, len(inputs), outputs)
+                inputs = list(inputs) + [mask]
+            values, _ = self._unroll(
+                step, inputs, outputs, tapped, constants, known)
+            return values if len(values) > 1 else values[0], []
+
+        k = int(unroll)
+        steps = inputs[0].shape[0]
+        if mask is None and (known is None or known % k):
+            mask = TT.ones((steps, tapped[0].shape[0]), util.FLOAT)
+        if mask is not None:
+            step = self._masked(step, len(inputs), outputs)
+            inputs = list(inputs) + [mask]
+        blocks = (steps + k - 1) // k
+        padded = []
+        for x in inputs:
+            shape = [x.shape[i] for i in range(1, x.ndim)]
+            if mask is not None:
+                x = TT.concatenate(
+                    [x, TT.zeros([blocks * k - steps] + shape, x.dtype)])
+            padded.append(x.reshape([blocks, k] + shape, ndim=x.ndim + 1))
+
+        def block(*args):
+            args = list(args)
+            xs = args[:len(padded)]
+            prev = args[len(padded):len(padded) + len(tapped)]
+            consts = args[len(padded) + len(tapped):]
+            values, last = self._unroll(step, xs, outputs, prev, consts, k)
+            return values + last
+
+        results, updates = theano.scan(
+            block,
             name=self._fmt(name),
-            sequences=inputs,
-            outputs_info=init,
-            non_sequences=constants,
-            go_backwards='back' in self.kwargs.get('direction', '').lower(),
-            truncate_gradient=self.kwargs.get('bptt_limit', -1),
-        )
+            sequences=padded,
+            outputs_info=[None] * len(outputs) + tapped,
+            non_sequences=constants)
+        values = []
+        for y in results[:len(outputs)]:
+            shape = [y.shape[i] for i in range(2, y.ndim)]
+            values.append(
+                y.reshape([blocks * k] + shape, ndim=y.ndim - 1)[:steps])
+        return values if len(values) > 1 else values[0], updates
+
+    @staticmethod
+    def _unroll(step, inputs, outputs, prev, constants, count):
+        '''Apply a step function to a fixed number of time steps.
+
+        Returns
+        -------
+        values : list of theano expressions
+            Each output of the step function, stacked over time steps.
+        last : list of theano expressions
+            The values of the tapped outputs after the last time step.
+        '''
+        results = []
+        for t in range(count):
+            values = step(*[x[t] for x in inputs] + list(prev) + list(constants))
+            if not isinstance(values, (tuple, list)):
+                values = [values]
+            prev = [v for v, x in zip(values, outputs) if x is not None]
+            results.append(values)
+        return [TT.stack(v) for v in zip(*results)], prev
+
+    @staticmethod
+    def _masked(step, num_inputs, outputs):
+        '''Wrap a step function so that masked steps do not update states.
+
+        The wrapped step function takes the mask value for the time step as an
+        extra sequence input, after the other sequence inputs.
+        '''
+        def masked(*args):
+            m_t = args[num_inputs].dimshuffle(0, 'x')
+            prev = args[num_inputs + 1:]
+            values = step(*(args[:num_inputs] + prev))
+            result = []
+            for value, x in zip(values, outputs):
+                if x is not None:
+                    value = TT.switch(m_t, value, prev[0])
+                    prev = prev[1:]
+                result.append(value)
+            return result
+        return masked
+
+    def _scan_once(self, inputs, outputs, step, constants):
+        '''Apply the step function of a scan for just one time step.
+
+        Initial values for the tapped outputs of the scan are created as
+        symbolic variables, and the values computed for them are recorded as
+        states of the layer; see :func:`connect_step`.
+        '''
+        if 'back' in self.kwargs.get('direction', '').lower():
+            raise util.ConfigurationError(
+                'layer "{}": cannot step a backwards recurrent layer'
+                .format(self.name))
+        prev = []
+        for i, x in enumerate(outputs):
+            if x is None:
+                continue
+            if isinstance(x, dict) or getattr(x, 'ndim', 0) > 0:
+                raise util.ConfigurationError(
+                    'layer "{}": cannot step with a given initial state'
+                    .format(self.name))
+            prev.append(TT.matrix(self._fmt('state{}'.format(i))))
+        values = step(*[x[0] for x in inputs] + prev + constants)
+        tapped = [v for v, x in zip(values, outputs) if x is not None]
+        for var, value in zip(prev, tapped):
+            self._step_states.append((var, value, (None, self.output_size)))
+        values = [TT.shape_padleft(v) for v in values]
+        return values if len(values) > 1 else values[0], []
+
+    def _time(self, steps):
+        '''Create a sequence of time step indices for a scan.
+
+        Parameters
+        ----------
+        steps : theano scalar
+            Number of time steps in the scan.
+
+        Returns
+        -------
+        indices : theano vector
+            The index of each time step. When stepping the layer (see
+            :func:`connect_step`), indices start at a time that is carried as
+            a state of the layer.
+        '''
+        t = TT.arange(steps)
+        if self._step_states is not None:
+            t0 = TT.lscalar(self._fmt('time'))
+            self._step_states.append((t0, t0 + steps, ()))
+            t = t + t0
+        return t
+
+    def _fused(self, names, axis=1):
+        '''Concatenate several parameters of this layer into one expression.
+
+        One product with a concatenation of weight matrices runs faster than
+        several smaller products, especially inside a loop.
+
+        Parameters
+        ----------
+        names : sequence of str
+            Names of the parameters to concatenate.
+        axis : int, optional
+            Concatenate parameters along this axis. Defaults to 1, which
+            concatenates weight matrices for different outputs.
+
+        Returns
+        -------
+        param : theano expression
+            The concatenated parameters.
+        '''
+        return TT.concatenate([self.find(n) for n in names], axis=axis)
+
+    def connect_step(self, inputs):
+        '''Create Theano variables for one time step of this layer.
+
+        This works like :func:`connect <theanets.layers.base.Layer.connect>`,
+        except that the layer's inputs are expected to contain exactly one time
+        step, and the state of the layer is carried explicitly between steps
+        rather than computed by a loop. This allows outputs of a recurrent
+        model to be computed incrementally, e.g., when sampling a sequence.
+
+        Parameters
+        ----------
+        inputs : dict of Theano expressions
+            Symbolic inputs to this layer, given as a dictionary mapping string
+            names to Theano expressions. See :func:`Layer.connect
+            <theanets.layers.base.Layer.connect>`.
+
+        Raises
+        ------
+        ConfigurationError :
+            If the layer runs backwards in time, or uses a given initial state
+            (e.g., ``h_0``), since these cannot be computed incrementally.
+
+        Returns
+        -------
+        outputs : dict
+            A dictionary mapping names to Theano expressions for the outputs
+            from this layer, each containing one time step.
+        states : list of (variable, expression, shape) tuples
+            The states of this layer. Each state is given as a symbolic input
+            variable holding the state before the time step, an expression for
+            the state after the time step, and the shape of the state, with
+            ``None`` standing for the number of examples. States start at zero.
+        '''
+        self._step_states = []
+        try:
+            outputs, _ = self.connect(inputs)
+            return outputs, self._step_states
+        finally:
+            self._step_states = None
 
     def _create_rates(self, dist='uniform', size=None, eps=1e-4):
         '''Create a rate parameter (usually for a recurrent network layer).
@@ -205,7 +482,7 @@ class Recurrent(base.Layer):
 
     def to_spec(self):
         spec = super(Recurrent, self).to_spec()
-        spec.update(h_0=self.h_0)
+        spec.update(h_0=self.h_0, mask=self.mask)
         return spec
 
 
@@ -256,14 +533,21 @@ class RNN(Recurrent):
 
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
-        (p, o), updates = self._scan([TT.arange(x.shape[0]), x], [init, init])
+        (p, o), updates = self._scan(
+            [self._time(x.shape[0]), x], [init, init],
+            constants=[self._recurrent_weights()],
+            mask=inputs.get(self.mask))
         pre = p.dimshuffle(1, 0, 2)
         out = o.dimshuffle(1, 0, 2)
 
         return dict(pre=pre, out=out), updates
 
-    def _step(self, _, x_t, __, h_tm1):
-        pre = x_t + TT.dot(h_tm1, self.find('hh'))
+    def _recurrent_weights(self):
+        '''Get the hidden-to-hidden weights used at each time step.'''
+        return self.find('hh')
+
+    def _step(self, _, x_t, __, h_tm1, hh):
+        pre = x_t + TT.dot(h_tm1, hh)
         return [pre, self.activate(pre)]
 
 
@@ -358,24 +642,26 @@ class RRNN(Recurrent):
         x = inputs[self.input_name].dimshuffle(1, 0, 2)
 
         step = self._step_static
-        arrays = [TT.dot(x, self.find('xh')) + self.find('b')]
         const = []
         if self._rate == 'matrix':
             step = self._step_dynamic
-            r = TT.nnet.sigmoid(TT.dot(x, self.find('xr')) + self.find('r'))
-            arrays.append(r)
-        elif self._rate == 'vector':
-            r = TT.nnet.sigmoid(self.find('r'))
-            const.append(r)
+            xr = (TT.dot(x, self._fused(('xh', 'xr'))) +
+                  self._fused(('b', 'r'), axis=0))
+            r = TT.nnet.sigmoid(xr[:, :, self.output_size:])
+            arrays = [xr[:, :, :self.output_size], r]
         else:
+            arrays = [TT.dot(x, self.find('xh')) + self.find('b')]
             r = self._rates
+            if self._rate == 'vector':
+                r = TT.nnet.sigmoid(self.find('r'))
             const.append(r)
 
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
         (p, h, o), updates = self._scan(
             arrays, [None, None, inputs.get(self.h_0, x.shape[1])],
-            constants=const, step=step)
+            constants=const, step=step,
+            mask=inputs.get(self.mask))
         pre = p.dimshuffle(1, 0, 2)
         hid = h.dimshuffle(1, 0, 2)
         out = o.dimshuffle(1, 0, 2)
@@ -470,7 +756,8 @@ class MRNN(Recurrent):
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
         (p, o), updates = self._scan(
-            [h, f], [None, inputs.get(self.h_0, x.shape[1])])
+            [h, f], [None, inputs.get(self.h_0, x.shape[1])],
+            mask=inputs.get(self.mask))
         pre = p.dimshuffle(1, 0, 2)
         out = o.dimshuffle(1, 0, 2)
 
@@ -601,7 +888,8 @@ class LSTM(Recurrent):
 
         (o, c), updates = self._scan(
             [TT.dot(x, self.find('xh')) + self.find('b')],
-            [inputs.get(self.h_0, x.shape[1]), inputs.get(self.c_0, x.shape[1])])
+            [inputs.get(self.h_0, x.shape[1]), inputs.get(self.c_0, x.shape[1])],
+            mask=inputs.get(self.mask))
 
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
@@ -698,10 +986,10 @@ class GRU(Recurrent):
         hrz = TT.dot(x, self.find('w')) + self.find('b')
 
         (p, h, r, o), updates = self._scan(
-            [hrz[:, :, :self.output_size],
-             hrz[:, :, self.output_size:-self.output_size],
-             hrz[:, :, -self.output_size:]],
-            [None, None, None, inputs.get(self.h_0, x.shape[1])])
+            [hrz[:, :, :self.output_size], hrz[:, :, self.output_size:]],
+            [None, None, None, inputs.get(self.h_0, x.shape[1])],
+            constants=[self._fused(('hr', 'hz'))],
+            mask=inputs.get(self.mask))
 
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
@@ -712,9 +1000,10 @@ class GRU(Recurrent):
 
         return dict(pre=pre, hid=hid, rate=rate, out=out), updates
 
-    def _step(self, x_t, r_t, z_t, h_tm1):
-        r = TT.nnet.sigmoid(r_t + TT.dot(h_tm1, self.find('hr')))
-        z = TT.nnet.sigmoid(z_t + TT.dot(h_tm1, self.find('hz')))
+    def _step(self, x_t, rz_t, h_tm1, hrz):
+        rz = TT.nnet.sigmoid(rz_t + TT.dot(h_tm1, hrz))
+        r = rz[:, :self.output_size]
+        z = rz[:, self.output_size:]
         pre = x_t + TT.dot(r * h_tm1, self.find('hh'))
         h_t = self.activate(pre)
         return [pre, h_t, z, (1 - z) * h_tm1 + z * h_t]
@@ -765,7 +1054,11 @@ class Clockwork(RNN):
     stored in full (i.e., it is ``size`` x ``size``); the module separation is
     enforced by masking this weight matrix with zeros in the appropriate places.
     This implementation runs *much* faster on a GPU than an approach that uses
-    dedicated module parameters.
+    dedicated module parameters. The masked weights are computed once for each
+    sequence, and at each time step, only the columns of the weights for
+    modules up to the slowest active module are used. When each period divides
+    the next (e.g., periods 1, 2, 4, 8), the active modules are always the
+    fastest ones, so no computation is spent on inactive modules.
 
     *Parameters*
 
@@ -827,9 +1120,21 @@ class Clockwork(RNN):
                      inputs)
         logging.info('learnable parameters: %d', self.log_params())
 
-    def _step(self, t, x_t, pre_tm1, h_tm1):
-        pre = x_t + TT.dot(h_tm1, self.find('hh') * self._mask)
-        pre_t = TT.switch(TT.eq(t % self._period, 0), pre, pre_tm1)
+    def _recurrent_weights(self):
+        return self.find('hh') * self._mask
+
+    def _step(self, t, x_t, pre_tm1, h_tm1, hh):
+        # modules are sorted by period, and the columns of the weights for
+        # module i only depend on modules i and up, so we only need to compute
+        # columns for modules up to the last active one.
+        n = self.output_size // len(self.periods)
+        active = TT.eq(t % self.periods, 0)
+        k = n * TT.max(active * np.arange(1, 1 + len(self.periods)))
+        pre = x_t[:, :k] + TT.dot(h_tm1, hh[:, :k])
+        if any(b % a for a, b in zip(self.periods[:-1], self.periods[1:])):
+            # some modules before the last active one might be inactive.
+            pre = TT.switch(TT.eq(t % self._period[:k], 0), pre, pre_tm1[:, :k])
+        pre_t = TT.concatenate([pre, pre_tm1[:, k:]], axis=1)
         return [pre_t, self.activate(pre_t)]
 
     def to_spec(self):
@@ -907,12 +1212,15 @@ class MUT1(Recurrent):
         # input is:   (batch, time, input)
         # scan wants: (time, batch, input)
         x = inputs[self.input_name].dimshuffle(1, 0, 2)
-        z = TT.nnet.sigmoid(TT.dot(x, self.find('xz')) + self.find('bz'))
+        n = self.output_size
+        xs = (TT.dot(x, self._fused(('xh', 'xr', 'xz'))) +
+              self._fused(('bh', 'br', 'bz'), axis=0))
+        z = TT.nnet.sigmoid(xs[:, :, 2 * n:])
 
         (p, h, o), updates = self._scan(
-            [TT.tanh(TT.dot(x, self.find('xh')) + self.find('bh')),
-             TT.dot(x, self.find('xr')) + self.find('br'), z],
-            [None, None, inputs.get(self.h_0, x.shape[1])])
+            [TT.tanh(xs[:, :, :n]), xs[:, :, n:2 * n], z],
+            [None, None, inputs.get(self.h_0, x.shape[1])],
+            mask=inputs.get(self.mask))
 
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
@@ -1028,7 +1336,8 @@ class SCRN(Recurrent):
             [None,
              inputs.get(self.h_0, x.shape[1]),
              inputs.get(self.s_0, x.shape[1])],
-            constants=[r])
+            constants=[r, self._fused(('hh', 'sh'), axis=0)],
+            mask=inputs.get(self.mask))
 
         # output is:  (time, batch, output)
         # we want:    (batch, time, output)
@@ -1041,9 +1350,9 @@ class SCRN(Recurrent):
 
         return dict(rate=r, state=state, hid=hid, out=out), updates
 
-    def _step(self, xh_t, xs_t, h_tm1, s_tm1, r):
+    def _step(self, xh_t, xs_t, h_tm1, s_tm1, r, hs):
         s = (1 - r) * s_tm1 + r * xs_t
-        p = xh_t + TT.dot(h_tm1, self.find('hh')) + TT.dot(s, self.find('sh'))
+        p = xh_t + TT.dot(TT.concatenate([h_tm1, s], axis=1), hs)
         return [p, self.activate(p), s]
 
     def to_spec(self):
@@ -30,6 +30,13 @@ class Loss(util.Registrar(str('Base'), (), {})):
         Name of the network output to tap for computing the loss. Defaults to
         'out:out', the name of the default output of the last layer in a linear
         network.
+    mask_name : str, optional
+        Name of a network output (usually an input layer) that provides a mask
+        for the loss, e.g., of shape (num-examples, num-time-steps) for a
+        recurrent model. Target values where the mask is zero (e.g., padding
+        at the end of a short sequence in a batch) do not contribute to the
+        loss. The mask is combined with the weights of a weighted loss, and is
+        only used by losses that support weights. Defaults to ``None``.
 
     Attributes
     ----------
@@ -37,9 +44,15 @@ class Loss(util.Registrar(str('Base'), (), {})):
         The importance of this loss for the model being trained.
     output_name : str
         Name of the network output to tap for computing the loss.
+    mask_name : str
+        Name of the network output to use as a mask for the loss, or ``None``.
     '''
 
-    def __init__(self, target, weight=1., weighted=False, output_name='out'):
+    # default for losses pickled before this attribute existed.
+    mask_name = None
+
+    def __init__(self, target, weight=1., weighted=False, output_name='out',
+                 mask_name=None):
         self.weight = weight
 
         self._target = (util.FLOAT_CONTAINERS[target]('target')
@@ -53,6 +66,10 @@ class Loss(util.Registrar(str('Base'), (), {})):
         if ':' not in self.output_name:
             self.output_name += ':out'
 
+        self.mask_name = mask_name
+        if self.mask_name and ':' not in self.mask_name:
+            self.mask_name += ':out'
+
     @property
     def variables(self):
         '''A list of Theano variables used in this loss.'''
@@ -61,6 +78,23 @@ class Loss(util.Registrar(str('Base'), (), {})):
             result.append(self._weights)
         return result
 
+    def to_spec(self):
+        '''Create a specification dictionary for this loss.
+
+        Returns
+        -------
+        spec : dict
+            A dictionary specifying the configuration of this loss.
+        '''
+        return dict(
+            form=self.__class__.__name__.lower(),
+            target=self._target.ndim,
+            weight=self.weight,
+            weighted=self._weights is not None,
+            output_name=self.output_name,
+            mask_name=self.mask_name,
+        )
+
     def log(self):
         '''Log some diagnostic info about this loss.'''
         logging.info('using loss: %s * %s (output %s)',
@@ -82,6 +116,32 @@ class Loss(util.Registrar(str('Base'), (), {})):
         '''
         raise NotImplementedError
 
+    def _weights_for(self, outputs):
+        '''Get the weights for computing this loss, including any mask.
+
+        Parameters
+        ----------
+        outputs : dict of Theano expressions
+            A dictionary mapping network output names to Theano expressions
+            representing the outputs of a computation graph.
+
+        Returns
+        -------
+        weights : Theano expression or None
+            An array of weights with the shape of the target, or None if this
+            loss is neither weighted nor masked.
+        '''
+        if self.mask_name is None:
+            return self._weights
+        mask = outputs[self.mask_name]
+        # broadcast the mask over any trailing dimensions of the target.
+        extra = ('x', ) * (self._target.ndim - mask.ndim)
+        mask = mask.dimshuffle(tuple(range(mask.ndim)) + extra)
+        mask = TT.ones_like(self._target, dtype=util.FLOAT) * mask
+        if self._weights is None:
+            return mask
+        return self._weights * mask
+
 
 class MeanSquaredError(Loss):
     r'''Mean-squared-error (MSE) loss function.
@@ -127,8 +187,9 @@ class MeanSquaredError(Loss):
             The values of the loss given the network output.
         '''
         err = outputs[self.output_name] - self._target
-        if self._weights is not None:
-            return (self._weights * err * err).sum() / self._weights.sum()
+        weights = self._weights_for(outputs)
+        if weights is not None:
+            return (weights * err * err).sum() / weights.sum()
         return (err * err).mean()
 
 
@@ -172,8 +233,9 @@ class MeanAbsoluteError(Loss):
             The values of the loss given the network output.
         '''
         err = outputs[self.output_name] - self._target
-        if self._weights is not None:
-            return abs(self._weights * err).sum() / self._weights.sum()
+        weights = self._weights_for(outputs)
+        if weights is not None:
+            return abs(weights * err).sum() / weights.sum()
         return abs(err).mean()
 
 
@@ -265,6 +327,13 @@ class GaussianLogLikelihood(Loss):
                      self.weight, self.__class__.__name__,
                      self.mean_name, self.covar_name)
 
+    def to_spec(self):
+        spec = super(GaussianLogLikelihood, self).to_spec()
+        spec.update(mean_name=self.mean_name,
+                    covar_name=self.covar_name,
+                    covar_eps=self.covar_eps)
+        return spec
+
     def __call__(self, outputs):
         '''Construct the computation graph for this loss function.
 
@@ -373,10 +442,20 @@ class MaximumMeanDiscrepancy(Loss):
 
     def __init__(self, kernel=1, **kwargs):
         super(MaximumMeanDiscrepancy, self).__init__(**kwargs)
+        self._bandwidth = None
         if isinstance(kernel, (int, float)):
+            self._bandwidth = kernel
             kernel = MaximumMeanDiscrepancy.gaussian(kernel)
         self.kernel = kernel
 
+    def to_spec(self):
+        if self._bandwidth is None:
+            raise util.ConfigurationError(
+                'cannot create a spec for a loss with a custom kernel')
+        spec = super(MaximumMeanDiscrepancy, self).to_spec()
+        spec['kernel'] = self._bandwidth
+        return spec
+
     def __call__(self, outputs):
         '''Construct the computation graph for this loss function.
 
@@ -437,8 +516,9 @@ class KullbackLeiblerDivergence(Loss):
         eps = 1e-8
         t = TT.clip(self._target, eps, 1 - eps)
         kl = t * TT.log(t / TT.clip(output, eps, 1 - eps))
-        if self._weights is not None:
-            return abs(self._weights * kl).sum() / self._weights.sum()
+        weights = self._weights_for(outputs)
+        if weights is not None:
+            return abs(weights * kl).sum() / weights.sum()
         return abs(kl).mean()
 
 
@@ -460,6 +540,10 @@ class CrossEntropy(Loss):
         Name of the network output to tap for computing the loss. Defaults to
         'out:out', the name of the default output of the last layer in a linear
         network.
+    mask_name : str, optional
+        Name of a network output that provides a mask for the loss. Target
+        values where the mask is zero do not contribute to the loss. Defaults
+        to ``None``.
 
     Attributes
     ----------
@@ -467,6 +551,8 @@ class CrossEntropy(Loss):
         The importance of this loss for the model being trained.
     output_name : str
         Name of the network output to tap for computing the loss.
+    mask_name : str
+        Name of the network output to use as a mask for the loss, or ``None``.
 
     Notes
     -----
@@ -490,9 +576,11 @@ class CrossEntropy(Loss):
 
     __extra_registration_keys__ = ['XE']
 
-    def __init__(self, target, weight=1., weighted=False, output_name='out'):
+    def __init__(self, target, weight=1., weighted=False, output_name='out',
+                 mask_name=None):
         super(CrossEntropy, self).__init__(
-            target, weight=weight, weighted=weighted, output_name=output_name)
+            target, weight=weight, weighted=weighted, output_name=output_name,
+            mask_name=mask_name)
         self._target = util.INT_CONTAINERS[target]('target')
 
     def __call__(self, outputs):
@@ -514,8 +602,9 @@ class CrossEntropy(Loss):
         n = TT.prod(output.shape) // k
         prob = output.reshape((n, k))[TT.arange(n), self._target.reshape((n, ))]
         nlp = -TT.log(TT.clip(prob, 1e-8, 1))
-        if self._weights is not None:
-            return (self._weights.reshape((n, )) * nlp).sum() / self._weights.sum()
+        weights = self._weights_for(outputs)
+        if weights is not None:
+            return (weights.reshape((n, )) * nlp).sum() / weights.sum()
         return nlp.mean()
 
     def accuracy(self, outputs):
@@ -537,8 +626,9 @@ class CrossEntropy(Loss):
         predict = TT.argmax(output, axis=-1)
         correct = TT.eq(predict, self._target)
         acc = correct.mean()
-        if self._weights is not None:
-            acc = (self._weights * correct).sum() / self._weights.sum()
+        weights = self._weights_for(outputs)
+        if weights is not None:
+            acc = (weights * correct).sum() / weights.sum()
         return acc
 
 
@@ -582,6 +672,7 @@ class Hinge(CrossEntropy):
         output = output.reshape((n, k))
         true = output[TT.arange(n), self._target.reshape((n, ))]
         err = TT.maximum(0, (output - true[:, None]).max(axis=-1))
-        if self._weights is not None:
-            return (self._weights.reshape((n, )) * err).sum() / self._weights.sum()
+        weights = self._weights_for(outputs)
+        if weights is not None:
+            return (weights.reshape((n, )) * err).sum() / weights.sum()
         return err.mean()
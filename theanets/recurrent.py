@@ -3,10 +3,39 @@
 '''This module contains recurrent network models and utilities.'''
 
 import collections
+import io
+import json
 import numpy as np
-import re
+import struct
+import theano
 
 from . import feedforward
+from . import layers
+from . import util
+
+
+def _windows(array, steps):
+    '''Create a strided view of all length-``steps`` windows of an array.
+
+    Parameters
+    ----------
+    array : ndarray (time-steps, ...)
+        An array of data.
+    steps : int
+        Number of time steps in each window.
+
+    Returns
+    -------
+    windows : ndarray (time-steps - steps + 1, steps, ...)
+        A read-only view of the array; row ``i`` of this view contains the
+        values ``array[i:i+steps]``. No data are copied.
+    '''
+    array = np.asarray(array)
+    shape = (len(array) - steps + 1, steps) + array.shape[1:]
+    strides = (array.strides[0], ) + array.strides
+    windows = np.lib.stride_tricks.as_strided(array, shape, strides)
+    windows.flags.writeable = False
+    return windows
 
 
 def batches(arrays, steps=100, batch_size=64, rng=None):
@@ -35,7 +64,8 @@ def batches(arrays, steps=100, batch_size=64, rng=None):
     -------
     callable :
         A callable that can be used inside a dataset for training a recurrent
-        network.
+        network. Its ``rng`` attribute is the random number generator it draws
+        from.
     '''
     assert batch_size >= 2, 'batch_size must be at least 2!'
     assert isinstance(arrays, (tuple, list)), 'arrays must be a tuple or list!'
@@ -43,17 +73,107 @@ def batches(arrays, steps=100, batch_size=64, rng=None):
     if rng is None or isinstance(rng, int):
         rng = np.random.RandomState(rng)
 
+    # strided views of every window in each array; sampling a batch then takes
+    # one fancy-index gather per array.
+    windows = [_windows(a, steps) for a in arrays]
+
+    def sample():
+        starts = rng.randint(len(arrays[0]) - steps, size=batch_size)
+        return [w[starts] for w in windows]
+
+    sample.rng = rng
+    return sample
+
+
+def bucketed_batches(sequences, batch_size=64, buckets=8, mask=-1, rng=None):
+    '''Create a callable that samples batches of similar-length sequences.
+
+    Sequences are sorted by length and split into buckets, each holding about
+    the same number of sequences. Each batch is drawn from a single bucket, so
+    the sequences in a batch have similar lengths and little of the batch is
+    wasted on padding. Buckets are chosen at random for each batch (in
+    proportion to the number of sequences they hold), so batches of different
+    lengths are interleaved during training.
+
+    Parameters
+    ----------
+    sequences : list of list of ndarray (time-steps, data-dimensions)
+        Sequences of data. Each element of this list holds the sequences for
+        one variable in the dataset---for example, [inputs, outputs] for a
+        recurrent regression problem. The sequences for each variable are given
+        as a list of arrays whose rows correspond to time steps; corresponding
+        sequences for different variables must have the same number of time
+        steps.
+    batch_size : int, optional
+        Generate this many sequences per call. Defaults to 64.
+    buckets : int, optional
+        Split the sequences into this many buckets. Defaults to 8.
+    mask : int, optional
+        Insert the mask for each batch into the list of arrays at this
+        position. The mask holds ones at valid time steps and zeros at padded
+        time steps. Defaults to -1, which appends the mask at the end (e.g., to
+        use the mask as the weights for a weighted loss). If this is None, no
+        mask is included.
+    rng : :class:`numpy.random.RandomState` or int, optional
+        A random number generator, or an integer seed for a random number
+        generator. If not provided, the random number generator will be created
+        with an automatically chosen seed.
+
+    Returns
+    -------
+    callable :
+        A callable that can be used inside a dataset for training a recurrent
+        network. Each call returns a list of arrays of shape (batch-size,
+        time-steps, ...) padded with zeros to the length of the longest
+        sequence in the batch, along with the mask, if requested. Its ``rng``
+        attribute is the random number generator it draws from.
+    '''
+    assert batch_size >= 2, 'batch_size must be at least 2!'
+    assert isinstance(sequences, (tuple, list)), 'sequences must be a tuple or list!'
+
+    if rng is None or isinstance(rng, int):
+        rng = np.random.RandomState(rng)
+
+    lengths = np.array([len(x) for x in sequences[0]])
+    for seqs in sequences[1:]:
+        assert np.array_equal([len(x) for x in seqs], lengths), \
+            'corresponding sequences must have the same length!'
+
+    groups = [g for g in np.array_split(np.argsort(lengths, kind='mergesort'),
+                                        buckets) if len(g)]
+    sizes = np.array([len(g) for g in groups], float)
+
     def sample():
-        xs = [np.zeros((batch_size, steps, a.shape[1]), a.dtype) for a in arrays]
-        for i in range(batch_size):
-            j = rng.randint(len(arrays[0]) - steps)
-            for x, a in zip(xs, arrays):
-                x[i] = a[j:j+steps]
-        return xs
+        group = groups[rng.choice(len(groups), p=sizes / sizes.sum())]
+        chosen = rng.choice(group, batch_size, replace=len(group) < batch_size)
+        valid = np.arange(lengths[chosen].max()) < lengths[chosen][:, None]
+        batch = []
+        for seqs in sequences:
+            first = np.asarray(seqs[chosen[0]])
+            padded = np.zeros(valid.shape + first.shape[1:], first.dtype)
+            # rows of the mask are filled in order, so the concatenated valid
+            # time steps can be scattered into the padded array at once.
+            padded[valid] = np.concatenate([seqs[i] for i in chosen])
+            batch.append(padded)
+        if mask is not None:
+            m = valid.astype(util.FLOAT)
+            batch.insert(mask if mask >= 0 else len(batch) + 1 + mask, m)
+        return batch
 
+    sample.rng = rng
     return sample
 
 
+_TEXT_MAGIC = b'\x93THEANETS-TEXT'
+
+
+def _ordinals(txt):
+    '''Get an array of the ordinal values of the characters in a string.'''
+    if isinstance(txt, bytes):
+        return np.frombuffer(txt, np.uint8)
+    return np.frombuffer(txt.encode('utf-32-le'), np.uint32)
+
+
 class Text(object):
     '''A class for handling sequential text data.
 
@@ -76,22 +196,76 @@ class Text(object):
     ----------
     text : str
         A blob of text, with all non-alphabet characters replaced by the
-        "unknown" character.
+        "unknown" character. This is decoded from :attr:`codes` the first
+        time it is accessed, and kept until :attr:`codes` is replaced.
     alpha : str
         A string containing each character in the alphabet.
+    codes : ndarray
+        The text, encoded as an array of alphabet index values. This array uses
+        ``uint8`` values if the alphabet has fewer than 256 characters, and
+        ``uint16`` values otherwise. For a text loaded from disk with
+        :func:`load`, this is a read-only memory map of the encoded file.
+
+    Notes
+    -----
+
+    Large corpora can be encoded once using :func:`encode_files`, which reads
+    the source documents in chunks and writes their alphabet index values to
+    disk. The resulting file can be opened with :func:`load`, which maps the
+    encoded values into memory rather than reading them, so training batches
+    can be drawn from a corpus of many gigabytes using a small, constant amount
+    of memory.
     '''
 
     def __init__(self, text, alpha=None, min_count=2, unknown='\0'):
-        self.alpha = alpha
-        if self.alpha is None:
-            self.alpha = ''.join(sorted(set(
+        if alpha is None:
+            alpha = ''.join(sorted(set(
                 char for char, count in
                 collections.Counter(text).items()
                 if char != unknown and count >= min_count)))
-        self.text = re.sub(r'[^{}]'.format(re.escape(self.alpha)), unknown, text)
-        assert unknown not in self.alpha
-        self._rev_index = unknown + self.alpha
-        self._fwd_index = dict(zip(self._rev_index, range(1 + len(self.alpha))))
+        self._init_alpha(alpha, unknown)
+        self.codes = self._encode(text)
+
+    def _init_alpha(self, alpha, unknown):
+        '''Set up lookup tables for an alphabet.'''
+        assert unknown not in alpha
+        self.alpha = alpha
+        self._rev_index = unknown + alpha
+
+        # lookup tables mapping character ordinals to alphabet indices, and
+        # back. ordinals not in the alphabet map to 0, the "unknown" index.
+        ords = _ordinals(self._rev_index)
+        dtype = np.uint8 if len(ords) <= 256 else np.uint16
+        self._fwd_table = np.zeros(max(
+            256 if ords.max() < 256 else 65536, ords.max() + 1), dtype)
+        self._fwd_table[ords[1:]] = np.arange(1, len(ords), dtype=dtype)
+        self._rev_table = ords.astype(np.uint32)
+
+    @property
+    def codes(self):
+        return self._codes
+
+    @codes.setter
+    def codes(self, codes):
+        self._codes = codes
+        self._text = None
+
+    @property
+    def text(self):
+        # decoding a large corpus is expensive, so only do it once.
+        if getattr(self, '_text', None) is None:
+            self._text = self.decode(self._codes)
+        return self._text
+
+    def _encode(self, txt):
+        '''Encode a text string as an array of alphabet index values.'''
+        ords = _ordinals(txt)
+        table = self._fwd_table
+        if len(ords) and ords.max() >= len(table):
+            return np.where(ords < len(table),
+                            table[np.minimum(ords, len(table) - 1)], 0
+                            ).astype(table.dtype)
+        return table[ords]
 
     def encode(self, txt):
         '''Encode a text string by replacing characters with alphabet index.
@@ -106,7 +280,7 @@ class Text(object):
         classes : list of int
             A sequence of alphabet index values corresponding to the given text.
         '''
-        return list(self._fwd_index.get(c, 0) for c in txt)
+        return self._encode(txt).tolist()
 
     def decode(self, enc):
         '''Encode a text string by replacing characters with alphabet index.
@@ -121,7 +295,8 @@ class Text(object):
         txt : str
             A string containing corresponding characters from the alphabet.
         '''
-        return ''.join(self._rev_index[c] for c in enc)
+        enc = np.asarray(enc, int)
+        return self._rev_table[enc].tobytes().decode('utf-32-le')
 
     def classifier_batches(self, steps, batch_size, rng=None):
         '''Create a callable that returns a batch of training data.
@@ -141,27 +316,160 @@ class Text(object):
         -------
         batch : callable
             A callable that, when called, returns a batch of data that can be
-            used to train a classifier model.
+            used to train a classifier model. Its ``rng`` attribute is the
+            random number generator it draws from.
         '''
         assert batch_size >= 2, 'batch_size must be at least 2!'
 
         if rng is None or isinstance(rng, int):
             rng = np.random.RandomState(rng)
 
+        B = np.arange(batch_size)[:, None]
         T = np.arange(steps)
+        windows = _windows(self.codes, steps + 1)
 
         def batch():
+            offsets = rng.randint(len(self.codes) - steps - 1, size=batch_size)
+            enc = windows[offsets]
             inputs = np.zeros((batch_size, steps, 1 + len(self.alpha)), 'f')
-            outputs = np.zeros((batch_size, steps), 'i')
-            for b in range(batch_size):
-                offset = rng.randint(len(self.text) - steps - 1)
-                enc = self.encode(self.text[offset:offset + steps + 1])
-                inputs[b, T, enc[:-1]] = 1
-                outputs[b, T] = enc[1:]
+            inputs[B, T, enc[:, :-1]] = 1
+            outputs = enc[:, 1:].astype('i')
             return [inputs, outputs]
 
+        batch.rng = rng
         return batch
 
+    def _write_header(self, handle):
+        '''Write the preamble of an encoded text file.'''
+        header = json.dumps(dict(
+            alpha=self.alpha,
+            unknown=self._rev_index[0],
+            dtype=self._fwd_table.dtype.str,
+        )).encode('utf-8')
+        # pad so that the encoded values start at an aligned offset.
+        header += b' ' * (-(len(_TEXT_MAGIC) + 8 + len(header)) % 64)
+        handle.write(_TEXT_MAGIC)
+        handle.write(struct.pack('<Q', len(header)))
+        handle.write(header)
+
+    def save(self, filename):
+        '''Save the encoded text to a file.
+
+        Parameters
+        ----------
+        filename : str
+            Save the alphabet and the encoded text to this file. The file can
+            be opened again using :func:`load`.
+        '''
+        with open(filename, 'wb') as handle:
+            self._write_header(handle)
+            np.asarray(self.codes).tofile(handle)
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        '''Load an encoded text from a file.
+
+        Parameters
+        ----------
+        filename : str
+            Load the text from this file, which must have been written by
+            :func:`save` or :func:`encode_files`.
+        mmap : bool, optional
+            If True, map the encoded text into memory from the file rather than
+            reading it. Defaults to True.
+
+        Returns
+        -------
+        text : :class:`Text`
+            The loaded text.
+        '''
+        with open(filename, 'rb') as handle:
+            if handle.read(len(_TEXT_MAGIC)) != _TEXT_MAGIC:
+                raise util.ConfigurationError(
+                    '{}: not an encoded text file'.format(filename))
+            size, = struct.unpack('<Q', handle.read(8))
+            header = json.loads(handle.read(size).decode('utf-8'))
+            dtype = np.dtype(header['dtype'])
+            if not mmap:
+                codes = np.fromfile(handle, dtype)
+        if mmap:
+            codes = np.memmap(filename, dtype, mode='r',
+                              offset=len(_TEXT_MAGIC) + 8 + size)
+        txt = cls.__new__(cls)
+        txt._init_alpha(header['alpha'], header['unknown'])
+        txt.codes = codes
+        return txt
+
+    @classmethod
+    def encode_files(cls, filenames, filename, alpha=None, min_count=2,
+                     unknown='\0', exclude='', encoding='utf-8',
+                     chunk_size=1 << 24):
+        '''Encode text documents into a file, one chunk at a time.
+
+        Documents are read twice---once to count characters for the alphabet
+        (only if ``alpha`` is not given), and once to encode them---but never
+        more than ``chunk_size`` characters are held in memory at once. The
+        encoded documents are concatenated in the output file.
+
+        Parameters
+        ----------
+        filenames : sequence of str
+            Names of text documents to encode.
+        filename : str
+            Write the alphabet and the encoded text to this file.
+        alpha : str, optional
+            An alphabet to use for representing characters in the text. If not
+            provided, all characters from the documents occurring at least
+            ``min_count`` times will be used.
+        min_count : int, optional
+            If the alphabet is to be computed from the documents, discard
+            characters that occur fewer than this number of times. Defaults to
+            2.
+        unknown : str, optional
+            A character to use to represent "out-of-alphabet" characters in the
+            text. This must not be in the alphabet. Defaults to '\0'.
+        exclude : str, optional
+            If the alphabet is to be computed from the documents, discard these
+            characters from it. Defaults to the empty string.
+        encoding : str, optional
+            Character encoding of the documents. Defaults to 'utf-8'.
+        chunk_size : int, optional
+            Read this many characters at a time. Defaults to 16M.
+
+        Returns
+        -------
+        text : :class:`Text`
+            The encoded text, memory-mapped from the output file.
+        '''
+        def chunks():
+            for name in filenames:
+                with io.open(name, encoding=encoding) as handle:
+                    chunk = handle.read(chunk_size)
+                    while chunk:
+                        yield chunk
+                        chunk = handle.read(chunk_size)
+
+        if alpha is None:
+            counts = np.zeros(0, int)
+            for chunk in chunks():
+                c = np.bincount(_ordinals(chunk))
+                if len(c) > len(counts):
+                    c[:len(counts)] += counts
+                    counts = c
+                else:
+                    counts[:len(c)] += c
+            ords = np.flatnonzero(counts >= max(1, min_count))
+            alpha = ''.join(sorted(
+                set(np.asarray(ords, np.uint32).tobytes().decode('utf-32-le'))
+                - set(exclude) - set(unknown)))
+
+        txt = cls('', alpha=alpha, unknown=unknown)
+        with open(filename, 'wb') as handle:
+            txt._write_header(handle)
+            for chunk in chunks():
+                txt._encode(chunk).tofile(handle)
+        return cls.load(filename)
+
 
 class Autoencoder(feedforward.Autoencoder):
     '''An autoencoder network attempts to reproduce its input.
@@ -388,9 +696,58 @@ class Classifier(feedforward.Classifier):
     OUTPUT_NDIM = 2
     '''Number of dimensions for holding output data arrays.'''
 
+    def _step_function(self):
+        '''Compile a function that computes one time step of this network.
+
+        Raises
+        ------
+        ConfigurationError :
+            If the network contains layers that cannot be computed one time
+            step at a time, e.g., bidirectional or convolutional layers.
+
+        Returns
+        -------
+        function : callable
+            A compiled Theano function. It takes an input array containing one
+            time step, followed by the current value of each state in the
+            network, and returns the class probabilities for the time step,
+            followed by the next value of each state.
+        states : list of (shape, dtype) tuples
+            The shape and dtype of each state value. A shape value of ``None``
+            stands for the number of examples.
+        '''
+        key = 'step:{}'.format(self._hash())
+        if key not in self._functions:
+            outputs = {}
+            states = []
+            for layer in self.layers:
+                if isinstance(layer, layers.recurrent.Recurrent):
+                    out, st = layer.connect_step(outputs)
+                    states.extend(st)
+                elif isinstance(layer, (layers.recurrent.Bidirectional,
+                                        layers.convolution.Conv1)):
+                    raise util.ConfigurationError(
+                        'layer "{}": cannot compute one time step at a time'
+                        .format(layer.name))
+                else:
+                    out, _ = layer.connect(outputs)
+                outputs.update(out)
+            f = theano.function(
+                self.inputs + [var for var, _, _ in states],
+                [outputs[self.layers[-1].output_name][:, 0]] +
+                [expr for _, expr, _ in states],
+                # some layers (e.g., plain RNN) do not read all their states.
+                on_unused_input='ignore')
+            self._functions[key] = f, [(s, v.dtype) for v, _, s in states]
+        return self._functions[key]
+
     def predict_sequence(self, labels, steps, streams=1, rng=None):
         '''Draw a sequential sample of class labels from this network.
 
+        The network is computed one time step at a time, carrying the states of
+        its recurrent layers between steps, so the cost of sampling grows
+        linearly with the number of steps.
+
         Parameters
         ----------
         labels : list of int
@@ -412,15 +769,27 @@ class Classifier(feedforward.Classifier):
             1, this will be a list containing the corresponding number of class
             labels.
         '''
+        assert len(labels) > 0, 'labels must contain at least one label!'
         if rng is None or isinstance(rng, int):
             rng = np.random.RandomState(rng)
-        offset = len(labels)
         batch = max(2, streams)
-        inputs = np.zeros((batch, offset + steps, self.layers[0].output_size), 'f')
-        inputs[:, np.arange(offset), labels] = 1
-        for i in range(offset, offset + steps):
+        step, shapes = self._step_function()
+        states = [np.zeros([batch if n is None else n for n in shape], dtype)
+                  for shape, dtype in shapes]
+        x = np.zeros((batch, 1, self.layers[0].output_size), util.FLOAT)
+
+        def advance(chars):
+            x[:] = 0
+            x[np.arange(batch), 0, chars] = 1
+            outputs = step(x, *states)
+            states[:] = outputs[1:]
+            return outputs[0]
+
+        for label in labels:
+            pdfs = advance(label)
+        for i in range(steps):
             chars = []
-            for pdf in self.predict_proba(inputs[:i])[:, -1]:
+            for pdf in pdfs:
                 try:
                     c = rng.multinomial(1, pdf).argmax(axis=-1)
                 except ValueError:
@@ -428,5 +797,96 @@ class Classifier(feedforward.Classifier):
                     # choose greedily in this case.
                     c = pdf.argmax(axis=-1)
                 chars.append(int(c))
-            inputs[np.arange(batch), i, chars] = 1
             yield chars[0] if streams == 1 else chars
+            if i < steps - 1:
+                pdfs = advance(chars)
+
+    def beam_search(self, labels, steps, beam_size=5):
+        '''Find likely sequences of class labels using beam search.
+
+        At each time step, every hypothesis in the beam of each stream is
+        extended by every class label, and the ``beam_size`` extensions with the
+        highest total log-probability are kept. All hypotheses for all streams
+        are computed together in one batched call to the network, one time step
+        at a time. Hypotheses record only a pointer to the hypothesis they
+        extend, so label histories are shared rather than copied, and sequences
+        are assembled by following these pointers at the end of the search.
+
+        Parameters
+        ----------
+        labels : list of int, or ndarray (num-streams, num-labels)
+            Integer class labels to get the classifier started. If this is a
+            two-dimensional array, each row starts a separate stream, and all
+            streams are searched in parallel.
+        steps : int
+            The number of time steps to search.
+        beam_size : int, optional
+            Number of hypotheses to keep for each stream. Defaults to 5.
+
+        Returns
+        -------
+        sequences : ndarray (num-streams, beam-size, steps)
+            The best sequences of class labels found for each stream, ordered
+            from most to least likely. If ``labels`` is one-dimensional, the
+            leading stream axis is omitted.
+        scores : ndarray (num-streams, beam-size)
+            The total log-probability of each sequence, given the initial
+            labels. If ``labels`` is one-dimensional, the leading stream axis is
+            omitted.
+        '''
+        labels = np.asarray(labels, int)
+        single = labels.ndim == 1
+        labels = np.atleast_2d(labels)
+        assert labels.shape[1] > 0, 'labels must contain at least one label!'
+        N, K = len(labels), beam_size
+        step, shapes = self._step_function()
+        states = [np.zeros([N * K if n is None else n for n in shape], dtype)
+                  for shape, dtype in shapes]
+        batched = [len(shape) > 0 and shape[0] is None for shape, _ in shapes]
+        x = np.zeros((N * K, 1, self.layers[0].output_size), util.FLOAT)
+        rows = np.arange(N * K)
+        streams = np.arange(N)[:, None]
+
+        def advance(chars):
+            x[:] = 0
+            x[rows, 0, chars] = 1
+            outputs = step(x, *states)
+            states[:] = outputs[1:]
+            return outputs[0]
+
+        for t in range(labels.shape[1]):
+            pdfs = advance(np.repeat(labels[:, t], K))
+
+        # initially all hypotheses in a beam are identical, so only the first
+        # one is allowed to be extended.
+        scores = np.full((N, K), -np.inf)
+        scores[:, 0] = 0
+        parents = np.zeros((steps, N, K), int)
+        chars = np.zeros((steps, N, K), int)
+        for i in range(steps):
+            C = pdfs.shape[-1]
+            with np.errstate(divide='ignore'):
+                logp = np.log(pdfs).reshape((N, K, C))
+            total = (scores[:, :, None] + logp).reshape((N, K * C))
+            best = np.argpartition(-total, K - 1, axis=1)[:, :K]
+            order = np.argsort(-total[streams, best], axis=1)
+            best = best[streams, order]
+            scores = total[streams, best]
+            parents[i], chars[i] = np.divmod(best, C)
+            if i < steps - 1:
+                # hypotheses continue from the states of their parents.
+                index = (K * streams + parents[i]).ravel()
+                states[:] = [s[index] if b else s
+                             for s, b in zip(states, batched)]
+                pdfs = advance(chars[i].ravel())
+
+        # follow parent pointers back from the final hypotheses.
+        sequences = np.zeros((N, K, steps), int)
+        beam = np.tile(np.arange(K), (N, 1))
+        for i in reversed(range(steps)):
+            sequences[:, :, i] = chars[i][streams, beam]
+            beam = parents[i][streams, beam]
+
+        if single:
+            return sequences[0], scores[0]
+        return sequences, scores
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+r'''This module contains a server for batched, multi-threaded inference.
+
+Calling :func:`Network.predict() <theanets.graph.Network.predict>` once per
+request pays the full overhead of Python and Theano function dispatch for each
+(often tiny) input. When many threads need predictions from the same network,
+it is much more efficient to collect their inputs into a single "micro-batch"
+and compute all of the outputs with one call to the compiled function.
+
+A :class:`Server` does exactly this: client threads submit single examples,
+which are queued and coalesced by a background worker into batches of up to
+``max_batch_size`` examples. A batch is computed as soon as it is full, or when
+the oldest request in the batch has waited ``max_latency`` seconds, whichever
+comes first. Results are scattered back to the clients through
+:class:`Future` objects.
+
+Each example is checked against the shape and dtype of the network input when
+it is submitted, so a malformed request fails immediately instead of poisoning
+a batch. If a batch fails anyway (for instance, because recurrent examples in
+the batch have different lengths), each of its requests is computed on its
+own, and only the requests that fail by themselves receive an error.
+
+Examples
+--------
+
+>>> net = theanets.Regressor([10, 20, 3])
+>>> with theanets.serving.Server(net, max_batch_size=32) as server:
+...     y = server.predict(x)  # x is one example, i.e., x.shape == (10, )
+'''
+
+import climate
+import numpy as np
+import threading
+import time
+
+from . import layers
+from . import util
+
+logging = climate.get_logger(__name__)
+
+
+class Future(object):
+    '''A placeholder for the result of a request submitted to a server.'''
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def done(self):
+        '''Return True if the result of this request is available.'''
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        '''Wait for and return the result of this request.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            Wait at most this many seconds for the result. By default, waits
+            forever.
+
+        Raises
+        ------
+        RuntimeError :
+            If the result is not available before the timeout expires.
+        Exception :
+            Any error raised while computing the result is re-raised here.
+
+        Returns
+        -------
+        value : ndarray
+            The output of the network for this request.
+        '''
+        if not self._event.wait(timeout):
+            raise RuntimeError('timed out waiting for result')
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def _set(self, value=None, error=None):
+        self._value = value
+        self._error = error
+        self._event.set()
+
+
+class Server(object):
+    '''Compute network outputs for many threads using coalesced batches.
+
+    Parameters
+    ----------
+    network : :class:`theanets.graph.Network`
+        The network to serve.
+    method : str, optional
+        Name of the network method used to compute outputs for a batch, e.g.
+        ``'predict'``, ``'predict_proba'``, or ``'encode'``. Defaults to
+        ``'predict'``.
+    max_batch_size : int, optional
+        Compute at most this many examples in one batch. Defaults to 64.
+    max_latency : float, optional
+        Wait at most this many seconds after the first request in a batch
+        arrives before computing the batch. Defaults to 0.002.
+    kwargs : dict, optional
+        Additional keyword arguments are passed to the network method.
+
+    Attributes
+    ----------
+    num_requests : int
+        Number of examples that have been computed by this server.
+    num_batches : int
+        Number of batches that have been computed by this server, including
+        batches that raised an error.
+    num_retries : int
+        Number of examples that were computed again, one at a time, after the
+        batch containing them raised an error.
+    '''
+
+    def __init__(self, network, method='predict', max_batch_size=64,
+                 max_latency=0.002, **kwargs):
+        if max_batch_size < 1:
+            raise util.ConfigurationError(
+                'max_batch_size must be positive, got {}'.format(max_batch_size))
+        self.network = network
+        self.compute = getattr(network, method)
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.kwargs = kwargs
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_retries = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._shape = self._dtype = None
+        for layer in network.layers:
+            if isinstance(layer, layers.Input):
+                self._shape = tuple(layer.output_shape)
+                self._dtype = layer.input.dtype
+                break
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        '''Start the background worker that computes batches.'''
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Compute any pending requests, then stop the background worker.'''
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._thread.join()
+        self._thread = None
+
+    def submit(self, x):
+        '''Submit one example for computation.
+
+        Parameters
+        ----------
+        x : ndarray
+            A single example, i.e., an array with the shape of the network
+            input, without the leading batch dimension.
+
+        Raises
+        ------
+        RuntimeError :
+            If the server is not running.
+        ValueError :
+            If the shape or dtype of the example does not match the network
+            input (or, if the network has no input layer, the first example
+            submitted to the server).
+
+        Returns
+        -------
+        future : :class:`Future`
+            A placeholder for the output of the network for this example.
+        '''
+        x = np.asarray(x)
+        future = Future()
+        with self._cond:
+            if self._thread is None or self._stopping:
+                raise RuntimeError('server is not running')
+            self._check(x)
+            self._pending.append((time.time(), x, future))
+            self._cond.notify()
+        return future
+
+    def predict(self, x, timeout=None):
+        '''Compute the output of the network for one example.
+
+        Parameters
+        ----------
+        x : ndarray
+            A single example, i.e., an array with the shape of the network
+            input, without the leading batch dimension.
+        timeout : float, optional
+            Wait at most this many seconds for the result. By default, waits
+            forever.
+
+        Returns
+        -------
+        y : ndarray
+            The output of the network for this example.
+        '''
+        return self.submit(x).result(timeout)
+
+    def _check(self, x):
+        '''Raise ValueError if an example does not look like the others.'''
+        if self._shape is None:
+            self._shape, self._dtype = x.shape, x.dtype
+        shape = self._shape
+        if len(x.shape) != len(shape) or any(
+                s is not None and s != n for s, n in zip(shape, x.shape)):
+            raise ValueError('expected example with shape {}, got {}'.format(
+                shape, x.shape))
+        if not np.can_cast(x.dtype, self._dtype):
+            raise ValueError('expected example with dtype {}, got {}'.format(
+                self._dtype, x.dtype))
+
+    def _next_batch(self):
+        '''Wait for a batch of requests to be ready, and return it.'''
+        with self._cond:
+            while not self._pending and not self._stopping:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            deadline = self._pending[0][0] + self.max_latency
+            while len(self._pending) < self.max_batch_size and not self._stopping:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:self.max_batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            futures = [f for _, _, f in batch]
+            self.num_batches += 1
+            try:
+                ys = self.compute(np.asarray([x for _, x, _ in batch]), **self.kwargs)
+            except Exception as err:
+                if len(batch) == 1:
+                    logging.exception('error computing request')
+                    futures[0]._set(error=err)
+                    continue
+                logging.warning('error computing batch of %d, retrying '
+                                'each request: %s', len(batch), err)
+                self.num_retries += len(batch)
+                for _, x, f in batch:
+                    try:
+                        y = self.compute(x[None], **self.kwargs)[0]
+                    except Exception as err:
+                        logging.exception('error computing request')
+                        f._set(error=err)
+                        continue
+                    f._set(value=y)
+                    self.num_requests += 1
+                continue
+            for f, y in zip(futures, ys):
+                f._set(value=y)
+            self.num_requests += len(batch)
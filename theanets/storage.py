@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+r'''This module contains an array-native file format for network models.
+
+A pickled network must be unpickled (and possibly decompressed) in full before
+it can be used, which copies every parameter array at least twice. The format
+implemented here instead stores:
+
+- a short binary preamble (a magic string and the size of the header),
+- a JSON header containing the network class, the :func:`layer specs
+  <theanets.layers.base.Layer.to_spec>`, the :func:`loss specs
+  <theanets.losses.Loss.to_spec>`, and the dtype, shape, and file offset of
+  each parameter, and
+- the raw (C-ordered) bytes of each parameter array, each aligned to a
+  multiple of :data:`ALIGNMENT` bytes.
+
+Because parameter arrays are stored raw and aligned, they can be memory-mapped
+directly from the file without copying. Many processes that load the same file
+this way will share one page-cached copy of the parameter values.
+
+This format is normally used through :func:`Network.save()
+<theanets.graph.Network.save>` (with ``format='arrays'``) and
+:func:`Network.load() <theanets.graph.Network.load>`, which detects the format
+automatically.
+'''
+
+import climate
+import importlib
+import json
+import numpy as np
+import struct
+
+from . import util
+
+logging = climate.get_logger(__name__)
+
+MAGIC = b'\x93THEANETS'
+'''Bytes at the start of every file in this format.'''
+
+VERSION = 1
+'''Version of the file format.'''
+
+ALIGNMENT = 64
+'''Byte alignment for the header and each parameter array.'''
+
+
+def _jsonable(value):
+    '''Convert a layer or loss spec value to something JSON can store.'''
+    if isinstance(value, dict):
+        return {k: _jsonable(v) for k, v in value.items()}
+    if isinstance(value, (tuple, list)):
+        return [_jsonable(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, util.basestring)):
+        return value
+    # layers (e.g., in "inputs") are stored using the name of their output.
+    if hasattr(value, 'output_name'):
+        return value.output_name
+    # activation instances are stored using their name.
+    if isinstance(getattr(value, 'name', None), util.basestring):
+        return value.name
+    raise util.ConfigurationError(
+        'cannot store value {!r} in a model file'.format(value))
+
+
+def _layer_spec(layer):
+    spec = layer.to_spec()
+    spec.pop('rng', None)
+    spec.pop('nrng', None)
+    return _jsonable(spec)
+
+
+def _loss_spec(network, loss):
+    spec = loss.to_spec()
+    # some losses (e.g., for autoencoders) use a network input as the target.
+    for i, input in enumerate(network.inputs):
+        if loss._target is input:
+            spec['target'] = dict(input=i)
+    return _jsonable(spec)
+
+
+def _pad(offset):
+    return -offset % ALIGNMENT
+
+
+def is_array_file(handle):
+    '''Check whether a file handle contains a model in this format.
+
+    Parameters
+    ----------
+    handle : file handle
+        A seekable file-like object opened for reading in binary mode. The
+        position of the handle is restored before returning.
+
+    Returns
+    -------
+    matches : bool
+        True if the handle appears to contain a model in this format.
+    '''
+    start = handle.tell()
+    magic = handle.read(len(MAGIC))
+    handle.seek(start)
+    return magic == MAGIC
+
+
+def save(network, handle):
+    '''Save a network to a file handle in the array-native format.
+
+    Parameters
+    ----------
+    network : :class:`theanets.graph.Network`
+        The network to save.
+    handle : file handle
+        A file-like object opened for writing in binary mode.
+    '''
+    values = [p.get_value(borrow=True) for p in network.params]
+    params = []
+    offset = 0
+    for param, value in zip(network.params, values):
+        offset += _pad(offset)
+        params.append(dict(name=param.name,
+                           dtype=value.dtype.str,
+                           shape=list(value.shape),
+                           offset=offset))
+        offset += value.nbytes
+    header = json.dumps(dict(
+        version=VERSION,
+        model='{}.{}'.format(network.__class__.__module__,
+                             network.__class__.__name__),
+        layers=[_layer_spec(l) for l in network.layers],
+        losses=[_loss_spec(network, l) for l in network.losses],
+        params=params,
+    )).encode('utf-8')
+    preamble = len(MAGIC) + 8
+    header += b' ' * _pad(preamble + len(header))
+    handle.write(MAGIC)
+    handle.write(struct.pack('<Q', len(header)))
+    handle.write(header)
+    base = preamble + len(header)
+    written = 0
+    for meta, value in zip(params, values):
+        handle.write(b'\0' * (meta['offset'] - written))
+        handle.write(np.ascontiguousarray(value).tobytes())
+        written = meta['offset'] + value.nbytes
+    logging.debug('wrote %d parameter bytes after %d header bytes',
+                  written, base)
+
+
+def _read_header(handle):
+    if handle.read(len(MAGIC)) != MAGIC:
+        raise util.ConfigurationError('not a theanets array model file')
+    size, = struct.unpack('<Q', handle.read(8))
+    header = json.loads(handle.read(size).decode('utf-8'))
+    if header['version'] > VERSION:
+        raise util.ConfigurationError(
+            'unsupported model file version {}'.format(header['version']))
+    return header, len(MAGIC) + 8 + size
+
+
+def load(filename_or_handle, mmap=False):
+    '''Load a network saved in the array-native format.
+
+    Parameters
+    ----------
+    filename_or_handle : str or file handle
+        Load the network from this file. If ``mmap`` is True, this must be a
+        filename.
+    mmap : bool, optional
+        If True, map parameter arrays directly from the file rather than
+        reading them into memory. Pages are mapped copy-on-write, so updating
+        parameters (e.g., by training) does not modify the file. Defaults to
+        False.
+
+    Returns
+    -------
+    network : :class:`theanets.graph.Network`
+        The loaded network.
+    '''
+    if isinstance(filename_or_handle, util.basestring):
+        with open(filename_or_handle, 'rb') as handle:
+            header, base = _read_header(handle)
+            if mmap:
+                data = np.memmap(filename_or_handle, dtype=np.uint8, mode='c')
+            else:
+                data = np.fromfile(handle, dtype=np.uint8)
+                base = 0
+    elif mmap:
+        raise util.ConfigurationError('can only memory-map from a filename')
+    else:
+        header, _ = _read_header(filename_or_handle)
+        data = _read_params(filename_or_handle, header)
+        base = 0
+
+    values = {}
+    for meta in header['params']:
+        dtype = np.dtype(meta['dtype'])
+        start = base + meta['offset']
+        end = start + dtype.itemsize * int(np.prod(meta['shape']))
+        values[meta['name']] = data[start:end].view(dtype).reshape(meta['shape'])
+
+    module, name = header['model'].rsplit('.', 1)
+    model = getattr(importlib.import_module(module), name)
+    # like unpickling, create the network without calling its constructor,
+    # and then restore its layers and losses.
+    network = model.__new__(model)
+    network.__setstate__(([], []))
+    for spec in header['layers']:
+        network.add_layer(layer=spec)
+    # layer parameters are created directly from the stored arrays, rather
+    # than being randomly initialized and then overwritten.
+    presets = dict(values)
+    for layer in network.layers:
+        layer.bind(network, initialize=presets)
+    for spec in header['losses']:
+        if isinstance(spec['target'], dict):
+            spec['target'] = network.inputs[spec['target']['input']]
+        network.add_loss(spec)
+
+    # remaining values belong to parameters not created by layers (e.g., those
+    # of parametric activation functions).
+    params = {p.name: p for p in network.params}
+    for name, value in presets.items():
+        if name not in params:
+            raise util.ConfigurationError(
+                'model file parameter "{}" not found in network'.format(name))
+        params[name].set_value(value, borrow=True)
+
+    return network
+
+
+def _read_params(handle, header):
+    '''Read the parameter bytes that follow the header into a writable array.
+
+    Reading directly into a preallocated array, rather than creating an array
+    from the bytes returned by ``read()`` (which is read-only), avoids copying
+    each parameter again after loading.
+    '''
+    size = 0
+    for meta in header['params']:
+        itemsize = np.dtype(meta['dtype']).itemsize
+        size = max(size, meta['offset'] + itemsize * int(np.prod(meta['shape'])))
+    data = np.empty(size, np.uint8)
+    view = memoryview(data)
+    filled = 0
+    while filled < size:
+        count = handle.readinto(view[filled:])
+        if not count:
+            raise util.ConfigurationError('model file is truncated')
+        filled += count
+    return data
@@ -7,15 +7,21 @@ to be pretty good for training neural networks; these are provided by
 ``downhill``. The other methods here --- :class:`SampleTrainer`,
 :class:`SupervisedPretrainer`, and :class:`UnsupervisedPretrainer` --- are more
 specific to neural networks, often taking advantage of the layered structure of
-many common network architectures.
+many common network architectures. The :class:`DataParallelTrainer` uses the
+optimizers from ``downhill``, but shares the computation of each gradient
+among several processes, while the :class:`HogwildTrainer` runs several SGD
+processes that update shared parameters asynchronously.
 '''
 
 import climate
 import downhill
-import itertools
+import multiprocessing
 import numpy as np
+import theano
+import theano.tensor as TT
 
 from . import layers
+from . import util
 
 logging = climate.get_logger(__name__)
 
@@ -67,28 +73,628 @@ class DownhillTrainer(object):
             yield monitors
 
 
+def _fork_context():
+    '''Get a multiprocessing context that forks worker processes.'''
+    if hasattr(multiprocessing, 'get_context'):
+        return multiprocessing.get_context('fork')
+    return multiprocessing
+
+
+def _shared_array(shape, dtype):
+    '''Allocate an array in memory that is shared with forked processes.'''
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    buf = multiprocessing.RawArray('b', max(1, size))
+    return np.frombuffer(buf, dtype, int(np.prod(shape))).reshape(shape)
+
+
+def _monitor_values(names):
+    '''Create shared scalars for holding the values of monitors.'''
+    return [theano.shared(np.asarray(0, util.FLOAT), name=name)
+            for name in names]
+
+
+def _store_monitors(variables, values):
+    '''Store computed monitor values in their shared scalars.'''
+    for var, value in zip(variables, values):
+        var.set_value(np.asarray(value, util.FLOAT))
+
+
+def _feed(name, dataset, compute):
+    '''Create a ``downhill`` dataset that passes batches to a function.
+
+    Each time ``downhill`` asks for a mini-batch, the next batch from the
+    dataset is passed to the function, which stores what it computes in shared
+    variables; the optimizer itself gets an empty batch.
+    '''
+    batches = [iter(())]
+
+    def next_batch():
+        try:
+            batch = next(batches[0])
+        except StopIteration:
+            batches[0] = iter(dataset)
+            batch = next(batches[0])
+        compute(batch)
+        return ()
+
+    return downhill.Dataset(
+        next_batch, name=name, iteration_size=dataset.iteration_size)
+
+
+class _Replicas(object):
+    '''Compute gradients for shards of each batch on forked processes.
+
+    Worker processes are forked from the calling process, so each one holds a
+    replica of the network and its compiled functions. Parameter values are
+    sent to the workers, and gradients are collected from them, through blocks
+    of shared memory; only the data for each shard is sent through a pipe. The
+    parameters of each replica are views of the shared block of parameter
+    values, so workers read the current values in place.
+
+    Parameters
+    ----------
+    network : :class:`theanets.graph.Network`
+        The network to compute gradients for.
+    monitors : list of theano expressions
+        Expressions to compute for each shard. The first one is differentiated
+        with respect to the parameters of the network.
+    updates : list of update pairs
+        Updates to apply when computing gradients in the calling process.
+    count : int
+        Number of processes to compute with, including the calling process.
+
+    Attributes
+    ----------
+    grads : list of ndarray
+        Arrays holding the averaged gradient of each parameter, as computed by
+        the most recent call to :func:`gradients`.
+    '''
+
+    def __init__(self, network, monitors, updates, count):
+        self.params = network.params
+        self.count = count
+        self._num_monitors = len(monitors)
+        grads = TT.grad(monitors[0], self.params)
+        self.f_grad = theano.function(
+            network.variables, monitors + grads, updates=updates)
+        self.f_eval = theano.function(network.variables, monitors)
+
+        self._shapes = [p.get_value(borrow=True).shape for p in self.params]
+        sizes = [int(np.prod(s)) for s in self._shapes]
+        self._offsets = np.cumsum([0] + sizes)
+        dtype = np.dtype(util.FLOAT)
+
+        size = int(self._offsets[-1])
+        self._values = _shared_array(size, dtype)
+        self._grads = [_shared_array(size, dtype) for _ in range(count)]
+        self._grad = np.zeros(size, dtype)
+        self.grads = list(self._unflatten(self._grad))
+        self._conns = []
+        self._workers = []
+        ctx = _fork_context()
+        for i in range(1, count):
+            conn, child = ctx.Pipe()
+            worker = ctx.Process(target=self._serve, args=(i, child))
+            worker.daemon = True
+            worker.start()
+            self._conns.append(conn)
+            self._workers.append(worker)
+
+    def _unflatten(self, flat):
+        for i, shape in enumerate(self._shapes):
+            yield flat[self._offsets[i]:self._offsets[i+1]].reshape(shape)
+
+    def _store(self, flat, arrays, weight=1):
+        for i, value in enumerate(arrays):
+            np.multiply(np.ravel(value), weight,
+                        out=flat[self._offsets[i]:self._offsets[i+1]])
+
+    def _serve(self, index, conn):
+        '''Compute shards sent by the calling process, until told to stop.'''
+        # read parameters in place from the block of shared values.
+        for param, value in zip(self.params, self._unflatten(self._values)):
+            param.set_value(value, borrow=True)
+        while True:
+            message = conn.recv()
+            if message is None:
+                return
+            kind, shard, weight = message
+            try:
+                if kind == 'grad':
+                    values = self.f_grad(*shard)
+                    self._store(self._grads[index], values[self._num_monitors:], weight)
+                    values = values[:self._num_monitors]
+                else:
+                    values = self.f_eval(*shard)
+                conn.send((values, None))
+            except Exception as err:
+                conn.send((None, err))
+
+    def _shards(self, batch):
+        n = batch[0].shape[0]
+        bounds = np.linspace(0, n, self.count + 1).astype(int)
+        return [(b - a, [x[a:b] for x in batch])
+                for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    def _compute(self, kind, batch):
+        shards = self._shards(batch)
+        weights = np.array([n for n, _ in shards], float)
+        weights /= weights.sum()
+        if len(shards) > 1:
+            self._store(self._values, (p.get_value(borrow=True) for p in self.params))
+        for conn, (_, shard), weight in zip(self._conns, shards[1:], weights[1:]):
+            conn.send((kind, shard, weight))
+        if kind == 'grad':
+            values = self.f_grad(*shards[0][1])
+            self._store(self._grads[0], values[self._num_monitors:], weights[0])
+            values = values[:self._num_monitors]
+        else:
+            values = self.f_eval(*shards[0][1])
+        results = [values]
+        for conn, _ in zip(self._conns, shards[1:]):
+            values, err = conn.recv()
+            if err is not None:
+                raise err
+            results.append(values)
+        return np.average(results, axis=0, weights=weights), len(shards)
+
+    def evaluate(self, batch):
+        '''Compute monitor values for a batch.'''
+        return self._compute('eval', batch)[0]
+
+    def gradients(self, batch):
+        '''Compute monitor values and averaged gradients for a batch.
+
+        Each process scales the gradient for its shard by the fraction of the
+        batch in the shard, so the averaged gradient is just their sum. It is
+        stored in :attr:`grads`.
+        '''
+        monitors, count = self._compute('grad', batch)
+        self._grad[:] = self._grads[0]
+        for grad in self._grads[1:count]:
+            self._grad += grad
+        return monitors
+
+    def close(self):
+        '''Stop the worker processes.'''
+        for conn in self._conns:
+            conn.send(None)
+        for worker in self._workers:
+            worker.join(1)
+            if worker.is_alive():
+                worker.terminate()
+        self._conns = []
+        self._workers = []
+
+
+class DataParallelTrainer(object):
+    '''Train a model by sharing each gradient computation among processes.
+
+    This trainer forks a number of worker processes, each of which holds a
+    replica of the network being trained. Each batch of training data is split
+    into shards along its first axis, one shard per process; each process
+    computes the gradient of the loss for its shard, and the gradients are
+    averaged (weighted by shard size) through shared memory. The averaged
+    gradient is then used by an optimizer from ``downhill`` to update the
+    parameters of the network in the calling process.
+
+    Because losses are means over the examples in a batch, the averaged
+    gradient is the gradient for the whole batch, so training proceeds as it
+    would with a single process, only faster for large batches. The number of
+    processes is given by the ``workers`` keyword argument to
+    :func:`itertrain`, and defaults to the number of CPUs.
+
+    Updates that are computed along with the loss (e.g., for batch
+    normalization statistics) are only applied for the shard computed by the
+    calling process.
+    '''
+
+    def __init__(self, algo, network):
+        self.algo = algo
+        self.network = network
+
+    def itertrain(self, train, valid=None, **kwargs):
+        '''Train a model using a training and validation set.
+
+        This method yields a series of monitor values to the caller. After every
+        iteration, a pair of monitor dictionaries is generated: one evaluated on
+        the training dataset, and another evaluated on the validation dataset.
+        The validation monitors might not be updated during every training
+        iteration; in this case, the most recent validation monitors will be
+        yielded along with the training monitors.
+
+        Parameters
+        ----------
+        train : :class:`Dataset <theanets.dataset.Dataset>`
+            A set of training data for computing updates to model parameters.
+        valid : :class:`Dataset <theanets.dataset.Dataset>`
+            A set of validation data for computing monitor values and
+            determining when the loss has stopped improving.
+
+        Yields
+        ------
+        training : dict
+            A dictionary mapping monitor names to values, evaluated on the
+            training dataset.
+        validation : dict
+            A dictionary containing monitor values evaluated on the validation
+            dataset.
+        '''
+        workers = kwargs.get('workers') or multiprocessing.cpu_count()
+        params = self.network.params
+        loss = self.network.loss(**kwargs)
+        monitors = self.network.monitors(**kwargs)
+        replicas = _Replicas(
+            self.network,
+            [loss] + [expr for _, expr in monitors],
+            self.network.updates(**kwargs),
+            workers)
+        logging.info('computing gradients with %d processes', workers)
+
+        # the replicas write the averaged gradients in place, and we store
+        # their monitor values for each batch in shared variables.
+        grads = [theano.shared(g, name='grad_' + p.name, borrow=True)
+                 for p, g in zip(params, replicas.grads)]
+        values = _monitor_values(['loss'] + [name for name, _ in monitors])
+
+        # the value of this loss is the one computed by the replicas, and its
+        # gradient with respect to each parameter is the averaged gradient.
+        surrogate = values[0] + sum(
+            ((p - theano.gradient.zero_grad(p)) * g).sum()
+            for p, g in zip(params, grads))
+
+        def compute(batch):
+            _store_monitors(values, replicas.gradients(batch))
+
+        def evaluate(batch):
+            _store_monitors(values, replicas.evaluate(batch))
+
+        opt = downhill.build(
+            algo=self.algo,
+            loss=surrogate,
+            params=params,
+            inputs=[],
+            monitors=[(v.name, v) for v in values[1:]],
+            monitor_gradients=kwargs.get('monitor_gradients', False))
+        try:
+            for monitors in opt.iterate(
+                    _feed('train', train, compute),
+                    valid=_feed('valid', train if valid is None else valid,
+                                evaluate),
+                    **kwargs):
+                yield monitors
+        finally:
+            replicas.close()
+
+
+class HogwildTrainer(object):
+    '''Train a model using lock-free asynchronous SGD in several processes.
+
+    This trainer moves the parameter values of the network being trained into
+    shared memory and then forks a number of worker processes. Batches of
+    training data are handed out to the workers as they become free; each
+    worker computes the gradient of the loss for its batch and applies an SGD
+    update directly to the shared parameter values, without any locking, so
+    workers might occasionally overwrite one another's updates [Niu11]_.
+
+    This works best when each update touches only a small part of the
+    parameters, for instance in a model with sparse inputs: when momentum is
+    disabled, only the rows of each weight matrix that have a nonzero gradient
+    are updated. The number of processes is given by the ``workers`` keyword
+    argument to :func:`itertrain`, and defaults to the number of CPUs.
+
+    After each pass over the training data, the calling process waits until
+    every worker has applied all of its batches before computing the training
+    monitors, so validation always sees the parameters after all of the
+    updates from the pass. If a worker process dies, training stops with a
+    ``RuntimeError`` rather than waiting for it. Updates that are computed
+    along with the loss (e.g., for batch normalization statistics) are only
+    applied within each worker process.
+
+    References
+    ----------
+    .. [Niu11] F. Niu, B. Recht, C. Ré, & S. J. Wright (2011). "Hogwild!: A
+       Lock-Free Approach to Parallelizing Stochastic Gradient Descent."
+       http://arxiv.org/abs/1106.5730
+    '''
+
+    def __init__(self, network):
+        self.network = network
+
+    def itertrain(self, train, valid=None, **kwargs):
+        '''Train a model using a training and validation set.
+
+        This method yields a series of monitor values to the caller. After every
+        iteration, a pair of monitor dictionaries is generated: one evaluated on
+        the training dataset, and another evaluated on the validation dataset.
+        The validation monitors might not be updated during every training
+        iteration; in this case, the most recent validation monitors will be
+        yielded along with the training monitors.
+
+        Parameters
+        ----------
+        train : :class:`Dataset <theanets.dataset.Dataset>`
+            A set of training data for computing updates to model parameters.
+        valid : :class:`Dataset <theanets.dataset.Dataset>`
+            A set of validation data for computing monitor values and
+            determining when the loss has stopped improving.
+
+        Yields
+        ------
+        training : dict
+            A dictionary mapping monitor names to values, evaluated on the
+            training dataset.
+        validation : dict
+            A dictionary containing monitor values evaluated on the validation
+            dataset.
+        '''
+        workers = kwargs.get('workers') or multiprocessing.cpu_count()
+        learning_rate = float(kwargs.get('learning_rate', 1e-4))
+        momentum = kwargs.get('momentum', 0)
+        max_gradient_elem = kwargs.get('max_gradient_elem', 0)
+        max_gradient_norm = kwargs.get('max_gradient_norm', 0)
+        params = self.network.params
+        loss = self.network.loss(**kwargs)
+        monitors = self.network.monitors(**kwargs)
+        outputs = [loss] + [expr for _, expr in monitors]
+        f_grad = theano.function(
+            self.network.variables,
+            outputs + TT.grad(loss, params),
+            updates=self.network.updates(**kwargs))
+        f_eval = theano.function(self.network.variables, outputs)
+
+        def update(values, grads):
+            if max_gradient_elem > 0:
+                limit = max_gradient_elem
+                grads = [np.clip(g, -limit, limit) for g in grads]
+            elif max_gradient_norm > 0:
+                limit = max_gradient_norm
+                grads = [g * min(1, limit / (np.sqrt((g * g).sum()) or 1))
+                         for g in grads]
+            for i, (value, grad) in enumerate(zip(values, grads)):
+                if velocities:
+                    velocities[i] *= momentum
+                    velocities[i] -= learning_rate * grad
+                    value += velocities[i]
+                    continue
+                # only touch the rows of the shared values that change.
+                rows = slice(None)
+                if grad.ndim > 1:
+                    rows = np.flatnonzero(grad.reshape((len(grad), -1)).any(axis=1))
+                    if len(rows) == len(grad):
+                        rows = slice(None)
+                value[rows] -= learning_rate * grad[rows]
+
+        def serve():
+            values = [p.get_value(borrow=True) for p in params]
+            sums, seen, error = np.zeros(len(outputs)), 0, None
+            while True:
+                kind, batch = tasks.get()
+                if kind == 'stop':
+                    return
+                if kind == 'sync':
+                    # report once all of our batches have been applied, and
+                    # then wait until the calling process has heard from every
+                    # worker, so that no worker takes two sync messages.
+                    results.put((sums.copy(), seen, error))
+                    sums[:], seen, error = 0, 0, None
+                    resume.acquire()
+                    continue
+                try:
+                    out = f_grad(*batch)
+                    update(values, out[len(outputs):])
+                    sums += out[:len(outputs)]
+                    seen += 1
+                except Exception as err:
+                    error = error or err
+
+        def check():
+            for proc in procs:
+                if not proc.is_alive():
+                    raise RuntimeError(
+                        'hogwild worker {} exited with code {}'.format(
+                            proc.pid, proc.exitcode))
+
+        def put(task):
+            # a dead worker never takes another task, so do not wait forever.
+            while True:
+                try:
+                    return tasks.put(task, timeout=1)
+                except util.queue.Full:
+                    check()
+
+        def get():
+            while True:
+                try:
+                    return results.get(timeout=1)
+                except util.queue.Empty:
+                    check()
+
+        def step():
+            for batch in train:
+                put(('batch', batch))
+            for _ in procs:
+                put(('sync', None))
+            totals, count, errors = np.zeros(len(outputs)), 0, []
+            for _ in procs:
+                sums, n, err = get()
+                totals += sums
+                count += n
+                if err is not None:
+                    errors.append(err)
+            # all workers have finished their batches; let them continue.
+            for _ in procs:
+                resume.release()
+            if errors:
+                raise errors[0]
+            _store_monitors(values, totals / max(1, count))
+            for param, copy in zip(params, copies):
+                copy.set_value(param.get_value())
+            return ()
+
+        def evaluate(batch):
+            _store_monitors(values, f_eval(*batch))
+
+        # downhill takes care of validation, early stopping, and logging. Its
+        # "training step" is a whole pass over the training data by the
+        # workers, after which the monitor values and a copy of the
+        # parameters are stored in shared variables; the optimizer only
+        # keeps track of the best copy, and never changes it.
+        values = _monitor_values(['loss'] + [name for name, _ in monitors])
+        copies = [theano.shared(p.get_value(), name=p.name) for p in params]
+        opt = downhill.build(
+            algo='sgd',
+            loss=values[0] + 0 * sum(c.sum() for c in copies),
+            params=copies,
+            inputs=[],
+            monitors=[(v.name, v) for v in values[1:]])
+
+        # move parameter values into shared memory, and fork the workers.
+        for param in params:
+            value = param.get_value(borrow=True)
+            shared = _shared_array(value.shape, value.dtype)
+            shared[...] = value
+            param.set_value(shared, borrow=True)
+        velocities = []
+        if momentum:
+            velocities = [np.zeros_like(p.get_value(borrow=True)) for p in params]
+        ctx = _fork_context()
+        tasks = ctx.Queue(2 * workers)
+        results = ctx.Queue()
+        resume = ctx.Semaphore(0)
+        procs = [ctx.Process(target=serve) for _ in range(workers)]
+        for proc in procs:
+            proc.daemon = True
+            proc.start()
+        logging.info('training with %d hogwild processes', workers)
+
+        try:
+            for monitors in opt.iterate(
+                    downhill.Dataset(step, name='train', iteration_size=1),
+                    valid=_feed('valid', train if valid is None else valid,
+                                evaluate),
+                    **kwargs):
+                yield monitors
+            # like downhill, finish with the parameters that did best.
+            for param, copy in zip(params, copies):
+                param.set_value(copy.get_value())
+        finally:
+            try:
+                for _ in procs:
+                    put(('stop', None))
+            except RuntimeError:
+                pass  # a worker died; the live ones are terminated below.
+            for proc in procs:
+                proc.join(1)
+                if proc.is_alive():
+                    proc.terminate()
+            # give parameters private copies of their values again.
+            for param in params:
+                param.set_value(param.get_value())
+
+
+class _Reservoir(object):
+    '''A uniform random sample of items from a stream of batches.
+
+    Items are sampled using "Algorithm R" [Vit85]_, but each batch of items is
+    processed at once: the first items fill the pool, and after that the item
+    with (zero-based) index ``t`` in the stream replaces a uniformly chosen
+    slot in the pool with probability ``size / (t + 1)``.
+
+    Parameters
+    ----------
+    size : int
+        Maximum number of items to keep in the pool.
+    rng : ``numpy.random.RandomState``
+        Random number generator for choosing items.
+
+    References
+    ----------
+    .. [Vit85] J. S. Vitter (1985). "Random Sampling with a Reservoir." ACM
+       Transactions on Mathematical Software 11(1):37-57.
+    '''
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.seen = 0
+        self.filled = 0
+        self.pool = None
+
+    @property
+    def values(self):
+        '''An array containing the items in the pool.'''
+        return self.pool[:self.filled]
+
+    def add(self, items):
+        '''Offer a batch of items to the pool.
+
+        Parameters
+        ----------
+        items : ndarray
+            An array of items, one item per row.
+        '''
+        if self.pool is None:
+            self.pool = np.empty((self.size, ) + items.shape[1:], items.dtype)
+        k = min(len(items), self.size - self.filled)
+        self.pool[self.filled:self.filled + k] = items[:k]
+        self.filled += k
+        rest = items[k:]
+        if len(rest):
+            t = self.seen + k + np.arange(len(rest))
+            slots = (self.rng.random_sample(len(rest)) * (t + 1)).astype(int)
+            keep = slots < self.size
+            # if several items pick the same slot, the last one wins, just as
+            # if the items had been offered one at a time.
+            self.pool[slots[keep]] = rest[keep]
+        self.seen += len(items)
+
+
+def _normalized_sample(values, n, rng):
+    '''Select n unit-norm rows from an array of samples.
+
+    If there are more than n rows, a random subset is selected; if there are
+    fewer, the rows are padded with distorted random duplicates.
+    '''
+    def unit(x):
+        norms = np.sqrt((x * x).reshape((len(x), -1)).sum(axis=1))
+        norms[norms == 0] = 1
+        return x / norms.reshape((-1, ) + (1, ) * (x.ndim - 1))
+    pool = unit(values)
+    if len(pool) > n:
+        pool = pool[rng.permutation(len(pool))[:n]]
+    if len(pool) < n:
+        S = np.std(pool, axis=0)
+        dupes = pool[rng.randint(len(pool), size=n - len(pool))]
+        pool = np.concatenate([pool, unit(dupes + S * rng.randn(*dupes.shape))])
+    return pool.astype(values.dtype)
+
+
 class SampleTrainer(object):
-    '''This trainer replaces network weights with samples from the input.'''
+    '''This trainer replaces network weights with samples from the input.
+
+    The training data are read in a single pass. Along the way, a uniform
+    random sample of input examples (e.g., whole sequences for a recurrent
+    model) and of target rows is kept, one batch at a time, so the whole
+    dataset never needs to be in memory at once. Then:
+
+    - the weights of each hidden layer are set to normalized samples of the
+      rows of the layer's input, starting with the first hidden layer. The
+      inputs for deeper layers are computed by passing the sampled input
+      examples through the network (in chunks of ``batch_size`` examples),
+      after the weights of the layers below have been set; and
+    - the weights of the output layer are set to normalized samples of the
+      target rows, if their shape matches.
+    '''
 
     @staticmethod
     def reservoir(xs, n, rng):
         '''Select a random sample of n items from xs.'''
-        pool = []
-        for i, x in enumerate(xs):
-            if len(pool) < n:
-                pool.append(x / np.linalg.norm(x))
-                continue
-            j = rng.randint(i + 1)
-            if j < n:
-                pool[j] = x / np.linalg.norm(x)
-        # if the pool still has fewer than n items, pad with distorted random
-        # duplicates from the source data.
-        L = len(pool)
-        S = np.std(pool, axis=0)
-        while len(pool) < n:
-            x = pool[rng.randint(L)]
-            pool.append(x + S * rng.randn(*x.shape))
-        return np.array(pool, dtype=pool[0].dtype)
+        pool = _Reservoir(n, rng)
+        for x in xs:
+            pool.add(np.asarray(x)[None])
+        return _normalized_sample(pool.values, n, rng)
 
     def __init__(self, network):
         self.network = network
@@ -120,43 +726,72 @@ class SampleTrainer(object):
             A dictionary containing monitor values evaluated on the validation
             dataset.
         '''
-        ifci = itertools.chain.from_iterable
-
         def first(x):
             return x[0] if isinstance(x, (tuple, list)) else x
 
         def last(x):
             return x[-1] if isinstance(x, (tuple, list)) else x
 
-        odim = idim = None
-        for t in train:
-            idim = first(t).shape[-1]
-            odim = last(t).shape[-1]
+        def rows(x):
+            return x.reshape((-1, x.shape[-1]))
 
         rng = kwargs.get('rng')
         if rng is None or isinstance(rng, int):
             rng = np.random.RandomState(rng)
 
+        net = self.network
+        hidden = []
+        for layer in net.layers[1:-1]:
+            try:
+                size = layer.input_size
+            except util.ConfigurationError:
+                continue
+            for param in layer.params:
+                shape = param.get_value(borrow=True).shape
+                if len(shape) == 2 and shape[0] == size:
+                    hidden.append((layer, param, shape))
+
+        # read the training data once, sampling input examples (in their
+        # original shape, e.g. whole sequences) and target rows.
+        odim = None
+        inputs = _Reservoir(max([s[1] for _, _, s in hidden] + [1]), rng)
+        targets = None
+        for t in train:
+            inputs.add(first(t))
+            y = last(t)
+            if y.ndim < 2 or not np.issubdtype(y.dtype, np.floating):
+                continue
+            if targets is None:
+                odim = last(t).shape[-1]
+                targets = _Reservoir(max([
+                    s[0] for s in (p.get_value(borrow=True).shape
+                                   for p in net.layers[-1].params)
+                    if len(s) == 2 and s[1] == odim] + [1]), rng)
+            targets.add(rows(y))
+
         # set output (decoding) weights on the network.
-        samples = ifci(last(t) for t in train)
-        for param in self.network.layers[-1].params:
+        for param in net.layers[-1].params:
             shape = param.get_value(borrow=True).shape
-            if len(shape) == 2 and shape[1] == odim:
-                arr = np.vstack(SampleTrainer.reservoir(samples, shape[0], rng))
+            if odim is not None and len(shape) == 2 and shape[1] == odim:
+                arr = _normalized_sample(targets.values, shape[0], rng)
                 logging.info('setting %s: %s', param.name, shape)
-                param.set_value(arr / np.sqrt((arr * arr).sum(axis=1))[:, None])
-
-        # set input (encoding) weights on the network.
-        samples = ifci(first(t) for t in train)
-        for layer in self.network.layers:
-            for param in layer.params:
-                shape = param.get_value(borrow=True).shape
-                if len(shape) == 2 and shape[0] == idim:
-                    arr = np.vstack(SampleTrainer.reservoir(samples, shape[1], rng)).T
-                    logging.info('setting %s: %s', param.name, shape)
-                    param.set_value(arr / np.sqrt((arr * arr).sum(axis=0)))
-                    samples = ifci(self.network.feed_forward(
-                        first(t))[i-1] for t in train)
+                param.set_value(arr.astype(param.dtype))
+
+        # set input (encoding) weights on the network, from the bottom up.
+        batch_size = kwargs.get('batch_size', 32)
+        given = set(l.output_name for l in net.layers
+                    if isinstance(l, layers.Input))
+        for layer, param, shape in hidden:
+            samples = inputs.values
+            if layer.input_name not in given:
+                # compute activations for whole examples, and only flatten
+                # them into rows afterwards.
+                samples = net.feed_forward(
+                    samples, outputs=layer.input_name,
+                    batch_size=batch_size)[layer.input_name]
+            arr = _normalized_sample(rows(samples), shape[1], rng).T
+            logging.info('setting %s: %s', param.name, shape)
+            param.set_value(arr.astype(param.dtype))
 
         yield dict(loss=0), dict(loss=0)
 
@@ -6,12 +6,18 @@ import fnmatch
 import numpy as np
 import theano
 import theano.tensor as TT
+import threading
 
 try:
     basestring = basestring
 except NameError:
     basestring = str
 
+try:
+    import queue
+except ImportError:  # python2
+    import Queue as queue
+
 FLOAT = theano.config.floatX
 
 FLOAT_CONTAINERS = (TT.scalar, TT.vector, TT.matrix, TT.tensor3, TT.tensor4)
@@ -188,3 +194,56 @@ def params_matching(layers, patterns):
                 if fnmatch.fnmatch(name, pattern):
                     yield name, param
                     break
+
+
+def prefetch(iterable, size=1):
+    '''Iterate over a sequence, fetching items ahead on a background thread.
+
+    Parameters
+    ----------
+    iterable : iterable
+        A sequence (e.g., a list or a generator) of items to iterate over.
+    size : int, optional
+        Fetch at most this many items ahead of the consumer. Defaults to 1.
+
+    Yields
+    ------
+    item :
+        Items from the sequence, in order. Any exception raised while fetching
+        items from the sequence is re-raised in the consuming thread.
+    '''
+    items = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fill():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as err:
+            put((done, err))
+
+    thread = threading.Thread(target=fill)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, err = items.get()
+            if err is not None:
+                raise err
+            if item is done:
+                break
+            yield item
+    finally:
+        stop.set()